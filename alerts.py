@@ -0,0 +1,70 @@
+"""
+Price alerts matched in memory: "notify me when collection X is listed at or under N TON".
+
+    python alerts.py 100000    # matching throughput with 100k random alerts
+"""
+import bisect
+import random
+import sys
+import time
+from typing import Dict, Iterable, List, Tuple
+
+class AlertIndex:
+    """
+    Inverted index of price alerts keyed by gift collection. Each collection keeps its thresholds
+    in ascending order, so the alerts an ad triggers are found with one dict lookup and one binary
+    search, and are the tail of the list from there.
+    """
+    
+    def __init__(self):
+        # collection -> thresholds ascending, and the (user_id, threshold) of each alert in the same order
+        self._thresholds: Dict[str, List[float]] = {}
+        self._subscribers: Dict[str, List[Tuple[int, float]]] = {}
+        self._size = 0
+    
+    def load(self, alerts: Iterable[Tuple[int, str, float]]):
+        """Replace the index with (user_id, collection, max_price) rows, sorting each collection once"""
+        by_collection: Dict[str, List[Tuple[float, int]]] = {}
+        for user_id, collection, max_price in alerts:
+            by_collection.setdefault(collection, []).append((max_price, user_id))
+        
+        self._thresholds, self._subscribers, self._size = {}, {}, 0
+        for collection, entries in by_collection.items():
+            entries.sort()
+            self._thresholds[collection] = [max_price for max_price, _ in entries]
+            self._subscribers[collection] = [(user_id, max_price) for max_price, user_id in entries]
+            self._size += len(entries)
+    
+    def match(self, collection: str, price: float) -> List[Tuple[int, float]]:
+        """(user_id, max_price) of every alert on the collection whose threshold is at least the price"""
+        thresholds = self._thresholds.get(collection)
+        if not thresholds:
+            return []
+        return self._subscribers[collection][bisect.bisect_left(thresholds, price):]
+    
+    def __len__(self) -> int:
+        return self._size
+
+def benchmark(subscriptions: int, collections: int = 500, ads: int = 100000):
+    """Time loading and matching random alerts; returns a printable summary"""
+    rng = random.Random(1)
+    names = [f"collection{i}" for i in range(collections)]
+    alerts = [(rng.randrange(10 ** 7), rng.choice(names), float(rng.randint(1, 500))) for _ in range(subscriptions)]
+    listings = [(rng.choice(names), float(rng.randint(1, 500))) for _ in range(ads)]
+    
+    index = AlertIndex()
+    start = time.perf_counter()
+    index.load(alerts)
+    loaded = time.perf_counter() - start
+    
+    matched = 0
+    start = time.perf_counter()
+    for collection, price in listings:
+        matched += len(index.match(collection, price))
+    elapsed = time.perf_counter() - start
+    return (f"{subscriptions} alerts over {collections} collections loaded in {loaded * 1000:.0f}ms; "
+            f"{ads} ads matched in {elapsed * 1000:.0f}ms ({ads / elapsed:.0f} ads/s, "
+            f"{elapsed / ads * 1e6:.1f}us per ad, {matched / ads:.0f} alerts per ad)")
+
+if __name__ == '__main__':
+    print(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
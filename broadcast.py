@@ -0,0 +1,158 @@
+"""
+Throttled, resumable broadcasts.
+
+    python broadcast.py 2000    # throughput and resends after an interrupted run, against a fake Bot API
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Optional, Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+from database import Database
+from load_guard import LoadGuard
+from throttling import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+class BroadcastRunner:
+    """Deliver a broadcast to all active users with bounded concurrency and resumable progress"""
+    
+    def __init__(self, bot: Bot, db: Database, limiter: RateLimiter, concurrency: int = 10,
+                 batch_size: int = 50, max_retries: int = 3,
+                 on_progress: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+                 progress_interval: float = 5.0, load_guard: Optional[LoadGuard] = None):
+        self.bot = bot
+        self.db = db
+        self.limiter = limiter
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.load_guard = load_guard
+    
+    async def deliver(self, broadcast: Dict[str, Any], user_id: int):
+        """Send to one user and record the result right away, so a restart resends to nobody who got it"""
+        status = await self.send(broadcast, user_id)
+        await self.db.record_broadcast_delivery(broadcast['id'], user_id, status)
+    
+    async def send(self, broadcast: Dict[str, Any], user_id: int) -> str:
+        """Copy the broadcast message to one user and return the delivery status"""
+        async with self.semaphore:
+            for _ in range(self.max_retries):
+                await self.limiter.acquire()
+                try:
+                    await self.bot.copy_message(
+                        chat_id=user_id,
+                        from_chat_id=broadcast['source_chat_id'],
+                        message_id=broadcast['source_message_id']
+                    )
+                    return 'sent'
+                except TelegramRetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                except TelegramForbiddenError:
+                    return 'blocked'
+                except Exception as e:
+                    logger.error("Broadcast %s failed for user %s: %s", broadcast['id'], user_id, e)
+                    return 'failed'
+            return 'failed'
+    
+    async def run(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        """Run (or resume) a broadcast until every active user has been processed"""
+        last_progress = 0.0
+        while True:
+            # Broadcasts are low priority: pause between batches while the bot is overloaded
+            if self.load_guard:
+                await self.load_guard.wait_until_idle()
+            
+            broadcast = await self.db.get_broadcast(broadcast_id)
+            if not broadcast or broadcast['status'] != 'running':
+                return broadcast
+            
+            user_ids = await self.db.get_active_user_ids(broadcast['last_user_id'], self.batch_size)
+            if not user_ids:
+                await self.db.finish_broadcast(broadcast_id, 'done')
+                broadcast = await self.db.get_broadcast(broadcast_id)
+                if self.on_progress:
+                    await self.on_progress(broadcast)
+                return broadcast
+            
+            # The cursor moves only after a whole batch, so a batch interrupted by a restart is read
+            # again; its recipients with a recorded result are skipped
+            delivered = set(await self.db.get_delivered_user_ids(broadcast_id, user_ids))
+            pending = [user_id for user_id in user_ids if user_id not in delivered]
+            await asyncio.gather(*(self.deliver(broadcast, user_id) for user_id in pending))
+            await self.db.advance_broadcast_cursor(broadcast_id, user_ids[-1])
+            
+            if self.on_progress and time.monotonic() - last_progress >= self.progress_interval:
+                last_progress = time.monotonic()
+                await self.on_progress(await self.db.get_broadcast(broadcast_id))
+
+async def _benchmark(users: int, latency: float) -> str:
+    from aiogram.types import MessageId
+    
+    sends = Counter()
+    
+    class FakeApi:
+        """Session middleware answering copyMessage after latency seconds; every 50th user has blocked the bot"""
+        
+        async def __call__(self, make_request, bot, method):
+            sends[method.chat_id] += 1
+            await asyncio.sleep(latency)
+            if method.chat_id % 50 == 0:
+                raise TelegramForbiddenError(method=method, message='Forbidden: bot was blocked by the user')
+            return MessageId(message_id=1)
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'broadcast.db')
+        db = Database(path)
+        await db.init_db()
+        with sqlite3.connect(path) as connection:
+            connection.executemany("INSERT INTO users (user_id, first_name) VALUES (?, 'User')",
+                                   ((user_id,) for user_id in range(1, users + 1)))
+        
+        bot = Bot('123456:benchmark')
+        bot.session.middleware(FakeApi())
+        runner = BroadcastRunner(bot, db, RateLimiter(10 ** 6, burst=10 ** 6))
+        
+        async def start() -> int:
+            with sqlite3.connect(path) as connection:
+                connection.execute("UPDATE users SET is_active = 1")
+            broadcast_id = await db.create_broadcast(0, 0, 1)
+            await db.start_broadcast(broadcast_id, users, 0, 0)
+            sends.clear()
+            return broadcast_id
+        
+        began = time.perf_counter()
+        await runner.run(await start())
+        elapsed = time.perf_counter() - began
+        
+        # Stop a second broadcast halfway, as a restart would, and resume it
+        broadcast_id = await start()
+        try:
+            await asyncio.wait_for(runner.run(broadcast_id), elapsed / 2)
+        except asyncio.TimeoutError:
+            pass
+        interrupted = sum(sends.values())
+        await runner.run(broadcast_id)
+        resent = sum(count - 1 for count in sends.values())
+        broadcast = await db.get_broadcast(broadcast_id)
+        await bot.session.close()
+    return (f"{users} users at {latency * 1000:g}ms per send: {elapsed:.2f}s ({users / elapsed:.0f} sends/s, "
+            f"{broadcast['sent_count']} sent, {broadcast['blocked_count']} blocked); "
+            f"interrupted after {interrupted} sends and resumed with {resent} resent")
+
+def benchmark(users: int, latency: float = 0.02) -> str:
+    """Run a broadcast to users fake recipients without a rate limit, then interrupt and resume another"""
+    return asyncio.run(_benchmark(users, latency))
+
+if __name__ == '__main__':
+    print(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
@@ -1,15 +1,87 @@
+"""
+SQLite data access for the bot.
+
+    python database.py payments 200    # 200 paid drafts, each payment delivered 8 times concurrently
+    python database.py search 300000   # /find latency over 300k ads
+    python database.py users 1000000   # admin user search latency over 1M users
+"""
 import aiosqlite
+import asyncio
+import json
+import logging
+import math
 import os
+from contextlib import asynccontextmanager
 from datetime import datetime
+from itertools import groupby
 from typing import Optional, List, Dict, Any
 
+import metrics
+from links import parse_link
+
+logger = logging.getLogger(__name__)
+
+# Arabic yeh and kaf are folded into their Persian forms in the user search index and in queries
+NAME_FOLDING = str.maketrans('يك', 'یک')
+
+def _folded(column: str) -> str:
+    """SQL expression applying NAME_FOLDING to a column"""
+    return f"replace(replace({column}, 'ي', 'ی'), 'ك', 'ک')"
+
+# Market rollup price histograms: bucket 0 counts prices under MARKET_BUCKET_FLOOR TON and bucket i those in
+# [floor * ratio**(i-1), floor * ratio**i), the last one also everything above, so medians are within ~9%
+MARKET_BUCKET_FLOOR = 0.01
+MARKET_BUCKET_RATIO = 2 ** 0.25
+MARKET_BUCKETS = 112
+EMPTY_MARKET_HISTOGRAM = json.dumps([0] * MARKET_BUCKETS, separators=(',', ':'))
+
+def market_bucket(price: float) -> int:
+    """Histogram bucket of a price"""
+    if price < MARKET_BUCKET_FLOOR:
+        return 0
+    return min(MARKET_BUCKETS - 1, 1 + int(math.log(price / MARKET_BUCKET_FLOOR, MARKET_BUCKET_RATIO)))
+
+def market_median(histogram: List[int], low: float, high: float) -> float:
+    """Median of the prices counted in a histogram, as the midpoint of its bucket clamped to the known min and max"""
+    middle = (sum(histogram) + 1) // 2
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        seen += count
+        if seen >= middle:
+            break
+    value = MARKET_BUCKET_FLOOR * MARKET_BUCKET_RATIO ** (bucket - 0.5) if bucket else 0.0
+    return min(max(value, low), high)
+
+def _market_columns(prices: List[float]) -> tuple:
+    """count, sum, min, max and histogram of a list of prices, as stored in market_daily"""
+    histogram = [0] * MARKET_BUCKETS
+    for price in prices:
+        histogram[market_bucket(price)] += 1
+    return (
+        len(prices), sum(prices), min(prices, default=None), max(prices, default=None),
+        json.dumps(histogram, separators=(',', ':'))
+    )
+
+@metrics.instrument_methods(metrics.db_method_seconds)
 class Database:
     def __init__(self, db_path: str):
         self.db_path = db_path
     
+    @asynccontextmanager
+    async def _connect(self):
+        """Open a connection, counting its statements against the update being handled"""
+        async with aiosqlite.connect(self.db_path) as db:
+            stats = metrics.update_stats.get()
+            if stats is not None:
+                await db.set_trace_callback(stats.count_statement)
+            yield db
+    
     async def init_db(self):
         """Initialize database tables"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
+            # WAL lets readers run while another process writes
+            await db.execute("PRAGMA journal_mode=WAL")
+            
             # Users table
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -79,6 +151,452 @@ class Database:
             except:
                 pass  # Column already exists
             
+            # Add digest_queued column if it doesn't exist
+            try:
+                await db.execute("ALTER TABLE ads ADD COLUMN digest_queued INTEGER DEFAULT 0")
+            except:
+                pass  # Column already exists
+            
+            # Digest posts share one channel message between several ads
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ads_channel_message_id ON ads (channel_message_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ads_digest_queued ON ads (digest_queued)")
+            
+            # Parsed link columns: kind (gift/channel/other), gift collection and number, canonical URL
+            for column in ("link_kind TEXT", "link_collection TEXT", "link_item INTEGER", "canonical_link TEXT"):
+                try:
+                    await db.execute(f"ALTER TABLE ads ADD COLUMN {column}")
+                except:
+                    pass  # Column already exists
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ads_canonical_link ON ads (canonical_link)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ads_link_collection ON ads (link_collection, link_item)")
+            await self._backfill_link_columns(db)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ads_user_id ON ads (user_id)")
+            # Listings buyers can see (approved and still for sale), by collection
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ads_listing ON ads (sold_status, status, link_collection)")
+            
+            # Price in TON as a number for range filters, sorting and aggregates; NULL if the text isn't one
+            try:
+                await db.execute("ALTER TABLE ads ADD COLUMN price_ton REAL")
+            except:
+                pass  # Column already exists
+            await self._backfill_price_ton(db)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ads_collection_price ON ads (link_collection, price_ton)")
+            # Listings by price across collections, also covering the overall price stats
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ads_listing_price ON ads (sold_status, status, price_ton)")
+            
+            # Full-text search over ads for admins; rowid is the ad ID, kept in sync by triggers
+            await db.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS ads_fts USING fts5(
+                    gift_link, canonical_link, description, username,
+                    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+                )
+            """)
+            await db.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_ads_fts_insert AFTER INSERT ON ads
+                BEGIN
+                    INSERT INTO ads_fts (rowid, gift_link, canonical_link, description, username)
+                    VALUES (NEW.id, NEW.gift_link, NEW.canonical_link, NEW.description,
+                            (SELECT username FROM users WHERE user_id = NEW.user_id));
+                END
+            """)
+            await db.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_ads_fts_update
+                AFTER UPDATE OF gift_link, canonical_link, description, user_id ON ads
+                BEGIN
+                    DELETE FROM ads_fts WHERE rowid = OLD.id;
+                    INSERT INTO ads_fts (rowid, gift_link, canonical_link, description, username)
+                    VALUES (NEW.id, NEW.gift_link, NEW.canonical_link, NEW.description,
+                            (SELECT username FROM users WHERE user_id = NEW.user_id));
+                END
+            """)
+            await db.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_ads_fts_delete AFTER DELETE ON ads
+                BEGIN
+                    DELETE FROM ads_fts WHERE rowid = OLD.id;
+                END
+            """)
+            # add_user is INSERT OR REPLACE, so a username change arrives as an insert
+            for event in ("INSERT", "UPDATE OF username"):
+                await db.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_users_fts_{event.split()[0].lower()}
+                    AFTER {event} ON users
+                    BEGIN
+                        UPDATE ads_fts SET username = NEW.username
+                        WHERE rowid IN (SELECT id FROM ads WHERE user_id = NEW.user_id)
+                        AND username IS NOT NEW.username;
+                    END
+                """)
+            cursor = await db.execute("SELECT EXISTS (SELECT 1 FROM ads) AND NOT EXISTS (SELECT 1 FROM ads_fts)")
+            if (await cursor.fetchone())[0]:
+                await self._rebuild_ads_search(db)
+            
+            # User search by username and name (prefix per word, case-folded); rowid is the user ID
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)")
+            await db.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+                    username, first_name, last_name,
+                    tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3 4 5 6'
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users (lower(username))")
+            user_search_row = f"""
+                DELETE FROM users_fts WHERE rowid = NEW.user_id;
+                INSERT INTO users_fts (rowid, username, first_name, last_name)
+                VALUES (NEW.user_id, NEW.username, {_folded('NEW.first_name')}, {_folded('NEW.last_name')});
+            """
+            # Replaced rows don't fire delete triggers, so inserts clear the previous entry themselves
+            await db.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_users_search_insert AFTER INSERT ON users
+                BEGIN {user_search_row} END
+            """)
+            await db.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_users_search_update
+                AFTER UPDATE OF username, first_name, last_name ON users
+                BEGIN {user_search_row} END
+            """)
+            await db.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_users_search_delete AFTER DELETE ON users
+                BEGIN
+                    DELETE FROM users_fts WHERE rowid = OLD.user_id;
+                END
+            """)
+            cursor = await db.execute("SELECT EXISTS (SELECT 1 FROM users) AND NOT EXISTS (SELECT 1 FROM users_fts)")
+            if (await cursor.fetchone())[0]:
+                await db.execute(f"""
+                    INSERT INTO users_fts (rowid, username, first_name, last_name)
+                    SELECT user_id, username, {_folded('first_name')}, {_folded('last_name')} FROM users
+                """)
+            
+            # Add is_active column if it doesn't exist (0 once the user blocks the bot)
+            try:
+                await db.execute("ALTER TABLE users ADD COLUMN is_active INTEGER DEFAULT 1")
+            except:
+                pass  # Column already exists
+            
+            # Broadcasts table
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    admin_id INTEGER,
+                    source_chat_id INTEGER NOT NULL,
+                    source_message_id INTEGER NOT NULL,
+                    progress_chat_id INTEGER,
+                    progress_message_id INTEGER,
+                    status TEXT DEFAULT 'draft',
+                    last_user_id INTEGER DEFAULT 0,
+                    total_count INTEGER DEFAULT 0,
+                    sent_count INTEGER DEFAULT 0,
+                    failed_count INTEGER DEFAULT 0,
+                    blocked_count INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            """)
+            
+            # Per-recipient broadcast progress, so a resumed broadcast never sends twice
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                    broadcast_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    PRIMARY KEY (broadcast_id, user_id)
+                ) WITHOUT ROWID
+            """)
+            
+            # Dead-letter table for Bot API calls that failed permanently
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS dead_letters (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    method TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    error TEXT,
+                    error_kind TEXT,
+                    context TEXT,
+                    status TEXT DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 1,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_dead_letters_status ON dead_letters (status, id)")
+            
+            # Ad drafts table: the invoice payload points here, so a paid draft survives restarts
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS ad_drafts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    gift_link TEXT NOT NULL,
+                    price TEXT NOT NULL,
+                    description TEXT DEFAULT 'توضیحات ندارد',
+                    channel_photo TEXT,
+                    language TEXT DEFAULT 'fa',
+                    status TEXT DEFAULT 'open',
+                    ad_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ad_drafts_user_status ON ad_drafts (user_id, status)")
+            
+            # One ad per payment charge, so redelivered payment updates can't create duplicates
+            cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_ads_payment_charge_id'")
+            if not await cursor.fetchone():
+                # Legacy redeliveries created extra ads for one charge; the first ad keeps the charge ID
+                cursor = await db.execute("""
+                    SELECT id, telegram_payment_charge_id FROM ads
+                    WHERE telegram_payment_charge_id IS NOT NULL AND id NOT IN (
+                        SELECT MIN(id) FROM ads WHERE telegram_payment_charge_id IS NOT NULL
+                        GROUP BY telegram_payment_charge_id
+                    )
+                """)
+                duplicates = await cursor.fetchall()
+                if duplicates:
+                    logger.warning(
+                        "Clearing the payment charge ID of %d ads that duplicate an earlier ad's charge: %s",
+                        len(duplicates), [tuple(row) for row in duplicates]
+                    )
+                    await db.executemany(
+                        "UPDATE ads SET telegram_payment_charge_id = NULL WHERE id = ?",
+                        [(row[0],) for row in duplicates]
+                    )
+                await db.execute("""
+                    CREATE UNIQUE INDEX idx_ads_payment_charge_id
+                    ON ads (telegram_payment_charge_id)
+                    WHERE telegram_payment_charge_id IS NOT NULL
+                """)
+            
+            # Append-only payments ledger (charge, refund, adjustment)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS payments_ledger (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    ad_id INTEGER,
+                    kind TEXT NOT NULL CHECK (kind IN ('charge', 'refund', 'adjustment')),
+                    amount INTEGER NOT NULL,
+                    telegram_payment_charge_id TEXT,
+                    note TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_payments_ledger_user ON payments_ledger (user_id, id)")
+            # A charge can be recorded and refunded only once
+            await db.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_ledger_charge
+                ON payments_ledger (telegram_payment_charge_id, kind)
+                WHERE kind != 'adjustment'
+            """)
+            
+            # Running balances per user; user_id 0 holds the global totals
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS ledger_balances (
+                    user_id INTEGER PRIMARY KEY,
+                    charged INTEGER DEFAULT 0,
+                    refunded INTEGER DEFAULT 0,
+                    adjusted INTEGER DEFAULT 0,
+                    balance INTEGER DEFAULT 0,
+                    entries INTEGER DEFAULT 0
+                )
+            """)
+            
+            # Balances are maintained on insert, for the user and the global row
+            for balance_user in ("NEW.user_id", "0"):
+                await db.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_ledger_balance_{'user' if balance_user != '0' else 'global'}
+                    AFTER INSERT ON payments_ledger
+                    BEGIN
+                        INSERT INTO ledger_balances (user_id, charged, refunded, adjusted, balance, entries)
+                        VALUES (
+                            {balance_user},
+                            CASE WHEN NEW.kind = 'charge' THEN NEW.amount ELSE 0 END,
+                            CASE WHEN NEW.kind = 'refund' THEN NEW.amount ELSE 0 END,
+                            CASE WHEN NEW.kind = 'adjustment' THEN NEW.amount ELSE 0 END,
+                            CASE WHEN NEW.kind = 'refund' THEN -NEW.amount ELSE NEW.amount END,
+                            1
+                        )
+                        ON CONFLICT (user_id) DO UPDATE SET
+                            charged = charged + excluded.charged,
+                            refunded = refunded + excluded.refunded,
+                            adjusted = adjusted + excluded.adjusted,
+                            balance = balance + excluded.balance,
+                            entries = entries + 1;
+                    END
+                """)
+            
+            await db.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_payments_ledger_no_update
+                BEFORE UPDATE ON payments_ledger
+                BEGIN
+                    SELECT RAISE(ABORT, 'payments_ledger is append-only');
+                END
+            """)
+            await db.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_payments_ledger_no_delete
+                BEFORE DELETE ON payments_ledger
+                BEGIN
+                    SELECT RAISE(ABORT, 'payments_ledger is append-only');
+                END
+            """)
+            
+            # Backfill the ledger from existing ads on first run
+            cursor = await db.execute("SELECT COUNT(*) FROM payments_ledger")
+            if (await cursor.fetchone())[0] == 0:
+                await db.execute("""
+                    INSERT OR IGNORE INTO payments_ledger (user_id, ad_id, kind, amount, telegram_payment_charge_id, created_at)
+                    SELECT user_id, id, 'charge', stars_paid, telegram_payment_charge_id, created_at
+                    FROM ads
+                    WHERE payment_status = 'paid' AND telegram_payment_charge_id IS NOT NULL
+                    ORDER BY id
+                """)
+                await db.execute("""
+                    INSERT OR IGNORE INTO payments_ledger (user_id, ad_id, kind, amount, telegram_payment_charge_id)
+                    SELECT user_id, id, 'refund', stars_paid, telegram_payment_charge_id
+                    FROM ads
+                    WHERE payment_status = 'paid' AND telegram_payment_charge_id IS NOT NULL AND refund_status = 'refunded'
+                    ORDER BY id
+                """)
+            
+            # Star transactions seen by the reconciliation job (a refund reuses its charge's ID)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS star_transactions (
+                    id TEXT NOT NULL,
+                    direction TEXT NOT NULL,
+                    user_id INTEGER,
+                    amount INTEGER NOT NULL,
+                    date TIMESTAMP,
+                    PRIMARY KEY (id, direction)
+                ) WITHOUT ROWID
+            """)
+            
+            # Differences between our ads and Telegram's transaction history
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS reconciliation_discrepancies (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    transaction_id TEXT NOT NULL,
+                    ad_id INTEGER,
+                    kind TEXT NOT NULL,
+                    details TEXT,
+                    status TEXT DEFAULT 'open',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (transaction_id, kind)
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_reconciliation_discrepancies_status ON reconciliation_discrepancies (status, kind)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ads_refund_status ON ads (refund_status)")
+            
+            # Key/value state of background jobs (e.g. reconciliation watermark)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS job_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+            
+            # Changes to listed ads bump a version, so every process's listing caches can tell their entries are stale
+            listing_columns = ("status, sold_status, gift_link, canonical_link, price, price_ton, description, "
+                               "channel_photo, link_kind, link_collection, link_item")
+            for name, event, condition in (
+                ('update', f"UPDATE OF {listing_columns}", "OLD.status = 'approved' OR NEW.status = 'approved'"),
+                ('delete', "DELETE", "OLD.status = 'approved'")
+            ):
+                await db.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_ads_listings_version_{name}
+                    AFTER {event} ON ads
+                    WHEN {condition}
+                    BEGIN
+                        INSERT INTO job_state (key, value) VALUES ('listings_version', '1')
+                        ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1;
+                    END
+                """)
+            
+            # Price alerts: notify the user when the collection is listed at or under max_price TON
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS price_alerts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    collection TEXT NOT NULL,
+                    max_price REAL NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (user_id, collection),
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            """)
+            # Every change bumps a version in job_state, so in-memory indexes know when to reload
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                await db.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_price_alerts_version_{event.lower()}
+                    AFTER {event} ON price_alerts
+                    BEGIN
+                        INSERT INTO job_state (key, value) VALUES ('price_alerts_version', '1')
+                        ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1;
+                    END
+                """)
+            
+            # Daily market rollup per gift collection, updated as ads are approved and sold.
+            # Each event keeps a fixed-size summary of its prices: count, sum, min, max and a histogram for medians
+            cursor = await db.execute("SELECT 1 FROM pragma_table_info('market_daily') WHERE name = 'listed_prices'")
+            keeps_prices = await cursor.fetchone() is not None
+            if keeps_prices:
+                # Earlier versions kept every price of the day; they are summarized below
+                await db.execute("ALTER TABLE market_daily RENAME TO market_daily_prices")
+            await db.execute(f"""
+                CREATE TABLE IF NOT EXISTS market_daily (
+                    collection TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    listed INTEGER DEFAULT 0,
+                    listed_sum REAL DEFAULT 0,
+                    listed_min REAL,
+                    listed_max REAL,
+                    listed_histogram TEXT DEFAULT '{EMPTY_MARKET_HISTOGRAM}',
+                    sold INTEGER DEFAULT 0,
+                    sold_sum REAL DEFAULT 0,
+                    sold_min REAL,
+                    sold_max REAL,
+                    sold_histogram TEXT DEFAULT '{EMPTY_MARKET_HISTOGRAM}',
+                    PRIMARY KEY (collection, day)
+                ) WITHOUT ROWID
+            """)
+            if keeps_prices:
+                await self._summarize_market_prices(db)
+            # Day under which an ad's sale was counted, so marking it available again can undo it
+            try:
+                await db.execute("ALTER TABLE ads ADD COLUMN rollup_sold_day TEXT")
+            except:
+                pass  # Column already exists
+            # Sales still counted under a day, to recompute its min and max when one is undone
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_ads_rollup_sold ON ads (link_collection, rollup_sold_day)
+                WHERE rollup_sold_day IS NOT NULL
+            """)
+            await self._backfill_market_daily(db)
+            
+            # Next lifecycle step of each listed ad ('remind' the seller, then 'expire' the ad), by due time
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS ad_timers (
+                    ad_id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL CHECK (kind IN ('remind', 'expire')),
+                    due_at REAL NOT NULL
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ad_timers_due_at ON ad_timers (due_at)")
+            
+            # Paid bumps: the ad is posted to the channel again
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS ad_bumps (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ad_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    telegram_payment_charge_id TEXT NOT NULL UNIQUE,
+                    stars_paid INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (ad_id) REFERENCES ads (id)
+                )
+            """)
+            # Bumps that could not be published are refunded
+            try:
+                await db.execute("ALTER TABLE ad_bumps ADD COLUMN refund_status TEXT DEFAULT 'not_refunded'")
+            except:
+                pass  # Column already exists
+            
             # Support requests table
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS support_requests (
@@ -110,27 +628,282 @@ class Database:
             
             await db.commit()
     
-    async def update_sold_status(self, ad_id: int, sold_status: str):
-        """Update sold status of an ad"""
-        async with aiosqlite.connect(self.db_path) as db:
+    async def search_listed_ads(self, text: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Approved ads still for sale, newest first: all of them for empty text, the collection's ads
+        when text is a collection slug, otherwise full-text matches
+        """
+        listed = "a.sold_status = 'available' AND a.status = 'approved'"
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            words = text.split()
+            if not words:
+                # Walk ads newest first and stop at the page; the unary + keeps the planner from
+                # collecting and sorting every listing through idx_ads_listing instead
+                cursor = await db.execute("""
+                    SELECT a.*, u.username FROM ads a LEFT JOIN users u ON a.user_id = u.user_id
+                    WHERE +a.sold_status = 'available' AND +a.status = 'approved'
+                    ORDER BY a.id DESC LIMIT ? OFFSET ?
+                """, (limit, offset))
+                return [dict(row) for row in await cursor.fetchall()]
+            
+            if len(words) == 1:
+                collection = words[0].lower()
+                cursor = await db.execute(
+                    f"SELECT 1 FROM ads a INDEXED BY idx_ads_listing WHERE {listed} AND a.link_collection = ? LIMIT 1",
+                    (collection,)
+                )
+                if await cursor.fetchone():
+                    # idx_ads_listing ends in the rowid, so this reads the page in order without sorting
+                    cursor = await db.execute(f"""
+                        SELECT a.*, u.username FROM ads a INDEXED BY idx_ads_listing
+                        LEFT JOIN users u ON a.user_id = u.user_id
+                        WHERE {listed} AND a.link_collection = ?
+                        ORDER BY a.id DESC LIMIT ? OFFSET ?
+                    """, (collection, limit, offset))
+                    return [dict(row) for row in await cursor.fetchall()]
+            
+            cursor = await db.execute(f"""
+                SELECT a.*, u.username FROM ads_fts f
+                JOIN ads a ON a.id = f.rowid
+                LEFT JOIN users u ON a.user_id = u.user_id
+                WHERE ads_fts MATCH ? AND {listed}
+                ORDER BY f.rowid DESC LIMIT ? OFFSET ?
+            """, (self._fts_query(text), limit, offset))
+            return [dict(row) for row in await cursor.fetchall()]
+    
+    async def get_listed_ads_page(self, link_kind: str = None, min_price: float = None, max_price: float = None,
+                                  before_id: int = None, after_id: int = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Up to limit + 1 approved ads still for sale, newest first, for keyset pagination:
+        ads older than before_id (next page) or newer than after_id (previous page).
+        link_kind 'gift' keeps gift links and 'channel' everything else; prices are in TON, inclusive.
+        """
+        params = []
+        if link_kind == 'channel':
+            # Only gifts have a collection, so channels are a rowid-ordered range of idx_ads_listing
+            source = "ads a INDEXED BY idx_ads_listing"
+            conditions = ["a.sold_status = 'available'", "a.status = 'approved'", "a.link_collection IS NULL"]
+        else:
+            # Gifts are most listings: walk the rowid newest first as search_listed_ads does
+            source = "ads a"
+            conditions = ["+a.sold_status = 'available'", "+a.status = 'approved'"]
+            if link_kind == 'gift':
+                conditions.append("a.link_kind = 'gift'")
+        if min_price is not None:
+            conditions.append("a.price_ton >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            conditions.append("a.price_ton <= ?")
+            params.append(max_price)
+        
+        # Seek from the cursor along the rowid instead of counting an OFFSET of rows
+        if after_id is not None:
+            conditions.append("a.id > ?")
+            params.append(after_id)
+            order = "ASC"
+        else:
+            if before_id is not None:
+                conditions.append("a.id < ?")
+                params.append(before_id)
+            order = "DESC"
+        
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(f"""
+                SELECT a.*, u.username FROM {source} LEFT JOIN users u ON a.user_id = u.user_id
+                WHERE {' AND '.join(conditions)}
+                ORDER BY a.id {order} LIMIT ?
+            """, (*params, limit + 1))
+            ads = [dict(row) for row in await cursor.fetchall()]
+        if after_id is not None:
+            # Keep the page newest first whichever way it was read
+            ads.reverse()
+        return ads
+    
+    async def get_price_stats(self, collection: str = None, sold_status: Optional[str] = 'available') -> Dict[str, Any]:
+        """
+        Count, min, avg and max price_ton of approved ads, in one gift collection or overall.
+        sold_status None covers sold and available ads; ads without a numeric price are left out.
+        """
+        # Both sold states are listed so the status columns stay index seeks
+        sold_statuses = ('available', 'sold') if sold_status is None else (sold_status,)
+        conditions = [f"sold_status IN ({', '.join('?' * len(sold_statuses))})", "status = 'approved'", "price_ton IS NOT NULL"]
+        params = list(sold_statuses)
+        if collection is not None:
+            # idx_ads_listing narrows to the collection's approved ads; idx_ads_listing_price covers the overall stats
+            source = "ads INDEXED BY idx_ads_listing"
+            conditions.append("link_collection = ?")
+            params.append(collection)
+        else:
+            source = "ads INDEXED BY idx_ads_listing_price"
+        
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(f"""
+                SELECT COUNT(*) AS count, MIN(price_ton) AS min, AVG(price_ton) AS avg, MAX(price_ton) AS max
+                FROM {source} WHERE {' AND '.join(conditions)}
+            """, params)
+            return dict(await cursor.fetchone())
+    
+    async def get_ads_by_price(self, min_price: float = None, max_price: float = None, collection: str = None,
+                               after: tuple = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Approved ads still for sale with a price in [min_price, max_price], cheapest first.
+        after is the (price_ton, id) of the last ad of the previous page. Within one collection
+        the page is read in order from idx_ads_collection_price.
+        """
+        conditions = ["a.sold_status = 'available'", "a.status = 'approved'", "a.price_ton IS NOT NULL"]
+        params = []
+        if collection is not None:
+            conditions.append("a.link_collection = ?")
+            params.append(collection)
+        if min_price is not None:
+            conditions.append("a.price_ton >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            conditions.append("a.price_ton <= ?")
+            params.append(max_price)
+        if after is not None:
+            conditions.append("(a.price_ton, a.id) > (?, ?)")
+            params.extend(after)
+        
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(f"""
+                SELECT a.*, u.username FROM ads a LEFT JOIN users u ON a.user_id = u.user_id
+                WHERE {' AND '.join(conditions)}
+                ORDER BY a.price_ton, a.id LIMIT ?
+            """, (*params, limit))
+            return [dict(row) for row in await cursor.fetchall()]
+    
+    async def update_sold_status(self, ad_id: int, sold_status: str, only_from: str = None) -> bool:
+        """
+        Update sold status of an ad and count or uncount the sale in the market rollup.
+        With only_from, nothing changes (and False is returned) unless the ad currently has that status.
+        """
+        async with self._connect() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute(
+                "SELECT sold_status, rollup_sold_day, link_collection, price_ton FROM ads WHERE id = ?", (ad_id,)
+            )
+            previous = await cursor.fetchone()
+            if only_from and (not previous or previous[0] != only_from):
+                await db.rollback()
+                return False
             await db.execute(
                 "UPDATE ads SET sold_status = ? WHERE id = ?",
                 (sold_status, ad_id)
             )
+            if previous and previous[0] != sold_status:
+                if sold_status == 'sold':
+                    await self._record_market_event(db, [ad_id], 'sold')
+                    # Remember the day only if the sale was counted
+                    await db.execute("""
+                        UPDATE ads SET rollup_sold_day = date('now')
+                        WHERE id = ? AND status = 'approved' AND link_collection IS NOT NULL AND price_ton IS NOT NULL
+                    """, (ad_id,))
+                elif previous[1]:
+                    _, day, collection, price = previous
+                    bucket = market_bucket(price)
+                    await db.execute("UPDATE ads SET rollup_sold_day = NULL WHERE id = ?", (ad_id,))
+                    # Take the price out of the day the sale was counted under; min and max come from the sales left
+                    await db.execute("""
+                        UPDATE market_daily SET
+                            sold = sold - 1,
+                            sold_sum = sold_sum - ?,
+                            sold_histogram = json_set(
+                                sold_histogram, '$[' || ? || ']', max(json_extract(sold_histogram, '$[' || ? || ']') - 1, 0)
+                            ),
+                            (sold_min, sold_max) = (
+                                SELECT MIN(price_ton), MAX(price_ton) FROM ads WHERE link_collection = ? AND rollup_sold_day = ?
+                            )
+                        WHERE collection = ? AND day = ? AND sold > 0
+                    """, (price, bucket, bucket, collection, day, collection, day))
             await db.commit()
+            return True
+    
+    async def get_market_history(self, collection: str, days: int) -> List[Dict[str, Any]]:
+        """Rollup rows of a collection for the last days (UTC), newest first, with their histograms as lists"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("""
+                SELECT * FROM market_daily
+                WHERE collection = ? AND day > date('now', ?)
+                ORDER BY day DESC
+            """, (collection, f"-{days} days"))
+            rows = [dict(row) for row in await cursor.fetchall()]
+            for row in rows:
+                row['listed_histogram'] = json.loads(row['listed_histogram'])
+                row['sold_histogram'] = json.loads(row['sold_histogram'])
+            return rows
     
     async def update_channel_message_id(self, ad_id: int, message_id: int):
         """Update channel message ID for an ad"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute(
                 "UPDATE ads SET channel_message_id = ? WHERE id = ?",
                 (message_id, ad_id)
             )
             await db.commit()
     
+    async def queue_ad_for_digest(self, ad_id: int):
+        """Queue an approved ad for the next channel digest post"""
+        async with self._connect() as db:
+            await db.execute(
+                "UPDATE ads SET digest_queued = 1 WHERE id = ?",
+                (ad_id,)
+            )
+            await db.commit()
+    
+    async def count_digest_queue(self) -> int:
+        """Count ads waiting for a digest post"""
+        async with self._connect() as db:
+            cursor = await db.execute("SELECT COUNT(*) FROM ads WHERE digest_queued = 1")
+            row = await cursor.fetchone()
+            return row[0] if row else 0
+    
+    async def get_digest_queue(self, limit: int) -> List[Dict[str, Any]]:
+        """Get the oldest ads waiting for a digest post"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("""
+                SELECT a.*, u.username, u.first_name, u.last_name
+                FROM ads a
+                JOIN users u ON a.user_id = u.user_id
+                WHERE a.digest_queued = 1
+                ORDER BY a.approved_at ASC, a.id ASC
+                LIMIT ?
+            """, (limit,))
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+    
+    async def set_digest_message_ids(self, message_ids: List[tuple]):
+        """Store (ad_id, message_id) pairs of a published digest and dequeue the ads"""
+        async with self._connect() as db:
+            await db.executemany(
+                "UPDATE ads SET channel_message_id = ?, digest_queued = 0 WHERE id = ?",
+                [(message_id, ad_id) for ad_id, message_id in message_ids]
+            )
+            await db.commit()
+    
+    async def get_ads_by_channel_message_id(self, message_id: int) -> List[Dict[str, Any]]:
+        """Get all ads published in the same text channel post"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("""
+                SELECT a.*, u.username, u.first_name, u.last_name
+                FROM ads a
+                JOIN users u ON a.user_id = u.user_id
+                WHERE a.channel_message_id = ? AND a.channel_photo IS NULL
+                ORDER BY a.id ASC
+            """, (message_id,))
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+    
     async def get_latest_payment_charge_id(self, user_id: int) -> Dict[str, Any]:
         """Get the latest payment charge ID for a user"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
                 SELECT id, telegram_payment_charge_id 
@@ -146,7 +919,7 @@ class Database:
         """
         Get all payment charge IDs for a user
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
                 SELECT id, telegram_payment_charge_id, price, created_at, 
@@ -160,7 +933,7 @@ class Database:
     
     async def get_payment_by_charge_id(self, telegram_payment_charge_id: str) -> Dict[str, Any]:
         """Get payment details by telegram payment charge ID"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
                 SELECT id, user_id, telegram_payment_charge_id, price, stars_paid, created_at,
@@ -173,22 +946,43 @@ class Database:
     
     async def update_refund_status(self, ad_id: int, refunded: bool):
         """
-        Update refund status for an ad
+        Update refund status for an ad and record the refund in the payments ledger
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             refund_status = 'refunded' if refunded else 'not_refunded'
             await db.execute(
                 "UPDATE ads SET refund_status = ? WHERE id = ?",
                 (refund_status, ad_id)
             )
+            if refunded:
+                await db.execute("""
+                    INSERT OR IGNORE INTO payments_ledger (user_id, ad_id, kind, amount, telegram_payment_charge_id)
+                    SELECT user_id, id, 'refund', stars_paid, telegram_payment_charge_id
+                    FROM ads
+                    WHERE id = ? AND telegram_payment_charge_id IS NOT NULL
+                """, (ad_id,))
             await db.commit()
     
+    async def get_refundable_payments(self, user_id: int) -> List[Dict[str, Any]]:
+        """Get a user's paid charges that haven't been refunded yet, newest first"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("""
+                SELECT id, telegram_payment_charge_id, stars_paid, created_at
+                FROM ads
+                WHERE user_id = ? AND payment_status = 'paid' AND telegram_payment_charge_id IS NOT NULL
+                      AND refund_status != 'refunded'
+                ORDER BY created_at DESC, id DESC
+            """, (user_id,))
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+    
     async def add_user(self, user_id: int, username: str = None, 
                       first_name: str = None, last_name: str = None,
                       language_code: str = None, is_bot: bool = False,
                       is_premium: bool = False, language: str = 'fa'):
         """Add or update user information"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("""
                 INSERT OR REPLACE INTO users 
                 (user_id, username, first_name, last_name, language_code, is_bot, is_premium, language, last_seen)
@@ -196,19 +990,272 @@ class Database:
             """, (user_id, username, first_name, last_name, language_code, is_bot, is_premium, language))
             await db.commit()
     
+    async def set_user_active(self, user_id: int, active: bool):
+        """Mark a user as blocking the bot (inactive) or reachable again (active)"""
+        async with self._connect() as db:
+            await db.execute(
+                "UPDATE users SET is_active = ? WHERE user_id = ? AND is_active != ?",
+                (int(active), user_id, int(active))
+            )
+            await db.commit()
+    
+    @staticmethod
+    def _link_columns(gift_link: str) -> tuple:
+        """Values of link_kind, link_collection, link_item and canonical_link for a stored link"""
+        parsed = parse_link(gift_link)
+        if parsed is None:
+            return 'other', None, None, None
+        return parsed.kind, parsed.collection, parsed.item, parsed.canonical
+    
+    async def _backfill_link_columns(self, db, batch_size: int = 500):
+        """Parse the links of ads created before the link columns existed, a batch at a time"""
+        while True:
+            cursor = await db.execute(
+                "SELECT id, gift_link FROM ads WHERE link_kind IS NULL LIMIT ?", (batch_size,)
+            )
+            rows = await cursor.fetchall()
+            if not rows:
+                return
+            await db.executemany("""
+                UPDATE ads SET link_kind = ?, link_collection = ?, link_item = ?, canonical_link = ?
+                WHERE id = ?
+            """, [(*self._link_columns(gift_link), ad_id) for ad_id, gift_link in rows])
+            await db.commit()
+    
+    @staticmethod
+    def _price_ton(price: str) -> Optional[float]:
+        """Numeric value of a stored price, or None unless it is a finite non-negative number"""
+        try:
+            value = float(price)
+        except (TypeError, ValueError):
+            return None
+        return value if math.isfinite(value) and value >= 0 else None
+    
+    async def _backfill_price_ton(self, db, batch_size: int = 500):
+        """Fill price_ton for ads created before the column existed, walking the ads by ID a batch at a time"""
+        last_id = 0
+        while True:
+            cursor = await db.execute(
+                "SELECT id, price FROM ads WHERE id > ? AND price_ton IS NULL ORDER BY id LIMIT ?",
+                (last_id, batch_size)
+            )
+            rows = await cursor.fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            updates = [(self._price_ton(price), ad_id) for ad_id, price in rows]
+            # Prices that aren't numbers stay NULL
+            await db.executemany(
+                "UPDATE ads SET price_ton = ? WHERE id = ?",
+                [update for update in updates if update[0] is not None]
+            )
+            await db.commit()
+    
+    async def _backfill_market_daily(self, db):
+        """Roll up the listings of ads approved before market_daily existed; their sales dates are unknown"""
+        cursor = await db.execute("SELECT 1 FROM job_state WHERE key = 'market_daily_backfilled'")
+        if await cursor.fetchone():
+            return
+        cursor = await db.execute("""
+            SELECT link_collection, date(approved_at), price_ton FROM ads
+            WHERE status = 'approved' AND link_collection IS NOT NULL AND price_ton IS NOT NULL AND approved_at IS NOT NULL
+            ORDER BY link_collection, date(approved_at)
+        """)
+        rows = await cursor.fetchall()
+        await db.executemany("""
+            INSERT OR IGNORE INTO market_daily (collection, day, listed, listed_sum, listed_min, listed_max, listed_histogram)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (collection, day, *_market_columns([row[2] for row in group]))
+            for (collection, day), group in groupby(rows, key=lambda row: (row[0], row[1]))
+        ])
+        await db.execute("INSERT INTO job_state (key, value) VALUES ('market_daily_backfilled', '1')")
+        await db.commit()
+    
+    async def _summarize_market_prices(self, db):
+        """Move rollup rows that kept every price of the day (market_daily_prices) into market_daily"""
+        cursor = await db.execute("SELECT collection, day, listed_prices, sold_prices FROM market_daily_prices")
+        await db.executemany("""
+            INSERT OR IGNORE INTO market_daily (
+                collection, day,
+                listed, listed_sum, listed_min, listed_max, listed_histogram,
+                sold, sold_sum, sold_min, sold_max, sold_histogram
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (collection, day, *_market_columns(json.loads(listed)), *_market_columns(json.loads(sold)))
+            for collection, day, listed, sold in await cursor.fetchall()
+        ])
+        await db.execute("DROP TABLE market_daily_prices")
+        await db.commit()
+    
+    async def _record_market_event(self, db, ad_ids: List[int], event: str):
+        """
+        Add approved gift ads to today's rollup of their collection, as 'listed' or 'sold'.
+        Runs in the caller's transaction; ads without a collection or numeric price are skipped.
+        """
+        column = 'listed' if event == 'listed' else 'sold'
+        cursor = await db.execute(f"""
+            SELECT link_collection, price_ton FROM ads
+            WHERE id IN ({','.join('?' * len(ad_ids))})
+                AND status = 'approved' AND link_collection IS NOT NULL AND price_ton IS NOT NULL
+        """, ad_ids)
+        await db.executemany(f"""
+            INSERT INTO market_daily (collection, day, {column}, {column}_sum, {column}_min, {column}_max, {column}_histogram)
+            VALUES (?, date('now'), ?, ?, ?, ?, ?)
+            ON CONFLICT (collection, day) DO UPDATE SET
+                {column} = {column} + excluded.{column},
+                {column}_sum = {column}_sum + excluded.{column}_sum,
+                {column}_min = min(coalesce({column}_min, excluded.{column}_min), excluded.{column}_min),
+                {column}_max = max(coalesce({column}_max, excluded.{column}_max), excluded.{column}_max),
+                {column}_histogram = json_set(
+                    {column}_histogram, '$[' || ? || ']', json_extract({column}_histogram, '$[' || ? || ']') + 1
+                )
+        """, [
+            (collection, *_market_columns([price]), market_bucket(price), market_bucket(price))
+            for collection, price in await cursor.fetchall()
+        ])
+    
+    async def _rebuild_ads_search(self, db) -> int:
+        """Repopulate ads_fts from ads and users and merge its segments"""
+        await db.execute("DELETE FROM ads_fts")
+        cursor = await db.execute("""
+            INSERT INTO ads_fts (rowid, gift_link, canonical_link, description, username)
+            SELECT a.id, a.gift_link, a.canonical_link, a.description, u.username
+            FROM ads a LEFT JOIN users u ON a.user_id = u.user_id
+        """)
+        await db.execute("INSERT INTO ads_fts (ads_fts) VALUES ('optimize')")
+        await db.commit()
+        return cursor.rowcount
+    
+    async def rebuild_ads_search(self) -> int:
+        """Rebuild the ad search index and return the number of indexed ads"""
+        async with self._connect() as db:
+            return await self._rebuild_ads_search(db)
+    
+    @staticmethod
+    def _fts_query(text: str) -> Optional[str]:
+        """Turn free text into an FTS5 query: every word must match, as a prefix"""
+        words = [word.replace('"', '') for word in text.split()]
+        words = [word for word in words if word]
+        if not words:
+            return None
+        return ' '.join(f'"{word}"*' for word in words)
+    
+    async def search_ads(self, text: str, limit: int = 10, offset: int = 0, rank_limit: int = 2000) -> tuple:
+        """
+        Ads matching text; returns (total, page of ads).
+        Up to rank_limit matches are ordered by relevance (bm25); broader queries are ordered newest first,
+        since scoring every match costs far more than reading the index in rowid order.
+        """
+        query = self._fts_query(text)
+        if query is None:
+            return 0, []
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("SELECT COUNT(*) FROM ads_fts WHERE ads_fts MATCH ?", (query,))
+            total = (await cursor.fetchone())[0]
+            order = "f.rank" if total <= rank_limit else "f.rowid DESC"
+            cursor = await db.execute(f"""
+                SELECT a.id, a.user_id, a.gift_link, a.price, a.description, a.status, a.sold_status, a.created_at,
+                       f.username
+                FROM ads_fts f
+                JOIN ads a ON a.id = f.rowid
+                WHERE ads_fts MATCH ?
+                ORDER BY {order}
+                LIMIT ? OFFSET ?
+            """, (query, limit, offset))
+            rows = await cursor.fetchall()
+            return total, [dict(row) for row in rows]
+    
     async def create_ad(self, user_id: int, gift_link: str, price: str, description: str = 'توضیحات ندارد', telegram_payment_charge_id: str = None, stars_paid: int = 0, channel_photo: str = None) -> int:
         """Create a new ad and return its ID"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cursor = await db.execute("""
-                INSERT INTO ads (user_id, gift_link, price, description, telegram_payment_charge_id, stars_paid, channel_photo)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (user_id, gift_link, price, description, telegram_payment_charge_id, stars_paid, channel_photo))
+                INSERT INTO ads (user_id, gift_link, price, price_ton, description, telegram_payment_charge_id, stars_paid, channel_photo,
+                                 link_kind, link_collection, link_item, canonical_link)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, gift_link, price, self._price_ton(price), description, telegram_payment_charge_id, stars_paid, channel_photo,
+                  *self._link_columns(gift_link)))
             await db.commit()
             return cursor.lastrowid
     
+    # Ad draft methods
+    async def save_ad_draft(self, user_id: int, gift_link: str, price: str, description: str = 'توضیحات ندارد',
+                            channel_photo: str = None, language: str = 'fa') -> int:
+        """Persist a confirmed ad draft before sending its invoice and cancel older open drafts of the user"""
+        async with self._connect() as db:
+            await db.execute("""
+                UPDATE ad_drafts SET status = 'cancelled'
+                WHERE user_id = ? AND status = 'open'
+            """, (user_id,))
+            cursor = await db.execute("""
+                INSERT INTO ad_drafts (user_id, gift_link, price, description, channel_photo, language)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, gift_link, price, description, channel_photo, language))
+            await db.commit()
+            return cursor.lastrowid
+    
+    async def get_ad_draft(self, draft_id: int) -> Optional[Dict[str, Any]]:
+        """Get ad draft by ID"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("SELECT * FROM ad_drafts WHERE id = ?", (draft_id,))
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+    
+    async def cancel_ad_drafts(self, user_id: int):
+        """Cancel all open drafts of a user"""
+        async with self._connect() as db:
+            await db.execute("""
+                UPDATE ad_drafts SET status = 'cancelled'
+                WHERE user_id = ? AND status = 'open'
+            """, (user_id,))
+            await db.commit()
+    
+    async def create_paid_ad(self, draft_id: int, telegram_payment_charge_id: str, stars_paid: int) -> tuple:
+        """
+        Turn a paid draft into an ad, idempotently keyed on the payment charge ID.
+        Returns (ad_id, created); created is False when this charge was already ingested.
+        """
+        async with self._connect() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute("SELECT gift_link, price FROM ad_drafts WHERE id = ?", (draft_id,))
+            draft = await cursor.fetchone()
+            link_columns = self._link_columns(draft[0]) if draft else (None, None, None, None)
+            price_ton = self._price_ton(draft[1]) if draft else None
+            cursor = await db.execute("""
+                INSERT INTO ads (user_id, gift_link, price, price_ton, description, channel_photo,
+                                 telegram_payment_charge_id, stars_paid, payment_status,
+                                 link_kind, link_collection, link_item, canonical_link)
+                SELECT user_id, gift_link, price, ?, description, channel_photo, ?, ?, 'paid', ?, ?, ?, ?
+                FROM ad_drafts WHERE id = ?
+                ON CONFLICT DO NOTHING
+            """, (price_ton, telegram_payment_charge_id, stars_paid, *link_columns, draft_id))
+            created = cursor.rowcount == 1
+            
+            cursor = await db.execute(
+                "SELECT id FROM ads WHERE telegram_payment_charge_id = ?",
+                (telegram_payment_charge_id,)
+            )
+            row = await cursor.fetchone()
+            ad_id = row[0] if row else None
+            
+            if created:
+                await db.execute("""
+                    UPDATE ad_drafts SET status = 'paid', ad_id = ?
+                    WHERE id = ?
+                """, (ad_id, draft_id))
+                await db.execute("""
+                    INSERT INTO payments_ledger (user_id, ad_id, kind, amount, telegram_payment_charge_id)
+                    SELECT user_id, id, 'charge', stars_paid, telegram_payment_charge_id
+                    FROM ads WHERE id = ?
+                """, (ad_id,))
+            await db.commit()
+            return ad_id, created
+    
     async def get_ad(self, ad_id: int) -> Optional[Dict[str, Any]]:
         """Get ad by ID"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
                 SELECT a.*, u.username, u.first_name, u.last_name
@@ -219,9 +1266,28 @@ class Database:
             row = await cursor.fetchone()
             return dict(row) if row else None
     
+    async def find_relisting(self, canonical_link: str, window_hours: int = 0, exclude_ad_id: int = None) -> Optional[Dict[str, Any]]:
+        """
+        Latest ad for the same gift or channel that is still live (not rejected, sold or expired),
+        created within the last window_hours (0 = any time)
+        """
+        if not canonical_link:
+            return None
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("""
+                SELECT id, user_id, status, sold_status, created_at FROM ads
+                WHERE canonical_link = ? AND id != ?
+                AND status != 'rejected' AND sold_status = 'available'
+                AND (? = 0 OR created_at >= datetime('now', ?))
+                ORDER BY id DESC LIMIT 1
+            """, (canonical_link, exclude_ad_id or 0, window_hours, f"-{window_hours} hours"))
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+    
     async def get_pending_ads(self) -> List[Dict[str, Any]]:
         """Get all pending ads"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
                 SELECT a.*, u.username, u.first_name, u.last_name
@@ -234,17 +1300,62 @@ class Database:
             return [dict(row) for row in rows]
     
     async def update_ad_status(self, ad_id: int, status: str):
-        """Update ad status"""
-        async with aiosqlite.connect(self.db_path) as db:
+        """Update ad status; a first approval adds the ad to the market rollup"""
+        async with self._connect() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute("SELECT status FROM ads WHERE id = ?", (ad_id,))
+            previous = await cursor.fetchone()
             await db.execute("""
                 UPDATE ads SET status = ?, approved_at = CURRENT_TIMESTAMP
                 WHERE id = ?
             """, (status, ad_id))
+            if status == 'approved' and previous and previous[0] != 'approved':
+                await self._record_market_event(db, [ad_id], 'listed')
+            await db.commit()
+    
+    async def get_ads(self, ad_ids: List[int]) -> List[Dict[str, Any]]:
+        """Get several ads by ID in one query"""
+        if not ad_ids:
+            return []
+        placeholders = ",".join("?" * len(ad_ids))
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(f"""
+                SELECT a.*, u.username, u.first_name, u.last_name
+                FROM ads a
+                JOIN users u ON a.user_id = u.user_id
+                WHERE a.id IN ({placeholders})
+                ORDER BY a.created_at ASC
+            """, ad_ids)
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+    
+    async def bulk_update_ad_status(self, ad_ids: List[int], status: str) -> List[int]:
+        """Move pending ads to a new status in one transaction and return the IDs that changed"""
+        if not ad_ids:
+            return []
+        placeholders = ",".join("?" * len(ad_ids))
+        async with self._connect() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            # Only ads still pending are touched, so another admin's decision is never overwritten
+            cursor = await db.execute(f"""
+                SELECT id FROM ads
+                WHERE id IN ({placeholders}) AND status = 'pending'
+            """, ad_ids)
+            updated_ids = [row[0] for row in await cursor.fetchall()]
+            if updated_ids:
+                await db.execute(f"""
+                    UPDATE ads SET status = ?, approved_at = CURRENT_TIMESTAMP
+                    WHERE id IN ({",".join("?" * len(updated_ids))})
+                """, [status, *updated_ids])
+                if status == 'approved':
+                    await self._record_market_event(db, updated_ids, 'listed')
             await db.commit()
+            return updated_ids
     
     async def update_payment_status(self, ad_id: int, status: str):
         """Update payment status"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("""
                 UPDATE ads SET payment_status = ?
                 WHERE id = ?
@@ -253,7 +1364,7 @@ class Database:
     
     async def get_user_ads(self, user_id: int) -> List[Dict[str, Any]]:
         """Get all ads by user"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
                 SELECT * FROM ads
@@ -263,10 +1374,104 @@ class Database:
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
     
+    # Ad lifecycle methods
+    async def set_ad_timers(self, ad_ids: List[int], kind: str, due_at: float):
+        """Set the next lifecycle step of ads, replacing the one they had"""
+        async with self._connect() as db:
+            await db.executemany("""
+                INSERT INTO ad_timers (ad_id, kind, due_at) VALUES (?, ?, ?)
+                ON CONFLICT (ad_id) DO UPDATE SET kind = excluded.kind, due_at = excluded.due_at
+            """, [(ad_id, kind, due_at) for ad_id in ad_ids])
+            await db.commit()
+    
+    async def delete_ad_timer(self, ad_id: int):
+        """Stop the lifecycle of an ad that left the listings"""
+        async with self._connect() as db:
+            await db.execute("DELETE FROM ad_timers WHERE ad_id = ?", (ad_id,))
+            await db.commit()
+    
+    async def get_due_ad_timers(self, until: float, limit: int) -> List[tuple]:
+        """(ad_id, kind, due_at) of the earliest timers due by until, read from the due time index"""
+        async with self._connect() as db:
+            cursor = await db.execute("""
+                SELECT ad_id, kind, due_at FROM ad_timers
+                WHERE due_at <= ?
+                ORDER BY due_at LIMIT ?
+            """, (until, limit))
+            return [tuple(row) for row in await cursor.fetchall()]
+    
+    async def claim_ad_timer(self, ad_id: int, kind: str, due_at: float, next_timer: tuple = None) -> bool:
+        """
+        Take a timer off the index if it is still the ad's current one, so a timer that was
+        rescheduled or stopped after it was loaded never fires. next_timer (kind, due_at) replaces it.
+        """
+        async with self._connect() as db:
+            if next_timer:
+                cursor = await db.execute("""
+                    UPDATE ad_timers SET kind = ?, due_at = ?
+                    WHERE ad_id = ? AND kind = ? AND due_at = ?
+                """, (*next_timer, ad_id, kind, due_at))
+            else:
+                cursor = await db.execute(
+                    "DELETE FROM ad_timers WHERE ad_id = ? AND kind = ? AND due_at = ?",
+                    (ad_id, kind, due_at)
+                )
+            await db.commit()
+            return cursor.rowcount == 1
+    
+    async def schedule_missing_reminders(self, delay_seconds: float) -> int:
+        """Give listed ads without a timer their first reminder, due delay_seconds after approval (or now)"""
+        async with self._connect() as db:
+            cursor = await db.execute("""
+                INSERT INTO ad_timers (ad_id, kind, due_at)
+                SELECT a.id, 'remind', MAX(CAST(strftime('%s', COALESCE(a.approved_at, a.created_at)) AS REAL) + ?, CAST(strftime('%s', 'now') AS REAL))
+                FROM ads a INDEXED BY idx_ads_listing
+                WHERE a.sold_status = 'available' AND a.status = 'approved'
+                    AND NOT EXISTS (SELECT 1 FROM ad_timers t WHERE t.ad_id = a.id)
+            """, (delay_seconds,))
+            await db.commit()
+            return cursor.rowcount
+    
+    async def record_bump(self, ad_id: int, user_id: int, telegram_payment_charge_id: str, stars_paid: int) -> bool:
+        """Record a paid bump and its ledger charge; False when this charge was already ingested"""
+        async with self._connect() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute("""
+                INSERT INTO ad_bumps (ad_id, user_id, telegram_payment_charge_id, stars_paid)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT DO NOTHING
+            """, (ad_id, user_id, telegram_payment_charge_id, stars_paid))
+            created = cursor.rowcount == 1
+            if created:
+                await db.execute("""
+                    INSERT INTO payments_ledger (user_id, ad_id, kind, amount, telegram_payment_charge_id, note)
+                    VALUES (?, ?, 'charge', ?, ?, 'bump')
+                """, (user_id, ad_id, stars_paid, telegram_payment_charge_id))
+            await db.commit()
+            return created
+    
+    async def record_bump_refund(self, telegram_payment_charge_id: str) -> bool:
+        """Mark a bump refunded and record the refund in the payments ledger; False if it already was"""
+        async with self._connect() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute("""
+                UPDATE ad_bumps SET refund_status = 'refunded'
+                WHERE telegram_payment_charge_id = ? AND refund_status != 'refunded'
+            """, (telegram_payment_charge_id,))
+            refunded = cursor.rowcount == 1
+            if refunded:
+                await db.execute("""
+                    INSERT OR IGNORE INTO payments_ledger (user_id, ad_id, kind, amount, telegram_payment_charge_id, note)
+                    SELECT user_id, ad_id, 'refund', stars_paid, telegram_payment_charge_id, 'bump'
+                    FROM ad_bumps WHERE telegram_payment_charge_id = ?
+                """, (telegram_payment_charge_id,))
+            await db.commit()
+            return refunded
+    
     # Support requests methods
     async def create_support_request(self, user_id: int, message: str) -> int:
         """Create a new support request"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cursor = await db.execute("""
                 INSERT INTO support_requests (user_id, message)
                 VALUES (?, ?)
@@ -276,7 +1481,7 @@ class Database:
     
     async def get_pending_support_requests(self) -> List[Dict[str, Any]]:
         """Get all pending support requests"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
                 SELECT sr.*, u.username, u.first_name, u.last_name
@@ -290,7 +1495,7 @@ class Database:
     
     async def get_support_request_by_id(self, request_id: int) -> Optional[Dict[str, Any]]:
         """Get support request by ID"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
                 SELECT sr.*, u.username, u.first_name, u.last_name
@@ -303,7 +1508,7 @@ class Database:
     
     async def respond_to_support_request(self, request_id: int, response: str):
         """Respond to a support request"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("""
                 UPDATE support_requests 
                 SET status = 'responded', admin_response = ?, responded_at = CURRENT_TIMESTAMP
@@ -314,7 +1519,7 @@ class Database:
     # User management methods for super admin
     async def get_all_users(self) -> List[Dict[str, Any]]:
         """Get all users"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
                 SELECT * FROM users
@@ -323,20 +1528,239 @@ class Database:
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
     
+    async def get_users_page(self, limit: int, offset: int = 0) -> tuple:
+        """Newest users first, one page at a time; returns (total, page of users)"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("SELECT COUNT(*) FROM users")
+            total = (await cursor.fetchone())[0]
+            cursor = await db.execute("""
+                SELECT * FROM users
+                ORDER BY created_at DESC
+                LIMIT ? OFFSET ?
+            """, (limit, offset))
+            rows = await cursor.fetchall()
+            return total, [dict(row) for row in rows]
+    
+    async def search_users(self, text: str, limit: int = 10, offset: int = 0, max_results: int = 1000) -> tuple:
+        """
+        Users whose username or name words start with every word of text, an exact username first and then
+        newest first. Returns (total, page of users, truncated); at most max_results matches are kept,
+        since reading the index in rowid order stops early while counting or scoring every match doesn't.
+        """
+        query = self._fts_query(text.replace('@', ' ').translate(NAME_FOLDING))
+        if query is None:
+            return 0, [], False
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(
+                "SELECT rowid FROM users_fts WHERE users_fts MATCH ? ORDER BY rowid DESC LIMIT ?",
+                (query, max_results + 1)
+            )
+            user_ids = [row[0] for row in await cursor.fetchall()]
+            truncated = len(user_ids) > max_results
+            
+            username = text.strip().lstrip('@')
+            if username and ' ' not in username:
+                cursor = await db.execute("SELECT user_id FROM users WHERE lower(username) = lower(?)", (username,))
+                exact = await cursor.fetchone()
+                if exact:
+                    user_ids = [exact[0]] + [user_id for user_id in user_ids if user_id != exact[0]]
+            user_ids = user_ids[:max_results]
+            
+            page_ids = user_ids[offset:offset + limit]
+            if not page_ids:
+                return len(user_ids), [], truncated
+            cursor = await db.execute(
+                f"SELECT * FROM users WHERE user_id IN ({','.join('?' * len(page_ids))})", page_ids
+            )
+            users = {row['user_id']: dict(row) for row in await cursor.fetchall()}
+            return len(user_ids), [users[user_id] for user_id in page_ids if user_id in users], truncated
+    
+    async def count_active_users(self) -> int:
+        """Count users who haven't blocked the bot"""
+        async with self._connect() as db:
+            cursor = await db.execute("SELECT COUNT(*) FROM users WHERE is_active = 1")
+            row = await cursor.fetchone()
+            return row[0] if row else 0
+    
+    async def get_active_user_ids(self, after_user_id: int, limit: int) -> List[int]:
+        """Get the next page of active user IDs in user_id order (keyset pagination)"""
+        async with self._connect() as db:
+            cursor = await db.execute("""
+                SELECT user_id FROM users
+                WHERE user_id > ? AND is_active = 1
+                ORDER BY user_id
+                LIMIT ?
+            """, (after_user_id, limit))
+            rows = await cursor.fetchall()
+            return [row[0] for row in rows]
+    
+    async def get_user_languages(self, user_ids: List[int]) -> Dict[int, str]:
+        """Preferred language of each of the given users; unknown users are left out"""
+        languages = {}
+        async with self._connect() as db:
+            for start in range(0, len(user_ids), 500):
+                batch = user_ids[start:start + 500]
+                cursor = await db.execute(
+                    f"SELECT user_id, language FROM users WHERE user_id IN ({','.join('?' * len(batch))})", batch
+                )
+                languages.update({user_id: language or 'fa' for user_id, language in await cursor.fetchall()})
+        return languages
+    
+    # Price alert methods
+    async def set_price_alert(self, user_id: int, collection: str, max_price: float) -> int:
+        """Create or replace the user's alert on a collection and return its ID"""
+        async with self._connect() as db:
+            cursor = await db.execute("""
+                INSERT INTO price_alerts (user_id, collection, max_price)
+                VALUES (?, ?, ?)
+                ON CONFLICT (user_id, collection) DO UPDATE SET
+                    max_price = excluded.max_price,
+                    created_at = CURRENT_TIMESTAMP
+                RETURNING id
+            """, (user_id, collection, max_price))
+            row = await cursor.fetchone()
+            await db.commit()
+            return row[0]
+    
+    async def delete_price_alert(self, alert_id: int, user_id: int) -> bool:
+        """Delete one of the user's alerts; False if it doesn't exist or isn't theirs"""
+        async with self._connect() as db:
+            cursor = await db.execute("DELETE FROM price_alerts WHERE id = ? AND user_id = ?", (alert_id, user_id))
+            await db.commit()
+            return cursor.rowcount == 1
+    
+    async def get_user_price_alerts(self, user_id: int) -> List[Dict[str, Any]]:
+        """Alerts of a user by collection"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(
+                "SELECT * FROM price_alerts WHERE user_id = ? ORDER BY collection", (user_id,)
+            )
+            return [dict(row) for row in await cursor.fetchall()]
+    
+    async def get_price_alerts(self) -> List[tuple]:
+        """(user_id, collection, max_price) of every alert of an active user, for the in-memory index"""
+        async with self._connect() as db:
+            cursor = await db.execute("""
+                SELECT a.user_id, a.collection, a.max_price FROM price_alerts a
+                JOIN users u ON u.user_id = a.user_id
+                WHERE u.is_active = 1
+            """)
+            return await cursor.fetchall()
+    
+    async def get_listings_version(self) -> str:
+        """Counter bumped by triggers whenever an ad enters, leaves or changes in the listings"""
+        return await self.get_job_state('listings_version', '0')
+    
+    async def get_price_alerts_version(self) -> str:
+        """Counter bumped by triggers whenever an alert is added, changed or deleted"""
+        return await self.get_job_state('price_alerts_version', '0')
+    
+    # Broadcast methods
+    async def create_broadcast(self, admin_id: int, source_chat_id: int, source_message_id: int) -> int:
+        """Create a draft broadcast of an admin's message"""
+        async with self._connect() as db:
+            cursor = await db.execute("""
+                INSERT INTO broadcasts (admin_id, source_chat_id, source_message_id)
+                VALUES (?, ?, ?)
+            """, (admin_id, source_chat_id, source_message_id))
+            await db.commit()
+            return cursor.lastrowid
+    
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        """Get broadcast by ID"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+    
+    async def get_running_broadcasts(self) -> List[Dict[str, Any]]:
+        """Get broadcasts that were interrupted while running"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+    
+    async def start_broadcast(self, broadcast_id: int, total_count: int, progress_chat_id: int, progress_message_id: int):
+        """Mark a draft broadcast as running"""
+        async with self._connect() as db:
+            await db.execute("""
+                UPDATE broadcasts
+                SET status = 'running', total_count = ?, progress_chat_id = ?, progress_message_id = ?
+                WHERE id = ? AND status = 'draft'
+            """, (total_count, progress_chat_id, progress_message_id, broadcast_id))
+            await db.commit()
+    
+    async def finish_broadcast(self, broadcast_id: int, status: str):
+        """Mark a broadcast as done or cancelled"""
+        async with self._connect() as db:
+            await db.execute("""
+                UPDATE broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (status, broadcast_id))
+            await db.commit()
+    
+    async def get_delivered_user_ids(self, broadcast_id: int, user_ids: List[int]) -> List[int]:
+        """Get which of the given users already have a recorded delivery"""
+        if not user_ids:
+            return []
+        placeholders = ",".join("?" * len(user_ids))
+        async with self._connect() as db:
+            cursor = await db.execute(f"""
+                SELECT user_id FROM broadcast_deliveries
+                WHERE broadcast_id = ? AND user_id IN ({placeholders})
+            """, [broadcast_id, *user_ids])
+            rows = await cursor.fetchall()
+            return [row[0] for row in rows]
+    
+    async def record_broadcast_delivery(self, broadcast_id: int, user_id: int, status: str) -> bool:
+        """
+        Store one recipient's delivery result and count it, deactivating the user if they blocked the bot.
+        Returns False if a result was already recorded for this recipient.
+        """
+        async with self._connect() as db:
+            cursor = await db.execute("""
+                INSERT INTO broadcast_deliveries (broadcast_id, user_id, status)
+                VALUES (?, ?, ?)
+                ON CONFLICT DO NOTHING
+            """, (broadcast_id, user_id, status))
+            if cursor.rowcount != 1:
+                return False
+            await db.execute("""
+                UPDATE broadcasts
+                SET sent_count = sent_count + ?, failed_count = failed_count + ?, blocked_count = blocked_count + ?
+                WHERE id = ?
+            """, (status == 'sent', status == 'failed', status == 'blocked', broadcast_id))
+            if status == 'blocked':
+                await db.execute("UPDATE users SET is_active = 0 WHERE user_id = ?", (user_id,))
+            await db.commit()
+            return True
+    
+    async def advance_broadcast_cursor(self, broadcast_id: int, last_user_id: int):
+        """Move a broadcast past a batch whose recipients all have a recorded result"""
+        async with self._connect() as db:
+            await db.execute("UPDATE broadcasts SET last_user_id = ? WHERE id = ?", (last_user_id, broadcast_id))
+            await db.commit()
+    
     async def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Get user by ID with stats including star payments and refunds"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
                 SELECT u.*, 
                        COUNT(DISTINCT a.id) as total_ads,
                        COUNT(DISTINCT CASE WHEN a.status = 'approved' THEN a.id END) as approved_ads,
                        COUNT(DISTINCT sr.id) as support_requests,
-                       COALESCE(SUM(CASE WHEN a.payment_status = 'paid' AND a.telegram_payment_charge_id IS NOT NULL THEN a.price ELSE 0 END), 0) as total_stars_paid,
-                       COALESCE(SUM(CASE WHEN a.status = 'rejected' AND a.payment_status = 'paid' AND a.refund_status = 'refunded' THEN a.price ELSE 0 END), 0) as total_stars_refunded
+                       COALESCE(lb.charged, 0) as total_stars_paid,
+                       COALESCE(lb.refunded, 0) as total_stars_refunded
                 FROM users u
                 LEFT JOIN ads a ON u.user_id = a.user_id
                 LEFT JOIN support_requests sr ON u.user_id = sr.user_id
+                LEFT JOIN ledger_balances lb ON u.user_id = lb.user_id
                 WHERE u.user_id = ?
                 GROUP BY u.user_id
             """, (user_id,))
@@ -345,7 +1769,7 @@ class Database:
     
     async def get_user_stats(self) -> Dict[str, int]:
         """Get general user statistics"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
                 SELECT 
@@ -364,7 +1788,7 @@ class Database:
     
     async def update_user_language(self, user_id: int, language: str):
         """Update user's preferred language"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("""
                 UPDATE users SET language = ?, last_seen = CURRENT_TIMESTAMP
                 WHERE user_id = ?
@@ -373,7 +1797,7 @@ class Database:
     
     async def get_user_language(self, user_id: int) -> str:
         """Get user's preferred language"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cursor = await db.execute("""
                 SELECT language FROM users WHERE user_id = ?
             """, (user_id,))
@@ -382,11 +1806,11 @@ class Database:
     
     async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Get user by ID - returns dictionary"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
                 SELECT user_id, username, first_name, last_name, language_code, 
-                       is_bot, is_premium, language, created_at, last_seen
+                       is_bot, is_premium, language, created_at, last_seen, is_active
                 FROM users WHERE user_id = ?
             """, (user_id,))
             row = await cursor.fetchone()
@@ -394,7 +1818,7 @@ class Database:
     
     async def get_all_paid_ads(self) -> List[Dict[str, Any]]:
         """Get all paid ads with telegram_payment_charge_id"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
                 SELECT a.*, u.username, u.first_name, u.last_name
@@ -408,19 +1832,236 @@ class Database:
     
     async def get_total_stars_paid(self) -> int:
         """Get total stars paid for all ads"""
-        async with aiosqlite.connect(self.db_path) as db:
+        balance = await self.get_ledger_balance()
+        return balance['charged']
+    
+    # Payments ledger methods
+    async def get_ledger_balance(self, user_id: int = 0) -> Dict[str, int]:
+        """Get the running ledger balance of a user (user_id 0 for global totals)"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
             cursor = await db.execute("""
-                SELECT COALESCE(SUM(stars_paid), 0) as total
-                FROM ads 
-                WHERE payment_status = 'paid' AND telegram_payment_charge_id IS NOT NULL
+                SELECT charged, refunded, adjusted, balance, entries
+                FROM ledger_balances WHERE user_id = ?
+            """, (user_id,))
+            row = await cursor.fetchone()
+            return dict(row) if row else {'charged': 0, 'refunded': 0, 'adjusted': 0, 'balance': 0, 'entries': 0}
+    
+    async def add_ledger_adjustment(self, user_id: int, amount: int, note: str = None) -> int:
+        """Append a manual adjustment (positive or negative) to the ledger"""
+        async with self._connect() as db:
+            cursor = await db.execute("""
+                INSERT INTO payments_ledger (user_id, kind, amount, note)
+                VALUES (?, 'adjustment', ?, ?)
+            """, (user_id, amount, note))
+            await db.commit()
+            return cursor.lastrowid
+    
+    async def reconcile_ledger(self, fix: bool = False) -> List[Dict[str, Any]]:
+        """
+        Re-derive balances from the ledger entries and return the rows that don't match ledger_balances.
+        With fix=True the balances are rebuilt from the ledger.
+        """
+        derived_sql = """
+            SELECT user_id,
+                   SUM(CASE WHEN kind = 'charge' THEN amount ELSE 0 END) as charged,
+                   SUM(CASE WHEN kind = 'refund' THEN amount ELSE 0 END) as refunded,
+                   SUM(CASE WHEN kind = 'adjustment' THEN amount ELSE 0 END) as adjusted,
+                   SUM(CASE WHEN kind = 'refund' THEN -amount ELSE amount END) as balance,
+                   COUNT(*) as entries
+            FROM payments_ledger
+            GROUP BY user_id
+            UNION ALL
+            SELECT 0,
+                   SUM(CASE WHEN kind = 'charge' THEN amount ELSE 0 END),
+                   SUM(CASE WHEN kind = 'refund' THEN amount ELSE 0 END),
+                   SUM(CASE WHEN kind = 'adjustment' THEN amount ELSE 0 END),
+                   SUM(CASE WHEN kind = 'refund' THEN -amount ELSE amount END),
+                   COUNT(*)
+            FROM payments_ledger
+            HAVING COUNT(*) > 0
+        """
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(f"""
+                WITH derived AS ({derived_sql})
+                SELECT COALESCE(d.user_id, b.user_id) as user_id,
+                       d.balance as derived_balance, b.balance as stored_balance,
+                       d.entries as derived_entries, b.entries as stored_entries
+                FROM derived d
+                LEFT JOIN ledger_balances b ON b.user_id = d.user_id
+                WHERE b.user_id IS NULL OR d.charged != b.charged OR d.refunded != b.refunded
+                      OR d.adjusted != b.adjusted OR d.balance != b.balance OR d.entries != b.entries
+                UNION ALL
+                SELECT b.user_id, NULL, b.balance, NULL, b.entries
+                FROM ledger_balances b
+                WHERE b.user_id NOT IN (SELECT user_id FROM derived)
+            """)
+            mismatches = [dict(row) for row in await cursor.fetchall()]
+            
+            if fix and mismatches:
+                await db.execute("DELETE FROM ledger_balances")
+                await db.execute(f"""
+                    INSERT INTO ledger_balances (user_id, charged, refunded, adjusted, balance, entries)
+                    {derived_sql}
+                """)
+                await db.commit()
+            
+            return mismatches
+    
+    # Dead-letter methods
+    async def add_dead_letter(self, method: str, payload: str, error: str, error_kind: str, context: str = None) -> int:
+        """Store a Bot API call that failed permanently"""
+        async with self._connect() as db:
+            cursor = await db.execute("""
+                INSERT INTO dead_letters (method, payload, error, error_kind, context)
+                VALUES (?, ?, ?, ?, ?)
+            """, (method, payload, error, error_kind, context))
+            await db.commit()
+            return cursor.lastrowid
+    
+    async def get_dead_letters(self, status: str = 'pending', limit: int = 100, after_id: int = 0) -> List[Dict[str, Any]]:
+        """Get the oldest dead letters with a given status (keyset pagination by ID)"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("""
+                SELECT * FROM dead_letters
+                WHERE status = ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+            """, (status, after_id, limit))
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+    
+    async def get_dead_letter_summary(self) -> List[Dict[str, Any]]:
+        """Count pending dead letters per method and error kind"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("""
+                SELECT method, error_kind, COUNT(*) as count
+                FROM dead_letters
+                WHERE status = 'pending'
+                GROUP BY method, error_kind
+                ORDER BY count DESC
             """)
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+    
+    async def update_dead_letter(self, dead_letter_id: int, status: str, error: str = None):
+        """Record the outcome of a dead letter replay"""
+        async with self._connect() as db:
+            await db.execute("""
+                UPDATE dead_letters
+                SET status = ?, error = COALESCE(?, error), attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (status, error, dead_letter_id))
+            await db.commit()
+    
+    async def discard_dead_letters(self) -> int:
+        """Discard all pending dead letters"""
+        async with self._connect() as db:
+            cursor = await db.execute("""
+                UPDATE dead_letters SET status = 'discarded', updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'pending'
+            """)
+            await db.commit()
+            return cursor.rowcount
+    
+    # Reconciliation methods
+    async def get_job_state(self, key: str, default: str = None) -> Optional[str]:
+        """Get a stored background job value"""
+        async with self._connect() as db:
+            cursor = await db.execute("SELECT value FROM job_state WHERE key = ?", (key,))
             row = await cursor.fetchone()
-            return row[0] if row else 0
+            return row[0] if row else default
+    
+    async def get_ads_by_charge_ids(self, charge_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get ads by payment charge ID (their own payment or a bump), keyed by charge ID"""
+        if not charge_ids:
+            return {}
+        placeholders = ",".join("?" * len(charge_ids))
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(f"""
+                SELECT id, user_id, telegram_payment_charge_id, payment_status, refund_status, stars_paid
+                FROM ads
+                WHERE telegram_payment_charge_id IN ({placeholders})
+                UNION ALL
+                SELECT ad_id, user_id, telegram_payment_charge_id, 'paid', refund_status, stars_paid
+                FROM ad_bumps
+                WHERE telegram_payment_charge_id IN ({placeholders})
+            """, charge_ids * 2)
+            rows = await cursor.fetchall()
+            return {row['telegram_payment_charge_id']: dict(row) for row in rows}
+    
+    async def save_star_transactions_page(self, transactions: List[Dict[str, Any]], discrepancies: List[Dict[str, Any]],
+                                          watermark_key: str, watermark: int):
+        """Store one page of reconciled transactions, its discrepancies and the new watermark in one transaction"""
+        async with self._connect() as db:
+            await db.executemany("""
+                INSERT OR IGNORE INTO star_transactions (id, direction, user_id, amount, date)
+                VALUES (:id, :direction, :user_id, :amount, :date)
+            """, transactions)
+            await db.executemany("""
+                INSERT OR IGNORE INTO reconciliation_discrepancies (transaction_id, ad_id, kind, details)
+                VALUES (:transaction_id, :ad_id, :kind, :details)
+            """, discrepancies)
+            # A refund that shows up late resolves its 'refund_missing' discrepancy
+            await db.executemany("""
+                UPDATE reconciliation_discrepancies SET status = 'resolved'
+                WHERE transaction_id = ? AND kind = 'refund_missing' AND status = 'open'
+            """, [(t['id'],) for t in transactions if t['direction'] == 'out'])
+            await db.execute("""
+                INSERT INTO job_state (key, value) VALUES (?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value
+            """, (watermark_key, str(watermark)))
+            await db.commit()
+    
+    async def record_missing_refunds(self) -> int:
+        """Flag ads marked refunded whose charge was seen but whose refund transaction wasn't"""
+        async with self._connect() as db:
+            cursor = await db.execute("""
+                INSERT OR IGNORE INTO reconciliation_discrepancies (transaction_id, ad_id, kind, details)
+                SELECT a.telegram_payment_charge_id, a.id, 'refund_missing', 'ad is marked refunded but Telegram has no refund'
+                FROM ads a
+                JOIN star_transactions c ON c.id = a.telegram_payment_charge_id AND c.direction = 'in'
+                LEFT JOIN star_transactions r ON r.id = a.telegram_payment_charge_id AND r.direction = 'out'
+                WHERE a.refund_status = 'refunded' AND r.id IS NULL
+            """)
+            await db.commit()
+            return cursor.rowcount
+    
+    async def get_discrepancy_summary(self) -> List[Dict[str, Any]]:
+        """Count open reconciliation discrepancies per kind"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("""
+                SELECT kind, COUNT(*) as count
+                FROM reconciliation_discrepancies
+                WHERE status = 'open'
+                GROUP BY kind
+                ORDER BY count DESC
+            """)
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+    
+    async def get_open_discrepancies(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Get the latest open reconciliation discrepancies"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("""
+                SELECT * FROM reconciliation_discrepancies
+                WHERE status = 'open'
+                ORDER BY id DESC
+                LIMIT ?
+            """, (limit,))
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
     
     # Spam Control Methods
     async def check_spam_limit(self, user_id: int, action_type: str, daily_limit: int = None, hourly_limit: int = None, cooldown_seconds: int = None) -> Dict[str, Any]:
         """Check if user has exceeded spam limits"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             db.row_factory = aiosqlite.Row
             
             # Get current spam control record
@@ -486,7 +2127,7 @@ class Database:
     
     async def reset_spam_limits(self, user_id: int, action_type: str = None):
         """Reset spam limits for a user"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             if action_type:
                 await db.execute("""
                     DELETE FROM spam_control WHERE user_id = ? AND action_type = ?
@@ -503,7 +2144,7 @@ class Database:
         today = now.date()
         current_hour = now.hour
         
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             # Check if record exists
             cursor = await db.execute(
                 "SELECT * FROM spam_control WHERE user_id = ? AND action_type = ?",
@@ -535,4 +2176,135 @@ class Database:
                     (user_id, action_type, now.isoformat(), 1, 1, str(today), current_hour)
                 )
             
-            await db.commit()
\ No newline at end of file
+            await db.commit()
+
+async def _benchmark_payments(charges: int, copies: int) -> str:
+    import tempfile
+    import time
+    
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'payments.db'))
+        await db.init_db()
+        drafts = []
+        for i in range(charges):
+            await db.add_user(i + 1, first_name='User')
+            drafts.append(await db.save_ad_draft(i + 1, f"https://t.me/nft/benchgift-{i + 1}", '10'))
+        
+        # The copies of one payment race each other, as redelivered and concurrent updates would
+        began = time.perf_counter()
+        results = []
+        for draft_id in drafts:
+            results += await asyncio.gather(*(db.create_paid_ad(draft_id, f"charge_{draft_id}", 10) for _ in range(copies)))
+        elapsed = time.perf_counter() - began
+        
+        deliveries = charges * copies
+        created = sum(1 for _, was_created in results if was_created)
+        async with db._connect() as connection:
+            cursor = await connection.execute("SELECT COUNT(*), COUNT(DISTINCT telegram_payment_charge_id) FROM ads")
+            ads, distinct_charges = await cursor.fetchone()
+    return (f"{deliveries} deliveries of {charges} payments in {elapsed:.2f}s "
+            f"({elapsed / deliveries * 1000:.1f}ms each): {created} created, "
+            f"{deliveries - created} returned the existing ad; {ads} ads for {distinct_charges} charges")
+
+def benchmark_payments(charges: int, copies: int = 8) -> str:
+    """Deliver every payment copies times at once and check that each charge creates exactly one ad"""
+    return asyncio.run(_benchmark_payments(charges, copies))
+
+async def _benchmark_search(ads: int, sellers: int, repeats: int) -> str:
+    import random
+    import sqlite3
+    import statistics
+    import tempfile
+    import time
+    
+    rng = random.Random(1)
+    collections = ['plushpepe', 'durovscap', 'lootbag', 'signetring', 'swisswatch', 'homemadecake', 'lovepotion', 'vintagecigar']
+    words = ['فوری', 'ارزان', 'کمیاب', 'تخفیف', 'اصل', 'rare', 'cheap', 'urgent', 'mint', 'classic', 'limited', 'gift']
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'search.db')
+        db = Database(path)
+        await db.init_db()
+        # Bulk load through the triggers that keep ads_fts in sync
+        with sqlite3.connect(path) as connection:
+            connection.executemany(
+                "INSERT INTO users (user_id, username, first_name) VALUES (?, ?, 'User')",
+                ((user_id, f"seller{user_id}") for user_id in range(1, sellers + 1))
+            )
+            rows = []
+            for _ in range(ads):
+                collection = rng.choice(collections)
+                item = rng.randint(1, 100000)
+                link = f"https://t.me/nft/{collection}-{item}"
+                description = ' '.join(rng.choice(words) for _ in range(rng.randint(2, 8)))
+                rows.append((rng.randint(1, sellers), link, str(rng.randint(1, 500)), link, description))
+            connection.executemany(
+                "INSERT INTO ads (user_id, gift_link, price, canonical_link, description) VALUES (?, ?, ?, ?, ?)", rows
+            )
+        
+        queries = [('plushpepe', 0), ('plushpepe 1234', 0), ('seller42', 0), ('فوری ارزان', 0), ('plushpepe', 2990)]
+        results = []
+        for text, offset in queries:
+            timings = []
+            for _ in range(repeats):
+                began = time.perf_counter()
+                total, _ = await db.search_ads(text, offset=offset)
+                timings.append(time.perf_counter() - began)
+            page = f", page {offset // 10 + 1}" if offset else ""
+            results.append(f'"{text}"{page} ({total} hits): {statistics.median(timings) * 1000:.1f}ms')
+        
+        began = time.perf_counter()
+        await db.rebuild_ads_search()
+        rebuilt = time.perf_counter() - began
+    return f"{ads} ads from {sellers} sellers, median of {repeats}: " + '; '.join(results) + f"; rebuild {rebuilt:.1f}s"
+
+def benchmark_search(ads: int, sellers: int = 20000, repeats: int = 5) -> str:
+    """Time /find queries of increasing breadth, deep pagination and a full index rebuild"""
+    return asyncio.run(_benchmark_search(ads, sellers, repeats))
+
+async def _benchmark_users(users: int, repeats: int) -> str:
+    import random
+    import sqlite3
+    import statistics
+    import tempfile
+    import time
+    
+    rng = random.Random(1)
+    first_names = ['Ali', 'Reza', 'Maryam', 'Sara', 'Mohammad', 'Ivan', 'Olga', 'John', 'علی', 'رضا', 'مریم', 'سارا', 'محمد']
+    last_names = ['Ahmadi', 'Karimi', 'Rezaei', 'Petrov', 'Smith', 'احمدی', 'کریمی', 'رضایی', None]
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'users.db')
+        db = Database(path)
+        await db.init_db()
+        # Bulk load through the triggers that keep users_fts in sync
+        with sqlite3.connect(path) as connection:
+            connection.executemany(
+                "INSERT INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)",
+                ((user_id, f"user{user_id}" if rng.random() < 0.7 else None, rng.choice(first_names), rng.choice(last_names))
+                 for user_id in range(1, users + 1))
+            )
+        
+        queries = [('@user4242', 0), ('ali', 0), ('reza ahmadi', 0), ('مریم احمدی', 0), ('m', 0), ('ali', 990)]
+        results = []
+        for text, offset in queries:
+            timings = []
+            for _ in range(repeats):
+                began = time.perf_counter()
+                total, _, truncated = await db.search_users(text, offset=offset)
+                timings.append(time.perf_counter() - began)
+            page = ", last page" if offset else ""
+            results.append(f'"{text}"{page} ({total}{"+" if truncated else ""} hits): {statistics.median(timings) * 1000:.1f}ms')
+    return f"{users} users, median of {repeats} including the connection: " + '; '.join(results)
+
+def benchmark_users(users: int, repeats: int = 5) -> str:
+    """Time admin user searches: exact username, common names, Persian names, one letter and the last page"""
+    return asyncio.run(_benchmark_users(users, repeats))
+
+if __name__ == '__main__':
+    import sys
+    benchmarks = {'payments': (benchmark_payments, 200), 'search': (benchmark_search, 300000), 'users': (benchmark_users, 1000000)}
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        sys.exit(f"usage: python database.py {{{','.join(benchmarks)}}} [size]")
+    run, size = benchmarks[sys.argv[1]]
+    print(run(int(sys.argv[2]) if len(sys.argv) > 2 else size))
@@ -0,0 +1,106 @@
+"""
+In-memory ad drafts with idle expiry and a size cap.
+
+    python draft_store.py 24    # 24 simulated hours of users abandoning the ad form
+"""
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, MutableMapping
+
+class DraftStore(MutableMapping):
+    """
+    In-flight ad drafts keyed by user ID, kept in least-recently-touched order.
+    Entries expire after ttl seconds without access and the oldest ones are evicted beyond max_entries.
+    Paid ads never depend on this store: drafts are persisted before an invoice is sent.
+    """
+    
+    def __init__(self, ttl: float, max_entries: int, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        # user_id -> (last touched, draft); the first entry is the least recently touched
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.evicted = 0
+    
+    def __getitem__(self, user_id: int) -> Dict[str, Any]:
+        draft = self._entries[user_id][1]
+        self._entries[user_id] = (self.clock(), draft)
+        self._entries.move_to_end(user_id)
+        return draft
+    
+    def __setitem__(self, user_id: int, draft: Dict[str, Any]):
+        self._entries[user_id] = (self.clock(), draft)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+    
+    def __delitem__(self, user_id: int):
+        del self._entries[user_id]
+    
+    def __contains__(self, user_id: object) -> bool:
+        # Membership checks don't count as a touch
+        return user_id in self._entries
+    
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._entries)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def sweep(self) -> int:
+        """Drop drafts untouched for longer than the TTL and return how many were removed"""
+        deadline = self.clock() - self.ttl
+        removed = 0
+        while self._entries:
+            user_id, (touched, _) = next(iter(self._entries.items()))
+            if touched > deadline:
+                break
+            self._entries.popitem(last=False)
+            removed += 1
+        self.evicted += removed
+        return removed
+    
+    def approximate_bytes(self) -> int:
+        """Shallow size of the store plus each draft and its values"""
+        total = sys.getsizeof(self._entries)
+        for _, draft in self._entries.values():
+            total += sys.getsizeof(draft) + sum(sys.getsizeof(value) for value in draft.values())
+        return total
+
+def benchmark(hours: int, users_per_sweep: int = 300, sweep_interval: float = 300, ttl: float = 3600,
+              max_entries: int = 10000) -> str:
+    """
+    Simulate hours of new users who each abandon the ad form, on a fake clock with the bot's sweep interval,
+    and report the store's size and traced memory once the TTL has been reached
+    """
+    now = [0.0]
+    store = DraftStore(ttl, max_entries, clock=lambda: now[0])
+    user_id = 0
+    sizes, memory = [], []
+    
+    tracemalloc.start()
+    began = time.perf_counter()
+    for sweep in range(int(hours * 3600 / sweep_interval)):
+        for _ in range(users_per_sweep):
+            user_id += 1
+            store[user_id] = {'gift_link': f"https://t.me/nft/Gift-{user_id}", 'language': 'fa'}
+            store[user_id]['description'] = 'توضیحات آگهی ' * 10
+            store[user_id]['price'] = '12.5'
+        now[0] += sweep_interval
+        store.sweep()
+        if now[0] >= ttl:
+            sizes.append(len(store))
+            memory.append(tracemalloc.get_traced_memory()[0])
+    elapsed = time.perf_counter() - began
+    tracemalloc.stop()
+    if not sizes:
+        return f"{hours}h is shorter than the {ttl:g}s TTL"
+    return (f"{user_id} abandoned drafts over {hours}h with a {ttl:g}s TTL: {min(sizes)}-{max(sizes)} drafts "
+            f"(~{store.approximate_bytes() / 1e6:.1f} MB), traced memory {min(memory) / 1024:.0f}-{max(memory) / 1024:.0f} KiB "
+            f"after the first TTL; {store.evicted} evicted; {elapsed / (user_id * 4) * 1e6:.2f}us per access")
+
+if __name__ == '__main__':
+    print(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 24))
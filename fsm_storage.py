@@ -0,0 +1,151 @@
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Mapping, Optional
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage, MemoryStorageRecord
+
+class TTLMemoryStorage(MemoryStorage):
+    """
+    MemoryStorage that remembers when each key was last used so abandoned states can be swept.
+    Reads no longer create records: the stock defaultdict kept one for every user who ever wrote to the bot.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self.touched: Dict[StorageKey, float] = {}
+    
+    def _record(self, key: StorageKey) -> Optional[MemoryStorageRecord]:
+        record = self.storage.get(key)
+        if record is not None:
+            self.touched[key] = time.monotonic()
+        return record
+    
+    def _forget_if_empty(self, key: StorageKey):
+        record = self.storage.get(key)
+        if record is not None and record.state is None and not record.data:
+            del self.storage[key]
+            self.touched.pop(key, None)
+    
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await super().set_state(key, state)
+        self.touched[key] = time.monotonic()
+        self._forget_if_empty(key)
+    
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._record(key)
+        return record.state if record else None
+    
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await super().set_data(key, data)
+        self.touched[key] = time.monotonic()
+        self._forget_if_empty(key)
+    
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._record(key)
+        return record.data.copy() if record else {}
+    
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Optional[Any] = None) -> Optional[Any]:
+        return (await self.get_data(storage_key)).get(dict_key, default)
+    
+    async def sweep(self, ttl: float) -> int:
+        """Drop states untouched for longer than ttl seconds and return how many were removed"""
+        deadline = time.monotonic() - ttl
+        expired = [key for key, touched in self.touched.items() if touched <= deadline]
+        for key in expired:
+            del self.touched[key]
+            self.storage.pop(key, None)
+        return len(expired)
+    
+    async def entry_count(self) -> int:
+        return len(self.storage)
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage in SQLite, so several bot processes (and restarts) share user states"""
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._ready = False
+    
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ':'.join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+    
+    @asynccontextmanager
+    async def _connect(self):
+        # One connection per call, like Database: a shared connection would queue every
+        # FSM lookup of the process behind a single statement waiting on a write lock
+        async with aiosqlite.connect(self.db_path) as db:
+            if not self._ready:
+                await db.execute("""
+                    CREATE TABLE IF NOT EXISTS fsm_states (
+                        key TEXT PRIMARY KEY,
+                        state TEXT,
+                        data TEXT NOT NULL DEFAULT '{}',
+                        updated_at REAL
+                    ) WITHOUT ROWID
+                """)
+                # Add updated_at column if it doesn't exist
+                try:
+                    await db.execute("ALTER TABLE fsm_states ADD COLUMN updated_at REAL")
+                except aiosqlite.OperationalError:
+                    pass  # Column already exists
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states(updated_at)")
+                await db.commit()
+                self._ready = True
+            yield db
+    
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        async with self._connect() as db:
+            await db.execute("""
+                INSERT INTO fsm_states (key, state, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+            """, (self._key(key), value, time.time()))
+            await db.commit()
+    
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        async with self._connect() as db:
+            async with db.execute("SELECT state FROM fsm_states WHERE key = ?", (self._key(key),)) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else None
+    
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        async with self._connect() as db:
+            await db.execute("""
+                INSERT INTO fsm_states (key, data, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            """, (self._key(key), json.dumps(dict(data), ensure_ascii=False), time.time()))
+            await db.commit()
+    
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        async with self._connect() as db:
+            async with db.execute("SELECT data FROM fsm_states WHERE key = ?", (self._key(key),)) as cursor:
+                row = await cursor.fetchone()
+                return json.loads(row[0]) if row else {}
+    
+    async def sweep(self, ttl: float) -> int:
+        """
+        Delete states not written for longer than ttl seconds, plus rows left empty by state.clear().
+        Rows from before updated_at existed count as stale.
+        """
+        async with self._connect() as db:
+            cursor = await db.execute(
+                "DELETE FROM fsm_states WHERE updated_at IS NULL OR updated_at <= ? OR (state IS NULL AND data = '{}')",
+                (time.time() - ttl,)
+            )
+            await db.commit()
+            return cursor.rowcount
+    
+    async def entry_count(self) -> int:
+        async with self._connect() as db:
+            async with db.execute("SELECT COUNT(*) FROM fsm_states") as cursor:
+                return (await cursor.fetchone())[0]
+    
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,96 @@
+"""
+Gift and channel link parsing.
+
+    python links.py 200000    # fuzz with random Telegram-like inputs and time parsing
+"""
+import random
+import re
+import string
+import sys
+import time
+from typing import NamedTuple, Optional
+
+# One pass over the input: optional scheme/host, then a gift slug, an invite hash,
+# a private channel ID or a public username (optionally followed by a post path)
+LINK_PATTERN = re.compile(
+    r"""
+    ^(?:
+        (?:(?:https?://)?(?:www\.)?(?:t|telegram)\.me/)
+        (?:
+            nft/(?P<gift>[A-Za-z0-9]+)(?:-(?P<item>\d+))?
+          | \+(?P<invite>[\w-]+)
+          | c/(?P<private>\d+)
+          | (?P<path_username>[A-Za-z0-9_]+)
+        )
+        (?:/[^\s?#]*)?(?:[?#]\S*)?
+      | @(?P<at_username>[A-Za-z0-9_]+)
+    )$
+    """,
+    re.IGNORECASE | re.VERBOSE
+)
+
+class ParsedLink(NamedTuple):
+    kind: str  # 'gift' or 'channel'
+    collection: Optional[str]  # lowercase gift collection slug, None for channels
+    item: Optional[int]  # gift number within its collection
+    canonical: str
+
+def parse_link(text: str) -> Optional[ParsedLink]:
+    """
+    Classify a gift or channel link and normalise it, or return None if it isn't one we accept.
+    t.me/nft/X, https://t.me/nft/x and www.t.me/nft/X all give the same canonical URL, as do @name and t.me/name/123.
+    """
+    match = LINK_PATTERN.match(text.strip())
+    if not match:
+        return None
+    
+    gift = match.group('gift')
+    if gift:
+        collection = gift.lower()
+        item = match.group('item')
+        if item is None:
+            return ParsedLink('gift', collection, None, f"https://t.me/nft/{collection}")
+        return ParsedLink('gift', collection, int(item), f"https://t.me/nft/{collection}-{int(item)}")
+    
+    # Invite hashes are case-sensitive; usernames are not
+    invite = match.group('invite')
+    if invite:
+        return ParsedLink('channel', None, None, f"https://t.me/+{invite}")
+    private = match.group('private')
+    if private:
+        return ParsedLink('channel', None, None, f"https://t.me/c/{private}")
+    
+    username = (match.group('path_username') or match.group('at_username')).lower()
+    # Bots and the link-only paths of t.me are not channels
+    if '_bot' in username or username in ('nft', 'joinchat', 'c', 'addstickers', 'share', 'proxy', 'socks'):
+        return None
+    return ParsedLink('channel', None, None, f"https://t.me/{username}")
+
+def _random_link(rng: random.Random) -> str:
+    prefix = rng.choice(['', 'http://', 'https://', 'https://www.', 'HTTPS://', ' ', 'ftp://'])
+    host = rng.choice(['t.me/', 'telegram.me/', 'T.ME/', 'x.me/', '@', ''])
+    path = rng.choice(['nft/', 'NFT/', '+', 'c/', 'joinchat/', '', '', 'nft/-'])
+    alphabet = rng.choice([string.ascii_letters, string.ascii_letters + string.digits + '_', string.digits,
+                           string.printable, 'абвгд-_'])
+    slug = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 16)))
+    suffix = rng.choice(['', '', f"-{rng.randint(0, 10 ** 6)}", f"/{rng.randint(1, 999)}", '?start=1', '#x', ' ', '/a b'])
+    return prefix + host + path + slug + suffix
+
+def benchmark(inputs: int) -> str:
+    """Parse random inputs, check that every accepted link parses to itself from its canonical URL, and time it"""
+    rng = random.Random(1)
+    texts = [_random_link(rng) for _ in range(inputs)]
+    
+    began = time.perf_counter()
+    parsed = [parse_link(text) for text in texts]
+    elapsed = time.perf_counter() - began
+    
+    accepted = [(text, link) for text, link in zip(texts, parsed) if link]
+    unstable = [text for text, link in accepted if parse_link(link.canonical) != link]
+    for text in unstable[:5]:
+        print(f"not stable: {text!r}", file=sys.stderr)
+    return (f"{inputs} inputs parsed in {elapsed * 1000:.0f}ms ({elapsed / inputs * 1e6:.2f}us per link); "
+            f"{len(accepted)} accepted, {len(unstable)} don't re-parse to themselves from their canonical URL")
+
+if __name__ == '__main__':
+    print(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200000))
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class LoadGuard:
+    """Track event loop lag and running handlers, and decide when low-priority work should be shed"""
+    
+    def __init__(self, lag_threshold: float = 0.5, in_flight_threshold: int = 100, interval: float = 0.5):
+        self.lag_threshold = lag_threshold
+        self.in_flight_threshold = in_flight_threshold
+        self.interval = interval
+        self.lag = 0.0
+        self.in_flight = 0
+        self._deferred: List[Callable[[], Awaitable[None]]] = []
+    
+    @property
+    def overloaded(self) -> bool:
+        return self.lag >= self.lag_threshold or self.in_flight >= self.in_flight_threshold
+    
+    def enter(self):
+        self.in_flight += 1
+        metrics.handlers_in_flight.set(self.in_flight)
+    
+    def exit(self):
+        self.in_flight -= 1
+        metrics.handlers_in_flight.set(self.in_flight)
+    
+    async def run_or_defer(self, make_call: Callable[[], Awaitable[None]]):
+        """Run a non-urgent call now, or keep it until the load drops"""
+        if self.overloaded:
+            self._deferred.append(make_call)
+            return
+        await make_call()
+    
+    async def wait_until_idle(self):
+        """Block background work (e.g. broadcasts) while the bot is overloaded"""
+        while self.overloaded:
+            await asyncio.sleep(self.interval)
+    
+    async def _flush_deferred(self):
+        deferred, self._deferred = self._deferred, []
+        for make_call in deferred:
+            try:
+                await make_call()
+            except Exception as e:
+                logger.error("Error running deferred call: %s", e)
+    
+    async def monitor(self):
+        """Measure how late the loop wakes a sleeping task; the delay is time other callbacks held the loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - start - self.interval)
+            metrics.loop_lag_seconds.set(self.lag)
+            
+            if self._deferred and not self.overloaded:
+                await self._flush_deferred()
@@ -0,0 +1,157 @@
+"""
+Structured logging that formats and writes records off the event loop.
+
+    python logging_config.py 20000 100    # time per log call on the loop, with a sink taking 100us per write
+"""
+import contextvars
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional, TextIO
+
+# Fields attached to every record logged while an update is being handled
+CONTEXT_FIELDS = ('update_id', 'user_id', 'handler', 'ad_id')
+
+log_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar('log_context', default={})
+
+def bind_log_context(**fields) -> contextvars.Token:
+    """Add fields to the log context of the current task; reset with log_context.reset(token)"""
+    return log_context.set({**log_context.get(), **fields})
+
+class ContextFilter(logging.Filter):
+    """Copy the current log context onto the record; runs on the event loop before the record is queued"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        for field, value in log_context.get().items():
+            if not hasattr(record, field):
+                setattr(record, field, value)
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of INFO and DEBUG records from noisy loggers; warnings and errors always pass"""
+    
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name)
+        return rate is None or random.random() < rate
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue records without formatting them, so message formatting happens on the listener thread.
+    Log arguments in this bot are IDs, strings and exceptions, which are safe to format later.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the context fields when present"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def parse_sample_rates(value: Optional[str]) -> Dict[str, float]:
+    """Parse 'logger=rate,logger=rate' into a dict"""
+    rates = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            name, rate = item.split('=', 1)
+            rates[name.strip()] = float(rate)
+    return rates
+
+def setup_logging(level: int = logging.INFO, json_output: bool = False,
+                  sample_rates: Optional[Dict[str, float]] = None, stream: Optional[TextIO] = None) -> QueueListener:
+    """Route all logging through a queue to a background listener thread and return the started listener"""
+    output = logging.StreamHandler(stream)
+    if json_output:
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+    queue_handler.addFilter(ContextFilter())
+    
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
+
+class _BenchmarkSink:
+    """Stream taking delay seconds per write, like a slow terminal, pipe or log shipper"""
+    
+    def __init__(self, delay: float):
+        self.delay = delay
+    
+    def write(self, text: str):
+        if self.delay:
+            time.sleep(self.delay)
+    
+    def flush(self):
+        pass
+
+def benchmark(calls: int, sink_delay: float = 0.0) -> str:
+    """
+    Time per-ad INFO logs on the calling thread: basicConfig with f-strings (writing inline)
+    against setup_logging with lazy arguments, plain and with JSON output and 10% sampling
+    """
+    root = logging.getLogger()
+    saved = root.handlers[:], root.level
+    logger = logging.getLogger('main.items')
+    sink = _BenchmarkSink(sink_delay)
+    results = []
+    try:
+        root.handlers[:] = []
+        logging.basicConfig(level=logging.INFO, stream=sink, format='%(levelname)s:%(name)s:%(message)s')
+        began = time.perf_counter()
+        for ad_id in range(calls):
+            logger.info(f"Ad {ad_id} sent to SUPER_ADMIN_ID: {195742142}")
+        results.append(f"basicConfig + f-strings {(time.perf_counter() - began) / calls * 1e6:.1f}us")
+        
+        for label, options in (('setup_logging', {}), ('JSON', {'json_output': True}),
+                               ('JSON + 10% sampling', {'json_output': True, 'sample_rates': {'main.items': 0.1}})):
+            listener = setup_logging(stream=sink, **options)
+            token = bind_log_context(update_id=1, user_id=195742142, handler='approve_ad')
+            began = time.perf_counter()
+            for ad_id in range(calls):
+                logger.info("Ad %s sent to SUPER_ADMIN_ID: %s", ad_id, 195742142, extra={'ad_id': ad_id})
+            elapsed = time.perf_counter() - began
+            log_context.reset(token)
+            began = time.perf_counter()
+            listener.stop()
+            results.append(f"{label} {elapsed / calls * 1e6:.1f}us (listener drained {time.perf_counter() - began:.2f}s later)")
+    finally:
+        root.handlers[:], level = saved
+        root.setLevel(level)
+    return f"{calls} INFO logs per run, sink {sink_delay * 1e6:g}us per write; time per call on the loop: " + '; '.join(results)
+
+if __name__ == '__main__':
+    print(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+                    float(sys.argv[2]) / 1e6 if len(sys.argv) > 2 else 0.0))
@@ -1,29 +1,65 @@
 import asyncio
 import logging
+import math
+import multiprocessing
 import os
+import time
 from typing import Dict, Any
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.types import (
     Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,
-    LabeledPrice, PreCheckoutQuery, ContentType, ReplyKeyboardMarkup, KeyboardButton
+    LabeledPrice, PreCheckoutQuery, ContentType, ReplyKeyboardMarkup, KeyboardButton,
+    InputMediaPhoto, BufferedInputFile, InlineQuery, InlineQueryResultArticle, InlineQueryResultCachedPhoto,
+    InputTextMessageContent, ChatMemberUpdated
 )
-from aiogram.methods import RefundStarPayment
+from aiogram.methods import (
+    RefundStarPayment, SendMessage, SendPhoto, SendMediaGroup, EditMessageText, EditMessageCaption, DeleteMessage
+)
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from fsm_storage import SQLiteStorage, TTLMemoryStorage
 from dotenv import load_dotenv
 
-from database import Database
+from database import Database, market_median
+from draft_store import DraftStore
+from cache import QueryCache
+from links import parse_link
+from alerts import AlertIndex
+from timer_wheel import TimerWheel
+from throttling import RateLimiter, SharedRateLimiter
+from broadcast import BroadcastRunner
+from retry import call_with_retry, replay_dead_letters
+from reconciliation import reconcile_star_transactions, reconciliation_worker
+from middlewares import (
+    UpdateRecorderMiddleware, UserSerialMiddleware, UpdateStatsMiddleware, LogContextMiddleware, HandlerTimingMiddleware, LoadSheddingMiddleware, RequestTimingMiddleware
+)
+from load_guard import LoadGuard
+from recording import Anonymizer, UpdateRecorder
+from profiling import profile_cpu, profile_memory
+from sharding import ADMIN_WORKER, route_update, run_ingress, consume_updates
+from logging_config import setup_logging, parse_sample_rates
+import metrics
 from translations import get_text, get_language_keyboard, get_main_menu_keyboard, get_back_keyboard, get_admin_response_keyboard, get_super_admin_keyboard, get_channel_photo_keyboard, get_ad_preview_keyboard, TRANSLATIONS
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging: records are queued on the event loop and written by a background thread
+def configure_logging():
+    return setup_logging(
+        level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper()),
+        json_output=os.getenv('LOG_JSON', 'false').lower() == 'true',
+        sample_rates=parse_sample_rates(os.getenv('LOG_SAMPLE_RATES'))
+    )
+
+log_listener = configure_logging()
 logger = logging.getLogger(__name__)
+# Per-item logs (one line per ad in loops), sampled through LOG_SAMPLE_RATES
+item_logger = logging.getLogger('main.items')
 
 # Bot configuration
 BOT_TOKEN = os.getenv('BOT_TOKEN')
@@ -33,6 +69,7 @@ CHANNEL_ID = os.getenv('CHANNEL_ID', '-1001234567890')  # Default channel ID
 CHANNEL_NAME = os.getenv('CHANNEL_NAME', 'کانال آگهی‌ها')
 STARS_AMOUNT = int(os.getenv('STARS_AMOUNT', 10))
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'ads_bot.db')
+BOT_API_URL = os.getenv('BOT_API_URL')  # Optional local Bot API server, e.g. http://localhost:8081
 
 # Anti-spam settings
 AD_COOLDOWN_SECONDS = int(os.getenv('AD_COOLDOWN_SECONDS', 30))  # seconds between ad submissions
@@ -40,6 +77,56 @@ AD_DAILY_LIMIT = int(os.getenv('AD_DAILY_LIMIT', 5))  # Maximum ads per day
 SUPPORT_COOLDOWN_SECONDS = int(os.getenv('SUPPORT_COOLDOWN_SECONDS', 60))  # seconds between support messages
 SUPPORT_HOURLY_LIMIT = int(os.getenv('SUPPORT_HOURLY_LIMIT', 3))  # Maximum support requests per hour
 
+# Relisting of a gift or channel that is already live: off, flag (warn admins) or block (refuse at submission)
+RELIST_POLICY = os.getenv('RELIST_POLICY', 'flag').lower()
+RELIST_WINDOW_HOURS = int(os.getenv('RELIST_WINDOW_HOURS', 168))  # Only earlier ads from this window count, 0 = any time
+
+# Digest publishing settings
+DIGEST_MODE = os.getenv('DIGEST_MODE', 'false').lower() in ('1', 'true', 'yes')  # Batch approved ads into one channel post
+DIGEST_SIZE = max(2, min(int(os.getenv('DIGEST_SIZE', 5)), 10))  # Ads per digest post (albums hold at most 10 items)
+DIGEST_INTERVAL_SECONDS = int(os.getenv('DIGEST_INTERVAL_SECONDS', 300))  # Publish partial digests after this delay
+
+# Bot API throughput limits
+CHANNEL_POSTS_PER_MINUTE = int(os.getenv('CHANNEL_POSTS_PER_MINUTE', 20))  # Telegram allows about 20 posts per minute in one chat
+MESSAGES_PER_SECOND = int(os.getenv('MESSAGES_PER_SECOND', 25))  # Stay below the global limit of 30 messages per second
+BULK_MODERATION_PAGE_SIZE = int(os.getenv('BULK_MODERATION_PAGE_SIZE', 30))  # Pending ads listed for bulk moderation
+FIND_PAGE_SIZE = int(os.getenv('FIND_PAGE_SIZE', 10))  # Ads per page of /find results
+INLINE_CACHE_SECONDS = int(os.getenv('INLINE_CACHE_SECONDS', 30))  # Lifetime of inline search results, in Telegram and in process
+INLINE_CACHE_ENTRIES = int(os.getenv('INLINE_CACHE_ENTRIES', 1000))  # Recent inline queries kept in process
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', 5))  # Ads per page of the "Browse ads" catalog
+CATALOG_CACHE_SECONDS = int(os.getenv('CATALOG_CACHE_SECONDS', 60))  # Lifetime of rendered catalog pages
+MAX_ALERTS_PER_USER = int(os.getenv('MAX_ALERTS_PER_USER', 20))  # Price alerts one user may keep
+ALERT_BATCH_SIZE = int(os.getenv('ALERT_BATCH_SIZE', 100))  # Price alert notifications sent per batch
+MARKET_DAYS = int(os.getenv('MARKET_DAYS', 7))  # Days of daily rollups shown by /market
+AD_REMIND_AFTER_HOURS = int(os.getenv('AD_REMIND_AFTER_HOURS', 168))  # Ask sellers to confirm a listed ad after this age, 0 disables reminders and expiry
+AD_CONFIRM_HOURS = int(os.getenv('AD_CONFIRM_HOURS', 48))  # Unconfirmed ads expire this long after the reminder
+BUMP_STARS = int(os.getenv('BUMP_STARS', 0))  # Stars for posting a listed ad to the channel again, 0 disables bumps
+USERS_PAGE_SIZE = int(os.getenv('USERS_PAGE_SIZE', 20))  # Users per page of user lists and user search results
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 10))  # Parallel sends during a broadcast
+
+# Traffic capture for replay (see replay.py); empty disables it
+RECORD_UPDATES_PATH = os.getenv('RECORD_UPDATES_PATH')  # JSON lines file, gzip-compressed when it ends in .gz
+RECORD_SALT = os.getenv('RECORD_SALT', '')  # Keeps pseudonymous IDs stable across restarts; random when empty
+
+# Multi-process mode: one polling process routes updates to an admin worker plus WORKERS user workers
+WORKERS = int(os.getenv('WORKERS', 0))  # Experimental, measured slower than one process under typical load; 0 runs everything in a single process
+
+# Star transaction reconciliation
+RECONCILE_INTERVAL_SECONDS = int(os.getenv('RECONCILE_INTERVAL_SECONDS', 3600))  # 0 disables the background job
+
+# Instrumentation
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))  # Prometheus endpoint port (worker N uses port + N), 0 disables it
+
+# Load shedding: past either threshold, low-priority handlers are refused and admin logs deferred
+LOOP_LAG_THRESHOLD_MS = int(os.getenv('LOOP_LAG_THRESHOLD_MS', 500))
+MAX_IN_FLIGHT_HANDLERS = int(os.getenv('MAX_IN_FLIGHT_HANDLERS', 100))
+
+# Abandoned ad drafts and FSM states are dropped after these idle times
+DRAFT_TTL_SECONDS = int(os.getenv('DRAFT_TTL_SECONDS', 86400))
+DRAFT_MAX_ENTRIES = int(os.getenv('DRAFT_MAX_ENTRIES', 10000))  # Least recently used drafts are evicted beyond this
+FSM_TTL_SECONDS = int(os.getenv('FSM_TTL_SECONDS', 86400))
+STATE_SWEEP_INTERVAL_SECONDS = int(os.getenv('STATE_SWEEP_INTERVAL_SECONDS', 300))
+
 # Messages
 WELCOME_MESSAGE = os.getenv('WELCOME_MESSAGE')
 PRICE_REQUEST_MESSAGE = os.getenv('PRICE_REQUEST_MESSAGE')
@@ -50,11 +137,45 @@ AD_REJECTED_MESSAGE = os.getenv('AD_REJECTED_MESSAGE')
 AD_TAG_TEXT = os.getenv('AD_TAG_TEXT')
 
 # Initialize bot and dispatcher
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session)
+# FSM states must be visible to every worker process, so multi-process mode keeps them in SQLite
+storage = SQLiteStorage(DATABASE_PATH) if WORKERS else TTLMemoryStorage()
 dp = Dispatcher(storage=storage)
 db = Database(DATABASE_PATH)
 
+load_guard = LoadGuard(LOOP_LAG_THRESHOLD_MS / 1000, MAX_IN_FLIGHT_HANDLERS)
+
+# Run each user's updates in order; different users still run in parallel
+dp.update.outer_middleware(UserSerialMiddleware())
+
+# Instrumentation: statements per update, log context, load shedding, handler latency and Bot API latency
+dp.update.outer_middleware(UpdateStatsMiddleware())
+dp.update.outer_middleware(LogContextMiddleware())
+for observer in (dp.message, dp.callback_query, dp.pre_checkout_query, dp.inline_query):
+    observer.middleware(LoadSheddingMiddleware(load_guard))
+    observer.middleware(HandlerTimingMiddleware())
+bot.session.middleware(RequestTimingMiddleware())
+
+# Strong references to fire-and-forget tasks; the event loop only keeps weak ones
+background_tasks = set()
+
+def _background_task_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error("Background task %s failed", task.get_name(), exc_info=task.exception())
+
+def spawn_background(coro) -> asyncio.Task:
+    """Run coro without awaiting it, keeping the task alive and logging its failure"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+# Shared rate limiters for outgoing Bot API calls
+channel_limiter = RateLimiter(CHANNEL_POSTS_PER_MINUTE, per=60)
+message_limiter = RateLimiter(MESSAGES_PER_SECOND, burst=MESSAGES_PER_SECOND)
+
 # States
 class AdStates(StatesGroup):
     waiting_for_language = State()
@@ -73,13 +194,47 @@ class AdminStates(StatesGroup):
     waiting_for_user_id = State()
     waiting_for_rejection_reason = State()
 
+class BroadcastStates(StatesGroup):
+    waiting_for_broadcast_message = State()
+
 class ManualRefundStates(StatesGroup):
     waiting_for_user_id = State()
     waiting_for_amount = State()
     waiting_for_transaction_id = State()
 
-# User data storage
-user_ads: Dict[int, Dict[str, Any]] = {}
+# Capture anonymised updates for replay, after UserSerialMiddleware so the recorded FSM state is current
+update_recorder = None
+if RECORD_UPDATES_PATH:
+    salt = RECORD_SALT.encode() or os.urandom(16)
+    # Free text in these states is personal or names a user or charge
+    scrubbed_states = [
+        SupportStates.waiting_for_support_message, SupportStates.waiting_for_admin_response,
+        AdminStates.waiting_for_user_id, ManualRefundStates.waiting_for_user_id,
+        ManualRefundStates.waiting_for_transaction_id
+    ]
+    anonymizer = Anonymizer(salt, SUPER_ADMIN_ID, SUPPORT_ADMIN_ID, [state.state for state in scrubbed_states])
+    update_recorder = UpdateRecorder(RECORD_UPDATES_PATH, anonymizer)
+    dp.update.outer_middleware(UpdateRecorderMiddleware(update_recorder))
+
+# In-flight ad drafts by user ID
+user_ads = DraftStore(DRAFT_TTL_SECONDS, DRAFT_MAX_ENTRIES)
+
+# Recent inline search results and rendered catalog pages, keyed by the listings version so any change to a listed ad misses
+listing_cache = QueryCache(INLINE_CACHE_ENTRIES, INLINE_CACHE_SECONDS)
+catalog_cache = QueryCache(INLINE_CACHE_ENTRIES, CATALOG_CACHE_SECONDS)
+INLINE_RESULTS_PER_PAGE = 20
+
+# Catalog price filters in TON as (min, max), inclusive; the callback data carries the index
+PRICE_RANGES = [(None, None), (None, 10), (10, 50), (50, 200), (200, None)]
+
+# Price alerts of all users by collection, reloaded when the price_alerts table has changed
+alert_index = AlertIndex()
+alert_index_version = None
+
+# Ad lifecycle timers due within the horizon are held in a timing wheel, so the due time index
+# is read once per half horizon instead of polled every second
+LIFECYCLE_HORIZON_SECONDS = 300
+LIFECYCLE_LOAD_LIMIT = 10000
 
 @dp.message(Command('start'))
 async def start_handler(message: Message, state: FSMContext):
@@ -90,6 +245,9 @@ async def start_handler(message: Message, state: FSMContext):
     existing_user = await db.get_user(user.id)
     if existing_user:
         language = existing_user.get('language', 'fa')  # Get language from dictionary
+        # A returning user may have blocked the bot before
+        if not existing_user.get('is_active', 1):
+            await db.set_user_active(user.id, True)
         # If user already has a language preference, show main menu
         await message.answer(
             get_text('welcome_message', language),
@@ -117,6 +275,13 @@ async def start_handler(message: Message, state: FSMContext):
     
     await state.clear()
 
+@dp.my_chat_member(F.chat.type == 'private')
+async def bot_blocked_or_unblocked(update: ChatMemberUpdated):
+    """Keep is_active in step with the user blocking (kicked) or unblocking (member) the bot"""
+    status = update.new_chat_member.status
+    if status in ('kicked', 'member'):
+        await db.set_user_active(update.from_user.id, status == 'member')
+
 # Handle text messages for Reply Keyboard
 @dp.message(F.text.in_(["📝 ثبت آگهی جدید", "📝 Разместить новое объявление", "📝 Post New Ad"]))
 async def new_ad_handler(message: Message, state: FSMContext):
@@ -234,35 +399,261 @@ async def my_ads_handler(message: Message, state: FSMContext):
     await message.answer(get_text('my_ads_title', language))
     
     for ad in user_ads:
-        # Create ad text
-        status_text = get_text('ad_status_sold', language) if ad.get('sold_status') == 'sold' else get_text('ad_status_available', language)
-        ad_text = f"🆔 ID: {ad['id']}\n"
-        ad_text += f"🎁 {ad['gift_link']}\n"
-        ad_text += f"💰 {get_text('price', language)}: {ad['price']}\n"
-        ad_text += f"📝 {get_text('description', language)}: {ad['description']}\n"
-        ad_text += f"📊 {get_text('status', language)}: {ad['status']}\n"
-        ad_text += f"🔄 {status_text}\n"
-        ad_text += f"📅 {ad['created_at'][:10]}"
-        
-        # Create inline keyboard for ad management
-        keyboard = []
-        if ad.get('sold_status') == 'sold':
-            keyboard.append([InlineKeyboardButton(
-                text=get_text('mark_as_available_button', language),
-                callback_data=f"mark_available_{ad['id']}"
-            )])
-        else:
+        ad_text, keyboard = build_my_ad_view(ad, language)
+        await message.answer(ad_text, reply_markup=keyboard)
+    
+    await state.clear()
+
+def build_my_ad_view(ad: Dict[str, Any], language: str) -> tuple:
+    """Text and management keyboard of one of the user's ads"""
+    status_key = {'sold': 'ad_status_sold', 'expired': 'ad_status_expired'}.get(ad.get('sold_status'), 'ad_status_available')
+    ad_text = f"🆔 ID: {ad['id']}\n"
+    ad_text += f"🎁 {ad['gift_link']}\n"
+    ad_text += f"💰 {get_text('price', language)}: {ad['price']}\n"
+    ad_text += f"📝 {get_text('description', language)}: {ad['description']}\n"
+    ad_text += f"📊 {get_text('status', language)}: {ad['status']}\n"
+    ad_text += f"🔄 {get_text(status_key, language)}\n"
+    ad_text += f"📅 {ad['created_at'][:10]}"
+    
+    keyboard = []
+    if ad.get('sold_status') in ('sold', 'expired'):
+        keyboard.append([InlineKeyboardButton(
+            text=get_text('mark_as_available_button', language),
+            callback_data=f"mark_available_{ad['id']}"
+        )])
+    else:
+        keyboard.append([InlineKeyboardButton(
+            text=get_text('mark_as_sold_button', language),
+            callback_data=f"mark_sold_{ad['id']}"
+        )])
+        if BUMP_STARS and ad['status'] == 'approved':
             keyboard.append([InlineKeyboardButton(
-                text=get_text('mark_as_sold_button', language),
-                callback_data=f"mark_sold_{ad['id']}"
+                text=get_text('bump_button', language, stars=BUMP_STARS),
+                callback_data=f"bump_{ad['id']}"
             )])
-        
-        await message.answer(
-            ad_text,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
-        )
+    return ad_text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def price_range_label(index: int, language: str) -> str:
+    low, high = PRICE_RANGES[index]
+    if low is None and high is None:
+        return get_text('browse_any_price', language)
+    if low is None:
+        return f"≤ {high}"
+    if high is None:
+        return f"{low}+"
+    return f"{low}–{high}"
+
+async def render_catalog_page(kind: str, price_index: int, direction: str, cursor: int, language: str):
+    """
+    Text and keyboard of one catalog page, cached per filter, cursor and language.
+    cursor is the ad ID the page continues from (0 for the newest ads); direction is 'next' for
+    older ads and 'prev' for newer ones.
+    """
+    # The listings version in the key makes changes by any worker process miss
+    key = (await db.get_listings_version(), kind, price_index, direction, cursor, language)
+    page = catalog_cache.get(key)
+    if page is not None:
+        return page
+    
+    low, high = PRICE_RANGES[price_index]
+    ads = await db.get_listed_ads_page(
+        link_kind=None if kind == 'all' else kind, min_price=low, max_price=high,
+        before_id=cursor if direction == 'next' and cursor else None,
+        after_id=cursor if direction == 'prev' else None,
+        limit=CATALOG_PAGE_SIZE
+    )
+    # The extra row only tells whether there is another page in the reading direction
+    if direction == 'prev':
+        has_newer, has_older = len(ads) > CATALOG_PAGE_SIZE, True
+        ads = ads[-CATALOG_PAGE_SIZE:]
+    else:
+        has_newer, has_older = bool(cursor), len(ads) > CATALOG_PAGE_SIZE
+        ads = ads[:CATALOG_PAGE_SIZE]
+    
+    text = get_text('browse_title', language) + "\n\n"
+    if not ads:
+        text += get_text('browse_empty', language)
+    for ad in ads:
+        icon = "🎁" if ad.get('link_kind') == 'gift' else "📺"
+        text += f"{icon} {ad['gift_link']}\n💰 {ad['price']} TON | 👤 @{ad.get('username') or '—'}\n"
+        if ad.get('description') and ad['description'] != 'توضیحات ندارد':
+            text += f"📝 {ad['description'][:100]}\n"
+        text += "\n"
+    
+    # Filter buttons start over from the newest ads; the selected ones do nothing
+    def filter_button(label: str, selected: bool, data: str) -> InlineKeyboardButton:
+        return InlineKeyboardButton(text=f"✅ {label}" if selected else label, callback_data="browse_current" if selected else data)
+    
+    keyboard = [
+        [
+            filter_button(get_text(label, language), kind == value, f"browse_{value}_{price_index}_next_0")
+            for value, label in (('all', 'browse_all'), ('gift', 'browse_gifts'), ('channel', 'browse_channels'))
+        ],
+        [
+            filter_button(price_range_label(index, language), index == price_index, f"browse_{kind}_{index}_next_0")
+            for index in range(len(PRICE_RANGES))
+        ]
+    ]
+    navigation = []
+    if has_newer and ads:
+        navigation.append(InlineKeyboardButton(
+            text=get_text('previous_page_button', language), callback_data=f"browse_{kind}_{price_index}_prev_{ads[0]['id']}"
+        ))
+    if has_older and ads:
+        navigation.append(InlineKeyboardButton(
+            text=get_text('next_page_button', language), callback_data=f"browse_{kind}_{price_index}_next_{ads[-1]['id']}"
+        ))
+    if navigation:
+        keyboard.append(navigation)
     
+    page = (text[:4096], InlineKeyboardMarkup(inline_keyboard=keyboard))
+    catalog_cache.set(key, page)
+    return page
+
+@dp.message(F.text.in_(["🛍 مشاهده آگهی‌ها", "🛍 Смотреть объявления", "🛍 Browse Ads"]), flags={'low_priority': True})
+async def browse_handler(message: Message, state: FSMContext):
+    """Handle browse ads button: the newest listings, browsed in one editable message"""
     await state.clear()
+    language = await db.get_user_language(message.from_user.id)
+    text, keyboard = await render_catalog_page('all', 0, 'next', 0, language)
+    await message.answer(text, reply_markup=keyboard, disable_web_page_preview=True)
+
+@dp.callback_query(F.data.startswith("browse_"), flags={'low_priority': True})
+async def browse_callback(callback: CallbackQuery):
+    """Change the catalog filters or page"""
+    if callback.data == "browse_current":
+        await callback.answer()
+        return
+    
+    _, kind, price_index, direction, cursor = callback.data.split("_")
+    language = await db.get_user_language(callback.from_user.id)
+    text, keyboard = await render_catalog_page(kind, int(price_index), direction, int(cursor), language)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard, disable_web_page_preview=True)
+    except Exception:
+        pass  # Page unchanged since it was shown
+    await callback.answer()
+
+@dp.message(Command('alert'))
+async def alert_command(message: Message):
+    """Handle /alert <collection or gift link> <max price>: notify the user of matching new listings"""
+    user_id = message.from_user.id
+    language = await db.get_user_language(user_id)
+    args = message.text.split()[1:]
+    if len(args) != 2:
+        await message.answer(get_text('alert_usage', language))
+        return
+    
+    # A gift link stands for its collection
+    parsed = parse_link(args[0])
+    if parsed and parsed.kind == 'gift':
+        collection = parsed.collection
+    elif args[0].isascii() and args[0].isalnum():
+        collection = args[0].lower()
+    else:
+        await message.answer(get_text('alert_usage', language))
+        return
+    
+    try:
+        max_price = float(args[1])
+        if not math.isfinite(max_price) or max_price < 0:
+            raise ValueError
+    except ValueError:
+        await message.answer(get_text('invalid_price', language))
+        return
+    
+    alerts = await db.get_user_price_alerts(user_id)
+    if len(alerts) >= MAX_ALERTS_PER_USER and all(alert['collection'] != collection for alert in alerts):
+        await message.answer(get_text('alert_limit', language, limit=MAX_ALERTS_PER_USER))
+        return
+    
+    await db.set_price_alert(user_id, collection, max_price)
+    await message.answer(get_text('alert_saved', language, collection=collection, max_price=f"{max_price:g}"))
+
+def build_alerts_keyboard(alerts: list) -> InlineKeyboardMarkup:
+    """One delete button per price alert"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"🗑 {alert['collection']} ≤ {alert['max_price']:g} TON", callback_data=f"alert_delete_{alert['id']}")]
+        for alert in alerts
+    ])
+
+@dp.message(Command('alerts'))
+async def alerts_command(message: Message):
+    """List the user's price alerts with delete buttons"""
+    user_id = message.from_user.id
+    language = await db.get_user_language(user_id)
+    alerts = await db.get_user_price_alerts(user_id)
+    if not alerts:
+        await message.answer(get_text('alerts_empty', language))
+        return
+    
+    await message.answer(get_text('alerts_title', language), reply_markup=build_alerts_keyboard(alerts))
+
+@dp.callback_query(F.data.startswith("alert_delete_"))
+async def delete_alert_callback(callback: CallbackQuery):
+    """Delete one of the user's price alerts and refresh the list"""
+    user_id = callback.from_user.id
+    language = await db.get_user_language(user_id)
+    await db.delete_price_alert(int(callback.data.split("_")[2]), user_id)
+    
+    alerts = await db.get_user_price_alerts(user_id)
+    if alerts:
+        await callback.message.edit_text(get_text('alerts_title', language), reply_markup=build_alerts_keyboard(alerts))
+    else:
+        await callback.message.edit_text(get_text('alerts_empty', language))
+    await callback.answer(get_text('alert_deleted', language))
+
+def merge_market_days(days: list) -> dict:
+    """Combine market rollup rows into one with the same counts, bounds and histograms"""
+    merged = {}
+    for column in ('listed', 'sold'):
+        counted = [day for day in days if day[column]]
+        merged[column] = sum(day[column] for day in counted)
+        merged[f'{column}_min'] = min((day[f'{column}_min'] for day in counted), default=None)
+        merged[f'{column}_max'] = max((day[f'{column}_max'] for day in counted), default=None)
+        merged[f'{column}_histogram'] = [sum(counts) for counts in zip(*(day[f'{column}_histogram'] for day in days))]
+    return merged
+
+def format_price_spread(day: dict, column: str) -> str:
+    """min / median / max of the 'listed' or 'sold' prices of a rollup row, or a dash if there are none"""
+    if not day[column]:
+        return "—"
+    low, high = day[f'{column}_min'], day[f'{column}_max']
+    # The median is read from a histogram and only accurate to ~9%, so it is rounded to three digits
+    median = float(f"{market_median(day[f'{column}_histogram'], low, high):.3g}")
+    return f"{low:g} / ~{median:g} / {high:g}"
+
+@dp.message(Command('market'), flags={'low_priority': True})
+async def market_command(message: Message):
+    """Handle /market <collection>: listings, sales and prices of the last MARKET_DAYS days from the daily rollup"""
+    language = await db.get_user_language(message.from_user.id)
+    args = message.text.split()[1:]
+    parsed = parse_link(args[0]) if args else None
+    if parsed and parsed.kind == 'gift':
+        collection = parsed.collection
+    elif len(args) == 1 and args[0].isascii() and args[0].isalnum():
+        collection = args[0].lower()
+    else:
+        await message.answer(get_text('market_usage', language))
+        return
+    
+    days = await db.get_market_history(collection, MARKET_DAYS)
+    if not days:
+        await message.answer(get_text('market_empty', language, collection=collection, days=MARKET_DAYS))
+        return
+    
+    lines = [
+        f"{day['day'][5:]} | 📥 {day['listed']} | 🤝 {day['sold']} | 💰 {format_price_spread(day, 'listed')}"
+        for day in days
+    ]
+    total = merge_market_days(days)
+    
+    text = get_text('market_title', language, collection=collection, days=MARKET_DAYS) + "\n\n"
+    text += get_text('market_totals', language, listed=total['listed'], sold=total['sold']) + "\n"
+    text += get_text('market_listed_prices', language, prices=format_price_spread(total, 'listed')) + "\n"
+    text += get_text('market_sold_prices', language, prices=format_price_spread(total, 'sold')) + "\n\n"
+    text += "\n".join(lines)
+    await message.answer(text)
 
 @dp.callback_query(F.data.startswith("mark_sold_"))
 async def mark_ad_as_sold(callback: CallbackQuery):
@@ -280,8 +671,9 @@ async def mark_ad_as_sold(callback: CallbackQuery):
         await callback.answer(get_text('no_permission', language), show_alert=True)
         return
     
-    # Update sold status
+    # Update sold status; a sold ad needs no more reminders
     await db.update_sold_status(ad_id, 'sold')
+    await db.delete_ad_timer(ad_id)
     
     # Update channel message if ad is approved
     if ad['status'] == 'approved':
@@ -311,115 +703,294 @@ async def mark_ad_as_available(callback: CallbackQuery):
     # Update sold status
     await db.update_sold_status(ad_id, 'available')
     
-    # Update channel message if ad is approved
+    # Update channel message if ad is approved, and start its reminders again
     if ad['status'] == 'approved':
         await update_channel_ad_text(ad_id, 'available')
+        await restart_ad_lifecycle([ad_id])
     
     await callback.answer(get_text('mark_as_available_success', language), show_alert=True)
     
     # Refresh the ad display
     await refresh_ad_display(callback, ad_id, language)
 
+@dp.callback_query(F.data.startswith("confirm_available_"))
+async def confirm_ad_available(callback: CallbackQuery):
+    """Seller confirmed from a reminder that the ad is still for sale"""
+    ad_id = int(callback.data.split("_")[2])
+    user_id = callback.from_user.id
+    language = await db.get_user_language(user_id)
+    
+    ad = await db.get_ad(ad_id)
+    if not ad or ad['user_id'] != user_id:
+        await callback.answer(get_text('no_permission', language), show_alert=True)
+        return
+    
+    # A reminder answered after the ad was sold or expired just shows its current state
+    if ad['status'] == 'approved' and ad.get('sold_status') == 'available':
+        await restart_ad_lifecycle([ad_id])
+        await callback.answer(get_text('ad_confirmed', language), show_alert=True)
+    else:
+        await callback.answer()
+    await refresh_ad_display(callback, ad_id, language)
+
+@dp.callback_query(F.data.startswith("bump_"))
+async def bump_ad(callback: CallbackQuery):
+    """Send the invoice for bumping a listed ad"""
+    ad_id = int(callback.data.split("_")[1])
+    user_id = callback.from_user.id
+    language = await db.get_user_language(user_id)
+    
+    ad = await db.get_ad(ad_id)
+    if not ad or ad['user_id'] != user_id:
+        await callback.answer(get_text('no_permission', language), show_alert=True)
+        return
+    if not BUMP_STARS or ad['status'] != 'approved' or ad.get('sold_status') != 'available':
+        await callback.answer(get_text('bump_unavailable', language), show_alert=True)
+        return
+    
+    await callback.message.answer_invoice(
+        title=get_text('bump_title', language),
+        description=get_text('bump_description', language),
+        payload=f"ad_bump_{ad_id}",
+        provider_token="",  # Empty for Telegram Stars
+        currency="XTR",
+        prices=[LabeledPrice(label=get_text('bump_label', language), amount=BUMP_STARS)]
+    )
+    await callback.answer()
+
 async def refresh_ad_display(callback: CallbackQuery, ad_id: int, language: str):
     """Refresh the ad display after status change"""
     ad = await db.get_ad(ad_id)
     if not ad:
         return
     
-    # Create updated ad text
-    status_text = get_text('ad_status_sold', language) if ad.get('sold_status') == 'sold' else get_text('ad_status_available', language)
-    ad_text = f"🆔 ID: {ad['id']}\n"
-    ad_text += f"🎁 {ad['gift_link']}\n"
-    ad_text += f"💰 {get_text('price', language)}: {ad['price']}\n"
-    ad_text += f"📝 {get_text('description', language)}: {ad['description']}\n"
-    ad_text += f"📊 {get_text('status', language)}: {ad['status']}\n"
-    ad_text += f"🔄 {status_text}\n"
-    ad_text += f"📅 {ad['created_at'][:10]}"
-    
-    # Create updated inline keyboard
-    keyboard = []
-    if ad.get('sold_status') == 'sold':
-        keyboard.append([InlineKeyboardButton(
-            text=get_text('mark_as_available_button', language),
-            callback_data=f"mark_available_{ad['id']}"
-        )])
-    else:
-        keyboard.append([InlineKeyboardButton(
-            text=get_text('mark_as_sold_button', language),
-            callback_data=f"mark_sold_{ad['id']}"
-        )])
-    
+    ad_text, keyboard = build_my_ad_view(ad, language)
     try:
-        await callback.message.edit_text(
-            ad_text,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
-        )
+        await callback.message.edit_text(ad_text, reply_markup=keyboard)
     except:
         pass  # Message might be the same
 
-async def update_channel_ad_text(ad_id: int, sold_status: str):
-    """Update the ad text in the channel to show sold status"""
-    ad = await db.get_ad(ad_id)
-    if not ad or ad['status'] != 'approved' or not ad.get('channel_message_id'):
-        return
+def build_channel_message(ad: Dict[str, Any], sold_status: str = 'available') -> str:
+    """Build the channel post text for a single ad"""
+    # Determine if it's a gift or channel for channel message
+    gift_link = ad.get('gift_link') or 'لینک ندارد'
+    is_gift = '/nft/' in gift_link if gift_link != 'لینک ندارد' else False
     
-    try:
-        # Determine if it's a gift or channel for channel message
-        gift_link = ad.get('gift_link') or 'لینک ندارد'
-        is_gift = '/nft/' in gift_link if gift_link != 'لینک ندارد' else False
-        
-        # Get description
-        description = ad.get('description') or 'توضیحات ندارد'
-        description_text = f"\n📝 {description}" if description and description != 'توضیحات ندارد' else ""
-        
-        # Handle all fields safely
-        username = ad.get('username') or 'ناشناس'
-        gift_link = ad.get('gift_link') or 'لینک ندارد'
-        price = ad.get('price') or '0'
-        
-        # Add sold status to message
-        sold_text = "\n\n🔴 SOLD" if sold_status == 'sold' else ""
-        
-        if is_gift:
-            # Gift message
-            channel_message = f"""🎁 {gift_link}
+    # Get description
+    description = ad.get('description') or 'توضیحات ندارد'
+    description_text = f"\n📝 {description}" if description and description != 'توضیحات ندارد' else ""
+    
+    # Handle all fields safely
+    username = ad.get('username') or 'ناشناس'
+    price = ad.get('price') or '0'
+    
+    # Add sold or expired status to message
+    sold_text = {'sold': "\n\n🔴 SOLD", 'expired': "\n\n⌛ EXPIRED"}.get(sold_status, "")
+    
+    if is_gift:
+        # Gift message
+        return f"""🎁 {gift_link}
 💰 Price: {price} TON
 👤 Seller: @{username}{description_text}
 
 📢 Ad posted on {CHANNEL_NAME}
 
 ⚠️ Only trade on trusted marketplaces like <a href="https://t.me/portals/market?startapp=d15jj7">Portals</a>, <a href="https://t.me/tonnel_network_bot/gifts?startapp=ref_195742142">Tonnel</a>, and <a href="https://t.me/mrkt/app?startapp=195742142">Mrkt</a>!{sold_text}"""
-        else:
-            # Channel message
-            channel_message = f"""📺 {gift_link}
+    
+    # Channel message
+    return f"""📺 {gift_link}
 💰 Price: {price} TON
 👤 Seller: @{username}{description_text}
 
 📢 Ad posted on {CHANNEL_NAME}
 
 ⚠️ Please verify the channel before joining!{sold_text}"""
-        
+
+def build_inline_result(ad: Dict[str, Any]):
+    """Inline search result for an ad; sending it posts the same text as the channel"""
+    if ad.get('link_collection') and ad.get('link_item'):
+        title = f"🎁 {ad['link_collection']} #{ad['link_item']}"
+    else:
+        title = ("🎁 " if ad.get('link_kind') == 'gift' else "📺 ") + (ad.get('gift_link') or '')
+    description = f"💰 {ad.get('price') or '0'} TON"
+    if ad.get('description') and ad['description'] != 'توضیحات ندارد':
+        description += f" | {ad['description'][:80]}"
+    
+    if ad.get('channel_photo'):
+        return InlineQueryResultCachedPhoto(
+            id=str(ad['id']), photo_file_id=ad['channel_photo'], title=title, description=description,
+            caption=build_channel_message(ad), parse_mode='HTML'
+        )
+    return InlineQueryResultArticle(
+        id=str(ad['id']), title=title, description=description,
+        input_message_content=InputTextMessageContent(message_text=build_channel_message(ad), parse_mode='HTML')
+    )
+
+# Telegram limits message text to 4096 UTF-16 code units after entity parsing; raw HTML is never shorter
+TELEGRAM_TEXT_LIMIT = 4096
+
+def telegram_length(text: str) -> int:
+    """Length of text as Telegram counts it, in UTF-16 code units"""
+    return len(text.encode('utf-16-le')) // 2
+
+def build_digest_message(ads: list) -> str:
+    """Build one combined channel post for several text ads"""
+    items = []
+    for ad in ads:
+        gift_link = ad.get('gift_link') or 'لینک ندارد'
+        icon = "🎁" if '/nft/' in gift_link else "📺"
+        description = ad.get('description') or 'توضیحات ندارد'
+        item = f"{icon} {gift_link}\n💰 Price: {ad.get('price') or '0'} TON\n👤 Seller: @{ad.get('username') or 'ناشناس'}"
+        if description != 'توضیحات ندارد':
+            item += f"\n📝 {description}"
+        if ad.get('sold_status') == 'sold':
+            item += "\n🔴 SOLD"
+        elif ad.get('sold_status') == 'expired':
+            item += "\n⌛ EXPIRED"
+        items.append(item)
+    
+    return "\n\n➖➖➖\n\n".join(items) + f"""
+
+📢 Ads posted on {CHANNEL_NAME}
+
+⚠️ Only trade on trusted marketplaces and verify channels before joining!"""
+
+def split_digest(ads: list) -> list:
+    """
+    Group text ads into digest posts that stay within Telegram's length limit,
+    measured with every ad marked expired so later status edits still fit.
+    An ad too long for any digest gets a post of its own.
+    """
+    posts, rendered = [], []
+    for ad in ads:
+        marked = {**ad, 'sold_status': 'expired'}
+        if rendered and telegram_length(build_digest_message(rendered[-1] + [marked])) <= TELEGRAM_TEXT_LIMIT:
+            posts[-1].append(ad)
+            rendered[-1].append(marked)
+        else:
+            posts.append([ad])
+            rendered.append([marked])
+    return posts
+
+async def publish_ad_to_channel(ad_data: Dict[str, Any]):
+    """Publish an approved ad to the channel, or queue it for the next digest"""
+    if DIGEST_MODE:
+        await db.queue_ad_for_digest(ad_data['id'])
+        if await db.count_digest_queue() >= DIGEST_SIZE:
+            await flush_digest()
+        return
+    
+    # Send to channel with photo if available
+    channel_message = build_channel_message(ad_data)
+    channel_photo = ad_data.get('channel_photo')
+    if channel_photo:
+        method = SendPhoto(chat_id=CHANNEL_ID, photo=channel_photo, caption=channel_message, parse_mode='HTML')
+    else:
+        method = SendMessage(chat_id=CHANNEL_ID, text=channel_message, parse_mode='HTML')
+    channel_msg = await call_with_retry(bot, method, db=db, context={'kind': 'channel_post', 'ad_ids': [ad_data['id']]})
+    
+    # Store channel message ID for future updates
+    await db.update_channel_message_id(ad_data['id'], channel_msg.message_id)
+
+digest_lock = asyncio.Lock()
+
+async def flush_digest(force: bool = False):
+    """Publish queued ads as digest posts: photo ads as one album, text ads as combined messages within the length limit"""
+    async with digest_lock:
+        while True:
+            queued_ads = await db.get_digest_queue(DIGEST_SIZE)
+            if not queued_ads or (len(queued_ads) < DIGEST_SIZE and not force):
+                return
+            
+            photo_ads = [ad for ad in queued_ads if ad.get('channel_photo')]
+            text_ads = [ad for ad in queued_ads if not ad.get('channel_photo')]
+            message_ids = []
+            
+            posts = []
+            if len(photo_ads) == 1:
+                ad = photo_ads[0]
+                posts.append((photo_ads, SendPhoto(chat_id=CHANNEL_ID, photo=ad['channel_photo'], caption=build_channel_message(ad), parse_mode='HTML')))
+            elif photo_ads:
+                # Every album item is its own message, so each ad keeps its own message ID
+                posts.append((photo_ads, SendMediaGroup(chat_id=CHANNEL_ID, media=[
+                    InputMediaPhoto(media=ad['channel_photo'], caption=build_channel_message(ad), parse_mode='HTML')
+                    for ad in photo_ads
+                ])))
+            for post_ads in split_digest(text_ads):
+                posts.append((post_ads, SendMessage(chat_id=CHANNEL_ID, text=build_digest_message(post_ads), parse_mode='HTML')))
+            
+            for post_ads, method in posts:
+                ad_ids = [ad['id'] for ad in post_ads]
+                try:
+                    result = await call_with_retry(bot, method, db=db, context={'kind': 'channel_post', 'ad_ids': ad_ids})
+                except Exception as e:
+                    # The post is in the dead-letter table now; dequeue it so it can't block later digests
+                    logger.error("Error publishing digest for ads %s: %s", ad_ids, e)
+                    message_ids.extend((ad_id, None) for ad_id in ad_ids)
+                    continue
+                message_ids.extend(map_channel_message_ids(ad_ids, result))
+            
+            await db.set_digest_message_ids(message_ids)
+            
+            logger.info("Published digest with %s ads", len(message_ids))
+
+def map_channel_message_ids(ad_ids: list, result) -> list:
+    """Pair ad IDs with the message IDs of a channel post (one album item per ad, or one shared message)"""
+    if isinstance(result, list):
+        return [(ad_id, msg.message_id) for ad_id, msg in zip(ad_ids, result)]
+    return [(ad_id, result.message_id) for ad_id in ad_ids]
+
+async def store_replayed_channel_post(result, context: Dict[str, Any]):
+    """Store channel message IDs of a channel post sent from the dead-letter table"""
+    await db.set_digest_message_ids(map_channel_message_ids(context['ad_ids'], result))
+
+async def digest_worker():
+    """Periodically publish partial digests so queued ads don't wait forever"""
+    while True:
+        await asyncio.sleep(DIGEST_INTERVAL_SECONDS)
+        try:
+            await flush_digest(force=True)
+        except Exception as e:
+            logger.error("Error publishing digest: %s", e)
+
+async def update_channel_ad_text(ad_id: int, sold_status: str):
+    """Update the ad text in the channel to show sold status"""
+    ad = await db.get_ad(ad_id)
+    if not ad or ad['status'] != 'approved' or not ad.get('channel_message_id'):
+        return
+    
+    try:
         # Update the channel message
         channel_photo = ad.get('channel_photo')
         if channel_photo:
-            await bot.edit_message_caption(
+            await call_with_retry(bot, EditMessageCaption(
                 chat_id=CHANNEL_ID,
                 message_id=ad['channel_message_id'],
-                caption=channel_message,
+                caption=build_channel_message(ad, sold_status),
                 parse_mode='HTML'
-            )
+            ), db=db)
         else:
-            await bot.edit_message_text(
+            # Text ads may share one digest post, so re-render every item in it
+            post_ads = await db.get_ads_by_channel_message_id(ad['channel_message_id'])
+            if len(post_ads) > 1:
+                for post_ad in post_ads:
+                    if post_ad['id'] == ad_id:
+                        post_ad['sold_status'] = sold_status
+                channel_message = build_digest_message(post_ads)
+            else:
+                channel_message = build_channel_message(ad, sold_status)
+            
+            await call_with_retry(bot, EditMessageText(
                 chat_id=CHANNEL_ID,
                 message_id=ad['channel_message_id'],
                 text=channel_message,
                 parse_mode='HTML'
-            )
+            ), db=db)
         
-        logger.info(f"Updated channel message for ad {ad_id} with sold status: {sold_status}")
+        item_logger.info("Updated channel message for ad %s with sold status: %s", ad_id, sold_status, extra={'ad_id': ad_id})
         
     except Exception as e:
-        logger.error(f"Error updating channel message for ad {ad_id}: {e}")
+        logger.error("Error updating channel message for ad %s: %s", ad_id, e, extra={'ad_id': ad_id})
 
 @dp.message(StateFilter(AdStates.waiting_for_gift_link))
 async def process_gift_link(message: Message, state: FSMContext):
@@ -431,39 +1002,16 @@ async def process_gift_link(message: Message, state: FSMContext):
     if not language:
         language = await db.get_user_language(message.from_user.id)
     
-    # Basic validation for Telegram links (gift, NFT, channels, etc.)
-    gift_patterns = [
-        'https://t.me/nft/',
-        't.me/nft/',
-        'http://t.me/nft/',
-        't.me/nft/'
-    ]
-    
-    channel_patterns = [
-        'https://t.me/',
-        't.me/',
-        'http://t.me/',
-        '@'
-    ]
-    
-    # Check if it's a gift link
-    is_gift = any(gift_link.startswith(pattern) for pattern in gift_patterns)
-    
-    # Check if it's a channel link (but not a gift link)
-    is_channel = False
-    if not is_gift:
-        # Check for channel patterns
-        if gift_link.startswith('@'):
-            is_channel = True
-        elif any(gift_link.startswith(pattern) for pattern in channel_patterns):
-            # Make sure it's not a bot link or other special links
-            if '/nft/' not in gift_link and '_bot' not in gift_link.lower() and '/joinchat/' not in gift_link:
-                is_channel = True
-    
-    if not (is_gift or is_channel):
+    # Accept gift (t.me/nft/...) and channel (@name, t.me/name, t.me/+invite) links
+    parsed_link = parse_link(gift_link)
+    if parsed_link is None:
         await message.answer(get_text('invalid_link', language))
         return
     
+    if RELIST_POLICY == 'block' and await db.find_relisting(parsed_link.canonical, RELIST_WINDOW_HOURS):
+        await message.answer(get_text('relist_blocked', language))
+        return
+    
     # Store gift link and language
     user_ads[message.from_user.id] = {'gift_link': gift_link, 'language': language}
     
@@ -534,8 +1082,8 @@ async def process_price(message: Message, state: FSMContext):
     try:
         # Check if the input is a valid number (integer or float)
         float(price)
-        # Also check that it's not negative
-        if float(price) < 0:
+        # Also check that it's not negative, infinite or NaN
+        if not math.isfinite(float(price)) or float(price) < 0:
             await message.answer(get_text('invalid_price', language))
             return
     except ValueError:
@@ -636,11 +1184,22 @@ async def process_preview_confirmation(message: Message, state: FSMContext):
         language = user_ads[user_id].get('language', 'fa')
     
     if message.text == get_text('confirm_ad_button', language):
-        # User confirmed - proceed to payment
+        # User confirmed - persist the draft so the payment doesn't depend on this process
+        ad_data = user_ads[user_id]
+        draft_id = await db.save_ad_draft(
+            user_id,
+            ad_data['gift_link'],
+            ad_data['price'],
+            ad_data.get('description', 'توضیحات ندارد'),
+            ad_data.get('channel_photo'),
+            language
+        )
+        
+        # Proceed to payment
         await message.answer_invoice(
             title=get_text('payment_title', language),
             description=get_text('payment_description', language).format(STARS_AMOUNT),
-            payload=f"ad_payment_{user_id}",
+            payload=f"ad_draft_{draft_id}",
             provider_token="",  # Empty for Telegram Stars
             currency="XTR",  # Telegram Stars currency
             prices=[LabeledPrice(label=get_text('payment_label', language), amount=STARS_AMOUNT)]
@@ -663,6 +1222,7 @@ async def process_preview_confirmation(message: Message, state: FSMContext):
     elif message.text == get_text('cancel_ad_button', language):
         # User wants to cancel
         del user_ads[user_id]
+        await db.cancel_ad_drafts(user_id)
         await message.answer(
             get_text('ad_cancelled', language),
             reply_markup=get_main_menu_keyboard(language)
@@ -674,48 +1234,195 @@ async def process_preview_confirmation(message: Message, state: FSMContext):
 
 @dp.pre_checkout_query()
 async def process_pre_checkout_query(pre_checkout_query: PreCheckoutQuery):
-    """Handle pre-checkout query"""
-    await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
+    """Handle pre-checkout query - only accept invoices of open drafts"""
+    payload = pre_checkout_query.invoice_payload
+    user_id = pre_checkout_query.from_user.id
+    ok = False
+    
+    if payload.startswith("ad_draft_"):
+        draft = await db.get_ad_draft(int(payload.split("_")[2]))
+        ok = (
+            draft is not None
+            and draft['user_id'] == user_id
+            and draft['status'] == 'open'
+            and pre_checkout_query.currency == "XTR"
+            and pre_checkout_query.total_amount == STARS_AMOUNT
+        )
+    elif payload.startswith("ad_payment_"):
+        # Invoices sent before drafts were persisted
+        ok = user_id in user_ads
+    elif payload.startswith("ad_bump_"):
+        ad = await db.get_ad(int(payload.split("_")[2]))
+        ok = (
+            ad is not None
+            and ad['user_id'] == user_id
+            and ad['status'] == 'approved'
+            and ad.get('sold_status') == 'available'
+            and pre_checkout_query.currency == "XTR"
+            and BUMP_STARS > 0
+            and pre_checkout_query.total_amount == BUMP_STARS
+        )
+    
+    if ok:
+        await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
+    else:
+        language = await db.get_user_language(user_id)
+        error_key = 'bump_unavailable' if payload.startswith("ad_bump_") else 'payment_draft_invalid'
+        await bot.answer_pre_checkout_query(
+            pre_checkout_query.id,
+            ok=False,
+            error_message=get_text(error_key, language)
+        )
 
 @dp.message(F.content_type == ContentType.SUCCESSFUL_PAYMENT)
 async def process_successful_payment(message: Message, state: FSMContext):
     """Handle successful payment"""
     user_id = message.from_user.id
-    
-    if user_id not in user_ads:
-        # Get user language from database
-        language = await db.get_user_language(user_id)
-        await message.answer(get_text('payment_error', language))
+    payload = message.successful_payment.invoice_payload
+    
+    if payload.startswith("ad_bump_"):
+        await process_bump_payment(message, int(payload.split("_")[2]))
+        return
+    
+    if payload.startswith("ad_draft_"):
+        draft_id = int(payload.split("_")[2])
+    elif user_id in user_ads:
+        # Invoices sent before drafts were persisted
+        ad_data = user_ads[user_id]
+        draft_id = await db.save_ad_draft(
+            user_id,
+            ad_data['gift_link'],
+            ad_data['price'],
+            ad_data.get('description', 'توضیحات ندارد'),
+            ad_data.get('channel_photo'),
+            ad_data.get('language', 'fa')
+        )
+    else:
+        await refund_orphan_payment(message, "پیش‌نویس آگهی در حافظه پیدا نشد")
         return
     
-    # Create ad in database
-    ad_data = user_ads[user_id]
-    language = ad_data.get('language', 'fa')
-    description = ad_data.get('description', 'توضیحات ندارد')
-    channel_photo = ad_data.get('channel_photo')
-    
     # Get telegram_payment_charge_id from successful payment
     telegram_payment_charge_id = message.successful_payment.telegram_payment_charge_id
     
-    ad_id = await db.create_ad(user_id, ad_data['gift_link'], ad_data['price'], description, telegram_payment_charge_id, STARS_AMOUNT, channel_photo)
-    await db.update_payment_status(ad_id, 'paid')
+    # Create ad in database (a redelivered payment returns the existing ad)
+    ad_id, created = await db.create_paid_ad(draft_id, telegram_payment_charge_id, message.successful_payment.total_amount)
     
     # Clean up user data
-    del user_ads[user_id]
+    user_ads.pop(user_id, None)
+    
+    if ad_id is None:
+        # The draft row is gone, so there is no ad to create for this payment
+        await refund_orphan_payment(message, f"پیش‌نویس {draft_id} در دیتابیس پیدا نشد")
+        return
+    
+    if not created:
+        logger.info("Ignoring duplicate payment %s for ad %s", telegram_payment_charge_id, ad_id, extra={'ad_id': ad_id})
+        return
     
-    await message.answer(get_text('ad_submitted', language))
+    draft = await db.get_ad_draft(draft_id)
+    await message.answer(get_text('ad_submitted', draft['language']))
     
     # Send to admin for approval
     await send_ad_to_admin(ad_id)
     
     await state.clear()
 
+async def refund_orphan_payment(message: Message, reason: str):
+    """Refund a payment that can't become an ad, and tell the user and the super admin"""
+    payment = message.successful_payment
+    language = await db.get_user_language(message.from_user.id)
+    try:
+        await call_with_retry(bot, RefundStarPayment(
+            user_id=message.from_user.id,
+            telegram_payment_charge_id=payment.telegram_payment_charge_id
+        ), db=db)
+        refunded = True
+    except Exception as e:
+        logger.error("Error refunding payment %s without an ad: %s", payment.telegram_payment_charge_id, e)
+        refunded = False
+    
+    await message.answer(get_text('payment_refunded_no_draft' if refunded else 'payment_no_draft', language))
+    await send_admin_log(f"""⚠️ پرداخت بدون آگهی ({reason})
+
+👤 کاربر: {message.from_user.id}
+💰 مبلغ: {payment.total_amount} استارز
+🧾 Transaction ID: {payment.telegram_payment_charge_id}
+{'✅ بازپرداخت شد' if refunded else '❌ بازپرداخت ناموفق بود، لطفاً دستی بررسی کنید'}""")
+
+async def process_bump_payment(message: Message, ad_id: int):
+    """Post a bumped ad to the channel again, once per payment"""
+    payment = message.successful_payment
+    created = await db.record_bump(ad_id, message.from_user.id, payment.telegram_payment_charge_id, payment.total_amount)
+    if not created:
+        logger.info("Ignoring duplicate bump payment %s for ad %s", payment.telegram_payment_charge_id, ad_id, extra={'ad_id': ad_id})
+        return
+    
+    ad = await db.get_ad(ad_id)
+    language = await db.get_user_language(message.from_user.id)
+    # The old post goes away unless other ads share it (a text digest)
+    old_message_id = ad.get('channel_message_id')
+    delete_old_post = old_message_id and (ad.get('channel_photo') or len(await db.get_ads_by_channel_message_id(old_message_id)) == 1)
+    try:
+        if not DIGEST_MODE:
+            await channel_limiter.acquire()
+        await publish_ad_to_channel(ad)
+    except Exception as e:
+        # Nothing was published (the old post is still up), so the bump is paid back
+        logger.error("Error publishing bumped ad %s: %s", ad_id, e, extra={'ad_id': ad_id})
+        if await refund_bump(message.from_user.id, payment.telegram_payment_charge_id):
+            await message.answer(get_text('bump_failed_refunded', language))
+        else:
+            await message.answer(get_text('bump_failed', language))
+            await send_admin_log(f"⚠️ ارتقای آگهی {ad_id} منتشر نشد و بازپرداخت {payment.total_amount} استارز ناموفق بود.\n"
+                                 f"🆔 کاربر: {message.from_user.id}\n🧾 Transaction ID: {payment.telegram_payment_charge_id}")
+        return
+    
+    # The old post may already be gone, and one left behind is harmless, so failures are logged
+    # rather than dead-lettered
+    if delete_old_post:
+        try:
+            await call_with_retry(bot, DeleteMessage(chat_id=CHANNEL_ID, message_id=old_message_id))
+        except Exception as e:
+            logger.warning("Could not delete the old post of bumped ad %s: %s", ad_id, e, extra={'ad_id': ad_id})
+    
+    await restart_ad_lifecycle([ad_id])
+    metrics.ad_lifecycle_events.inc('bump')
+    await message.answer(get_text('ad_bumped', language, channel_name=CHANNEL_NAME))
+
+async def store_replayed_refund(result, context: Dict[str, Any]):
+    """Record an ad refund sent from the dead-letter table, so the ad and the ledger show it"""
+    await db.update_refund_status(context['ad_id'], True)
+
+async def store_replayed_bump_refund(result, context: Dict[str, Any]):
+    """Record a bump refund sent from the dead-letter table"""
+    await db.record_bump_refund(context['telegram_payment_charge_id'])
+
+async def refund_bump(user_id: int, telegram_payment_charge_id: str) -> bool:
+    """Refund a bump payment and record it in the ledger"""
+    try:
+        await call_with_retry(bot, RefundStarPayment(
+            user_id=user_id,
+            telegram_payment_charge_id=telegram_payment_charge_id
+        ), db=db, context={'kind': 'bump_refund', 'telegram_payment_charge_id': telegram_payment_charge_id})
+    except Exception as e:
+        logger.error("Error refunding bump %s: %s", telegram_payment_charge_id, e)
+        return False
+    await db.record_bump_refund(telegram_payment_charge_id)
+    return True
+
+async def send_admin_log(text: str):
+    """Send an activity log to the super admin, deferred while the bot is overloaded"""
+    async def send():
+        await call_with_retry(bot, SendMessage(chat_id=SUPER_ADMIN_ID, text=text), db=db)
+    
+    await load_guard.run_or_defer(send)
+
 async def send_ad_to_admin(ad_id: int):
     """Send ad to both admin types for approval"""
     try:
         ad_data = await db.get_ad(ad_id)
         if not ad_data:
-            logger.error(f"Ad with ID {ad_id} not found")
+            logger.error("Ad with ID %s not found", ad_id, extra={'ad_id': ad_id})
             return
         
         # Handle names safely
@@ -743,6 +1450,13 @@ async def send_ad_to_admin(ad_id: int):
 📝 توضیحات: {ad_data.get('description', 'توضیحات ندارد')}
 📅 تاریخ ثبت: {ad_data['created_at']}"""
         
+        # Warn about a live ad for the same gift or channel
+        if RELIST_POLICY != 'off':
+            relisting = await db.find_relisting(ad_data.get('canonical_link'), RELIST_WINDOW_HOURS, exclude_ad_id=ad_id)
+            if relisting:
+                owner = "همین کاربر" if relisting['user_id'] == ad_data['user_id'] else f"کاربر {relisting['user_id']}"
+                admin_message += f"\n\n⚠️ تکراری: قبلاً توسط {owner} در آگهی #{relisting['id']} ثبت شده (وضعیت: {relisting['status']}، {relisting['created_at']})"
+        
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [
                 InlineKeyboardButton(text="✅ تایید", callback_data=f"approve_{ad_id}"),
@@ -758,21 +1472,21 @@ async def send_ad_to_admin(ad_id: int):
                 await bot.send_photo(SUPPORT_ADMIN_ID, photo=channel_photo, caption=admin_message, reply_markup=keyboard)
             else:
                 await bot.send_message(SUPPORT_ADMIN_ID, admin_message, reply_markup=keyboard)
-            logger.info(f"Ad {ad_id} sent to SUPPORT_ADMIN_ID: {SUPPORT_ADMIN_ID}")
+            item_logger.info("Ad %s sent to SUPPORT_ADMIN_ID: %s", ad_id, SUPPORT_ADMIN_ID, extra={'ad_id': ad_id})
         except Exception as e:
-            logger.error(f"Failed to send ad {ad_id} to SUPPORT_ADMIN_ID {SUPPORT_ADMIN_ID}: {e}")
+            logger.error("Failed to send ad %s to SUPPORT_ADMIN_ID %s: %s", ad_id, SUPPORT_ADMIN_ID, e, extra={'ad_id': ad_id})
         
         try:
             if channel_photo:
                 await bot.send_photo(SUPER_ADMIN_ID, photo=channel_photo, caption=admin_message, reply_markup=keyboard)
             else:
                 await bot.send_message(SUPER_ADMIN_ID, admin_message, reply_markup=keyboard)
-            logger.info(f"Ad {ad_id} sent to SUPER_ADMIN_ID: {SUPER_ADMIN_ID}")
+            item_logger.info("Ad %s sent to SUPER_ADMIN_ID: %s", ad_id, SUPER_ADMIN_ID, extra={'ad_id': ad_id})
         except Exception as e:
-            logger.error(f"Failed to send ad {ad_id} to SUPER_ADMIN_ID {SUPER_ADMIN_ID}: {e}")
+            logger.error("Failed to send ad %s to SUPER_ADMIN_ID %s: %s", ad_id, SUPER_ADMIN_ID, e, extra={'ad_id': ad_id})
             
     except Exception as e:
-        logger.error(f"Error in send_ad_to_admin for ad {ad_id}: {e}")
+        logger.error("Error in send_ad_to_admin for ad %s: %s", ad_id, e, extra={'ad_id': ad_id})
 
 @dp.callback_query(F.data.startswith("approve_"))
 async def approve_ad(callback: CallbackQuery):
@@ -790,54 +1504,25 @@ async def approve_ad(callback: CallbackQuery):
     
     # Update ad status
     await db.update_ad_status(ad_id, 'approved')
+    await restart_ad_lifecycle([ad_id])
     
-    # Determine if it's a gift or channel for channel message
-    gift_link = ad_data.get('gift_link') or 'لینک ندارد'
-    is_gift = '/nft/' in gift_link if gift_link != 'لینک ندارد' else False
+    # Buyers' alerts don't depend on the channel post or the seller's notification
+    spawn_background(dispatch_price_alerts([ad_data]))
     
     # Get description
     description = ad_data.get('description') or 'توضیحات ندارد'
-    description_text = f"\n📝 {description}" if description and description != 'توضیحات ندارد' else ""
     
     # Handle all fields safely
     username = ad_data.get('username') or 'ناشناس'
-    gift_link = ad_data.get('gift_link') or 'لینک ندارد'
-    price = ad_data.get('price') or '0'
-    
-    if is_gift:
-        # Gift message
-        channel_message = f"""🎁 {gift_link}
-💰 Price: {price} TON
-👤 Seller: @{username}{description_text}
-
-📢 Ad posted on {CHANNEL_NAME}
-
-⚠️ Only trade on trusted marketplaces like <a href="https://t.me/portals/market?startapp=d15jj7">Portals</a>, <a href="https://t.me/tonnel_network_bot/gifts?startapp=ref_195742142">Tonnel</a>, and <a href="https://t.me/mrkt/app?startapp=195742142">Mrkt</a>!"""
-    else:
-        # Channel message
-        channel_message = f"""📺 {gift_link}
-💰 Price: {price} TON
-👤 Seller: @{username}{description_text}
-
-📢 Ad posted on {CHANNEL_NAME}
-
-⚠️ Please verify the channel before joining!"""
     
     try:
-        # Send to channel with photo if available
-        channel_photo = ad_data.get('channel_photo')
-        if channel_photo:
-            channel_msg = await bot.send_photo(CHANNEL_ID, photo=channel_photo, caption=channel_message, parse_mode='HTML')
-        else:
-            channel_msg = await bot.send_message(CHANNEL_ID, channel_message, parse_mode='HTML')
-        
-        # Store channel message ID for future updates
-        await db.update_channel_message_id(ad_id, channel_msg.message_id)
+        # Send to channel (or queue for the next digest)
+        await publish_ad_to_channel(ad_data)
         
         # Notify user
         user_language = await db.get_user_language(ad_data['user_id'])
         user_message = get_text('ad_approved', user_language, channel_name=CHANNEL_NAME)
-        await bot.send_message(ad_data['user_id'], user_message)
+        await call_with_retry(bot, SendMessage(chat_id=ad_data['user_id'], text=user_message), db=db)
         
         # Send log to super admin if approved by support admin
         if callback.from_user.id == SUPPORT_ADMIN_ID and SUPER_ADMIN_ID != SUPPORT_ADMIN_ID:
@@ -853,7 +1538,7 @@ async def approve_ad(callback: CallbackQuery):
 🆔 ID: {ad_data['user_id']}
 👨‍💼 تایید شده توسط: {callback.from_user.first_name or ''} ({callback.from_user.id})
 📅 تاریخ: {ad_data['created_at']}"""
-            await bot.send_message(SUPER_ADMIN_ID, admin_log)
+            await send_admin_log(admin_log)
         
         # Update admin message
         try:
@@ -871,10 +1556,10 @@ async def approve_ad(callback: CallbackQuery):
                 # If no text or caption, send a new message
                 await callback.message.reply("✅ تایید شد و در کانال منتشر شد.")
         except Exception as edit_error:
-            logger.error(f"Error updating admin message: {edit_error}")
+            logger.error("Error updating admin message: %s", edit_error)
         
     except Exception as e:
-        logger.error(f"Error sending to channel: {e}")
+        logger.error("Error sending to channel: %s", e)
         await callback.answer("خطا در ارسال به کانال.", show_alert=True)
     
     await callback.answer("آگهی تایید شد.")
@@ -882,7 +1567,7 @@ async def approve_ad(callback: CallbackQuery):
 @dp.callback_query(F.data.startswith("reject_") & ~F.data.startswith("reject_refund_") & ~F.data.startswith("reject_no_refund_"))
 async def reject_ad(callback: CallbackQuery, state: FSMContext):
     """Start rejection process - ask for reason"""
-    logger.info(f"reject_ad called with data: {callback.data}")
+    logger.info("reject_ad called with data: %s", callback.data)
     if callback.from_user.id not in [SUPPORT_ADMIN_ID, SUPER_ADMIN_ID]:
         await callback.answer("شما مجاز به انجام این عمل نیستید.", show_alert=True)
         return
@@ -913,13 +1598,13 @@ async def reject_ad(callback: CallbackQuery, state: FSMContext):
 @dp.callback_query(F.data.startswith("reject_refund_"))
 async def reject_ad_with_refund(callback: CallbackQuery, state: FSMContext):
     """Reject ad with refund"""
-    logger.info(f"reject_ad_with_refund called with data: {callback.data}")
+    logger.info("reject_ad_with_refund called with data: %s", callback.data)
     if callback.from_user.id not in [SUPPORT_ADMIN_ID, SUPER_ADMIN_ID]:
         await callback.answer("شما مجاز به انجام این عمل نیستید.", show_alert=True)
         return
     
     ad_id = int(callback.data.split("_")[2])
-    logger.info(f"Processing refund rejection for ad_id: {ad_id}")
+    logger.info("Processing refund rejection for ad_id: %s", ad_id, extra={'ad_id': ad_id})
     await state.update_data(rejecting_ad_id=ad_id, with_refund=True)
     await state.set_state(AdminStates.waiting_for_rejection_reason)
     
@@ -929,13 +1614,13 @@ async def reject_ad_with_refund(callback: CallbackQuery, state: FSMContext):
 @dp.callback_query(F.data.startswith("reject_no_refund_"))
 async def reject_ad_without_refund(callback: CallbackQuery, state: FSMContext):
     """Reject ad without refund"""
-    logger.info(f"reject_ad_without_refund called with data: {callback.data}")
+    logger.info("reject_ad_without_refund called with data: %s", callback.data)
     if callback.from_user.id not in [SUPPORT_ADMIN_ID, SUPER_ADMIN_ID]:
         await callback.answer("شما مجاز به انجام این عمل نیستید.", show_alert=True)
         return
     
     ad_id = int(callback.data.split("_")[3])  # reject_no_refund_123 -> index 3
-    logger.info(f"Processing no-refund rejection for ad_id: {ad_id}")
+    logger.info("Processing no-refund rejection for ad_id: %s", ad_id, extra={'ad_id': ad_id})
     await state.update_data(rejecting_ad_id=ad_id, with_refund=False)
     await state.set_state(AdminStates.waiting_for_rejection_reason)
     
@@ -984,7 +1669,10 @@ async def process_rejection_reason(message: Message, state: FSMContext):
     
     # Notify user with reason and refund status
     user_message = f"{AD_REJECTED_MESSAGE}\n\n📝 دلیل رد: {rejection_reason}{refund_status}"
-    await bot.send_message(ad_data['user_id'], user_message)
+    try:
+        await call_with_retry(bot, SendMessage(chat_id=ad_data['user_id'], text=user_message), db=db)
+    except Exception as e:
+        logger.error("Failed to notify user %s about rejection of ad %s: %s", ad_data['user_id'], ad_id, e, extra={'ad_id': ad_id})
     
     # Send log to super admin if rejected by support admin
     if message.from_user.id == SUPPORT_ADMIN_ID and SUPER_ADMIN_ID != SUPPORT_ADMIN_ID:
@@ -995,44 +1683,387 @@ async def process_rejection_reason(message: Message, state: FSMContext):
         last_name = ad_data.get('last_name') or ''
         admin_log = f"""❌ آگهی رد شد
 
-📝 لینک: {ad_data['gift_link']}
-📄 توضیحات: {description}
-💰 قیمت: {ad_data['price']} TON
-👤 کاربر: {first_name} {last_name} (@{username})
-🆔 ID: {ad_data['user_id']}
-📝 دلیل رد: {rejection_reason}
-💸 ریفاند: {'بله' if with_refund else 'خیر'}
-👨‍💼 رد شده توسط: {message.from_user.first_name or ''} ({message.from_user.id})
-📅 تاریخ: {ad_data['created_at']}{refund_status}"""
-        await bot.send_message(SUPER_ADMIN_ID, admin_log)
+📝 لینک: {ad_data['gift_link']}
+📄 توضیحات: {description}
+💰 قیمت: {ad_data['price']} TON
+👤 کاربر: {first_name} {last_name} (@{username})
+🆔 ID: {ad_data['user_id']}
+📝 دلیل رد: {rejection_reason}
+💸 ریفاند: {'بله' if with_refund else 'خیر'}
+👨‍💼 رد شده توسط: {message.from_user.first_name or ''} ({message.from_user.id})
+📅 تاریخ: {ad_data['created_at']}{refund_status}"""
+        await send_admin_log(admin_log)
+    
+    # Confirm to admin
+    admin_message = f"✅ آگهی با موفقیت رد شد.\n📝 دلیل: {rejection_reason}{refund_status}"
+    await message.reply(admin_message)
+    
+    # Clear state
+    await state.clear()
+
+async def refund_stars(ad_id: int) -> bool:
+    """Refund stars for rejected ad"""
+    try:
+        ad_data = await db.get_ad(ad_id)
+        if not ad_data or not ad_data.get('telegram_payment_charge_id'):
+            logger.error("Cannot refund ad %s: No payment charge ID found", ad_id, extra={'ad_id': ad_id})
+            return False
+        
+        # Refund the stars using Bot API method
+        await call_with_retry(bot, RefundStarPayment(
+            user_id=ad_data['user_id'],
+            telegram_payment_charge_id=ad_data['telegram_payment_charge_id']
+        ), db=db, context={'kind': 'refund', 'ad_id': ad_id})
+        await db.update_refund_status(ad_id, True)
+        
+        logger.info("Stars refunded successfully for ad %s", ad_id, extra={'ad_id': ad_id})
+        return True
+        
+    except Exception as e:
+        logger.error("Error refunding stars for ad %s: %s", ad_id, e, extra={'ad_id': ad_id})
+        return False
+
+# Bulk moderation handlers
+def build_bulk_moderation_keyboard(pending_ads: list, selected: list) -> InlineKeyboardMarkup:
+    """Build the multi-select keyboard for bulk moderation"""
+    keyboard = []
+    for ad in pending_ads:
+        mark = "☑️" if ad['id'] in selected else "⬜"
+        keyboard.append([InlineKeyboardButton(
+            text=f"{mark} #{ad['id']} | {ad['price']} TON | {ad['gift_link'][:30]}",
+            callback_data=f"bulk_toggle_{ad['id']}"
+        )])
+    
+    keyboard.append([InlineKeyboardButton(text="☑️ انتخاب همه", callback_data="bulk_select_all")])
+    keyboard.append([InlineKeyboardButton(text=f"✅ تایید انتخاب‌شده‌ها ({len(selected)})", callback_data="bulk_approve")])
+    keyboard.append([
+        InlineKeyboardButton(text="💰 رد با ریفاند", callback_data="bulk_reject_refund"),
+        InlineKeyboardButton(text="❌ رد بدون ریفاند", callback_data="bulk_reject_no_refund")
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+async def show_bulk_moderation(message: Message, state: FSMContext):
+    """Send the bulk moderation list of pending ads"""
+    pending_ads = (await db.get_pending_ads())[:BULK_MODERATION_PAGE_SIZE]
+    if not pending_ads:
+        await message.answer("هیچ آگهی در انتظار وجود ندارد.")
+        return
+    
+    await state.update_data(bulk_selected=[])
+    await message.answer(
+        f"🗂 مدیریت گروهی آگهی‌ها ({len(pending_ads)} آگهی در انتظار)\n\nآگهی‌ها را انتخاب کنید:",
+        reply_markup=build_bulk_moderation_keyboard(pending_ads, [])
+    )
+
+@dp.message(Command('bulk_moderation'))
+async def bulk_moderation_command(message: Message, state: FSMContext):
+    """Handle /bulk_moderation command"""
+    if message.from_user.id not in [SUPPORT_ADMIN_ID, SUPER_ADMIN_ID]:
+        return
+    
+    await show_bulk_moderation(message, state)
+
+@dp.callback_query(F.data == "bulk_moderation")
+async def bulk_moderation_callback(callback: CallbackQuery, state: FSMContext):
+    """Open bulk moderation from the admin panel"""
+    if callback.from_user.id not in [SUPPORT_ADMIN_ID, SUPER_ADMIN_ID]:
+        await callback.answer("شما مجاز به انجام این عمل نیستید.", show_alert=True)
+        return
+    
+    await show_bulk_moderation(callback.message, state)
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("bulk_toggle_") | (F.data == "bulk_select_all"))
+async def bulk_toggle_selection(callback: CallbackQuery, state: FSMContext):
+    """Toggle one ad (or all ads) in the bulk selection"""
+    if callback.from_user.id not in [SUPPORT_ADMIN_ID, SUPER_ADMIN_ID]:
+        await callback.answer("شما مجاز به انجام این عمل نیستید.", show_alert=True)
+        return
+    
+    pending_ads = (await db.get_pending_ads())[:BULK_MODERATION_PAGE_SIZE]
+    pending_ids = [ad['id'] for ad in pending_ads]
+    data = await state.get_data()
+    selected = [ad_id for ad_id in data.get('bulk_selected', []) if ad_id in pending_ids]
+    
+    if callback.data == "bulk_select_all":
+        selected = [] if len(selected) == len(pending_ids) else pending_ids
+    else:
+        ad_id = int(callback.data.split("_")[2])
+        if ad_id in selected:
+            selected.remove(ad_id)
+        elif ad_id in pending_ids:
+            selected.append(ad_id)
+    
+    await state.update_data(bulk_selected=selected)
+    try:
+        await callback.message.edit_reply_markup(reply_markup=build_bulk_moderation_keyboard(pending_ads, selected))
+    except:
+        pass  # Keyboard might be the same
+    await callback.answer()
+
+@dp.callback_query(F.data.in_(["bulk_approve", "bulk_reject_refund", "bulk_reject_no_refund"]))
+async def bulk_moderation_action(callback: CallbackQuery, state: FSMContext):
+    """Approve or reject all selected ads at once"""
+    if callback.from_user.id not in [SUPPORT_ADMIN_ID, SUPER_ADMIN_ID]:
+        await callback.answer("شما مجاز به انجام این عمل نیستید.", show_alert=True)
+        return
+    
+    data = await state.get_data()
+    selected = data.get('bulk_selected', [])
+    if not selected:
+        await callback.answer("هیچ آگهی انتخاب نشده است.", show_alert=True)
+        return
+    
+    await callback.answer()
+    await callback.message.edit_text(f"🔄 در حال پردازش {len(selected)} آگهی... لطفاً صبر کنید.")
+    await state.update_data(bulk_selected=[])
+    
+    # Rate-limited channel posts take minutes; the moderator keeps using the bot meanwhile
+    spawn_background(run_bulk_moderation(callback.message, callback.from_user, callback.data, selected))
+
+async def run_bulk_moderation(progress_message: Message, admin, action: str, ad_ids: list):
+    """Apply a bulk moderation action in the background and show its summary when done"""
+    try:
+        if action == "bulk_approve":
+            summary = await bulk_approve_ads(ad_ids)
+        else:
+            summary = await bulk_reject_ads(ad_ids, with_refund=action == "bulk_reject_refund")
+    except Exception as e:
+        logger.error("Error in bulk moderation of ads %s: %s", ad_ids, e)
+        await progress_message.edit_text(f"❌ خطا در پردازش گروهی: {e}")
+        return
+    
+    await progress_message.edit_text(summary)
+    
+    # Send log to super admin if done by support admin
+    if admin.id == SUPPORT_ADMIN_ID and SUPER_ADMIN_ID != SUPPORT_ADMIN_ID:
+        await send_admin_log(
+            f"{summary}\n👨‍💼 انجام شده توسط: {admin.first_name or ''} ({admin.id})"
+        )
+
+async def show_find_results(message: Message, query: str, page: int, edit: bool = False):
+    """Show one page of ad search results with previous/next buttons"""
+    total, ads = await db.search_ads(query, limit=FIND_PAGE_SIZE, offset=page * FIND_PAGE_SIZE)
+    if not total:
+        await message.answer(f"🔍 نتیجه‌ای برای «{query}» پیدا نشد.")
+        return
+    
+    pages = (total + FIND_PAGE_SIZE - 1) // FIND_PAGE_SIZE
+    text = f"🔍 نتایج «{query}»: {total} آگهی (صفحه {page + 1} از {pages})\n\n"
+    for ad in ads:
+        text += f"#{ad['id']} | {ad['status']} | {ad['sold_status']} | {ad['price']} TON\n"
+        text += f"   {ad['gift_link']}\n"
+        text += f"   👤 {ad['user_id']} | @{ad['username'] or 'ندارد'} | 📅 {ad['created_at'][:10]}\n"
+        if ad['description']:
+            text += f"   📝 {ad['description'][:80]}\n"
+        text += "\n"
+    
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="◀️ قبلی", callback_data=f"find_page_{page - 1}"))
+    if page + 1 < pages:
+        buttons.append(InlineKeyboardButton(text="بعدی ▶️", callback_data=f"find_page_{page + 1}"))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    
+    if edit:
+        await message.edit_text(text[:4096], reply_markup=keyboard)
+    else:
+        await message.answer(text[:4096], reply_markup=keyboard)
+
+@dp.message(Command('find'))
+async def find_command(message: Message, state: FSMContext):
+    """Handle /find <query>: full-text search over ad links, descriptions and seller usernames"""
+    if message.from_user.id not in [SUPPORT_ADMIN_ID, SUPER_ADMIN_ID]:
+        return
+    
+    query = message.text.partition(' ')[2].strip()
+    if not query:
+        await message.answer("🔍 استفاده: /find <متن جستجو>\nمثال: /find plushpepe یا /find @username")
+        return
+    
+    # The query is kept in state data so the page buttons only carry the page number
+    await state.update_data(find_query=query)
+    await show_find_results(message, query, 0)
+
+@dp.callback_query(F.data.startswith("find_page_"))
+async def find_page_callback(callback: CallbackQuery, state: FSMContext):
+    """Show another page of /find results"""
+    if callback.from_user.id not in [SUPPORT_ADMIN_ID, SUPER_ADMIN_ID]:
+        await callback.answer("شما مجاز به انجام این عمل نیستید.", show_alert=True)
+        return
+    
+    query = (await state.get_data()).get('find_query')
+    if not query:
+        await callback.answer("جستجو منقضی شده است. لطفاً دوباره /find را ارسال کنید.", show_alert=True)
+        return
+    
+    await show_find_results(callback.message, query, int(callback.data.split("_")[2]), edit=True)
+    await callback.answer()
+
+reindex_lock = asyncio.Lock()
+
+async def run_reindex(chat_id: int):
+    """Rebuild the search index in the background so the admin's other updates aren't queued behind it"""
+    async with reindex_lock:
+        start = time.perf_counter()
+        try:
+            count = await db.rebuild_ads_search()
+        except Exception as e:
+            logger.error("Error rebuilding the search index: %s", e)
+            await bot.send_message(chat_id, f"❌ خطا در بازسازی فهرست جستجو: {e}")
+            return
+        await bot.send_message(chat_id, f"✅ فهرست جستجو بازسازی شد: {count} آگهی در {time.perf_counter() - start:.1f} ثانیه")
+
+@dp.message(Command('reindex_search'))
+async def reindex_search_command(message: Message):
+    """Rebuild the ad search index"""
+    if message.from_user.id != SUPER_ADMIN_ID:
+        return
     
-    # Confirm to admin
-    admin_message = f"✅ آگهی با موفقیت رد شد.\n📝 دلیل: {rejection_reason}{refund_status}"
-    await message.reply(admin_message)
+    if reindex_lock.locked():
+        await message.answer("⏳ بازسازی فهرست جستجو در حال اجراست.")
+        return
     
-    # Clear state
-    await state.clear()
+    await message.answer("🔄 بازسازی فهرست جستجو شروع شد...")
+    spawn_background(run_reindex(message.chat.id))
 
-async def refund_stars(ad_id: int) -> bool:
-    """Refund stars for rejected ad"""
-    try:
-        ad_data = await db.get_ad(ad_id)
-        if not ad_data or not ad_data.get('telegram_payment_charge_id'):
-            logger.error(f"Cannot refund ad {ad_id}: No payment charge ID found")
+@dp.inline_query(flags={'low_priority': True})
+async def inline_search(inline_query: InlineQuery):
+    """Buyers search listed ads from any chat: @bot <collection or text>"""
+    # One-letter queries show the latest listings, so the first keystroke shares their cache entry
+    text = ' '.join(inline_query.query.lower().split())
+    if len(text) < 2:
+        text = ''
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    
+    # Typing sends a query per keystroke; repeated and popular queries are served from the cache.
+    # The listings version in the key makes changes by any worker process miss
+    key = (await db.get_listings_version(), text, offset)
+    ads = listing_cache.get(key)
+    if ads is None:
+        metrics.inline_cache_lookups.inc('miss')
+        ads = await db.search_listed_ads(text, limit=INLINE_RESULTS_PER_PAGE + 1, offset=offset)
+        listing_cache.set(key, ads)
+    else:
+        metrics.inline_cache_lookups.inc('hit')
+    
+    next_offset = str(offset + INLINE_RESULTS_PER_PAGE) if len(ads) > INLINE_RESULTS_PER_PAGE else ''
+    await inline_query.answer(
+        [build_inline_result(ad) for ad in ads[:INLINE_RESULTS_PER_PAGE]],
+        cache_time=INLINE_CACHE_SECONDS, is_personal=False, next_offset=next_offset
+    )
+
+async def notify_users(notifications: list) -> int:
+    """Send (user_id, text) notifications through the message rate limiter and return the failure count"""
+    async def send(user_id: int, text: str) -> bool:
+        try:
+            await message_limiter.acquire()
+            await call_with_retry(bot, SendMessage(chat_id=user_id, text=text), db=db)
+            return True
+        except Exception as e:
+            logger.error("Failed to notify user %s: %s", user_id, e)
             return False
+    
+    results = await asyncio.gather(*(send(user_id, text) for user_id, text in notifications))
+    return results.count(False)
+
+async def dispatch_price_alerts(ads: list):
+    """Notify buyers whose price alerts the newly approved ads trigger"""
+    global alert_index_version
+    ads = [ad for ad in ads if ad.get('link_collection') and ad.get('price_ton') is not None]
+    if not ads:
+        return
+    
+    # Alerts may have been changed in another worker process; reload only when the table has changed
+    version = await db.get_price_alerts_version()
+    if version != alert_index_version:
+        alert_index.load(await db.get_price_alerts())
+        alert_index_version = version
+    
+    for ad in ads:
+        matches = [
+            (user_id, max_price) for user_id, max_price in alert_index.match(ad['link_collection'], ad['price_ton'])
+            if user_id != ad['user_id']
+        ]
+        if not matches:
+            continue
         
-        # Refund the stars using Bot API method
-        refund_result = await bot(RefundStarPayment(
-            user_id=ad_data['user_id'],
-            telegram_payment_charge_id=ad_data['telegram_payment_charge_id']
-        ))
-        
-        logger.info(f"Stars refunded successfully for ad {ad_id}")
-        return True
+        languages = await db.get_user_languages([user_id for user_id, _ in matches])
+        failed = 0
+        # Batches keep the number of pending sends bounded; the message limiter paces them
+        for start in range(0, len(matches), ALERT_BATCH_SIZE):
+            failed += await notify_users([
+                (user_id, get_text(
+                    'price_alert_match', languages.get(user_id, 'fa'), collection=ad['link_collection'],
+                    price=f"{ad['price_ton']:g}", max_price=f"{max_price:g}", link=ad['gift_link']
+                ))
+                for user_id, max_price in matches[start:start + ALERT_BATCH_SIZE]
+            ])
+        metrics.price_alert_notifications.inc('sent', len(matches) - failed)
+        metrics.price_alert_notifications.inc('failed', failed)
+        logger.info("Price alerts for ad %s: %d matched, %d failed", ad['id'], len(matches), failed, extra={'ad_id': ad['id']})
+
+async def bulk_approve_ads(ad_ids: list) -> str:
+    """Approve selected ads, publish them and notify their owners"""
+    approved_ids = await db.bulk_update_ad_status(ad_ids, 'approved')
+    await restart_ad_lifecycle(approved_ids)
+    ads = await db.get_ads(approved_ids)
+    
+    # Channel posts go out one by one under the per-chat limit
+    channel_failed = 0
+    notifications = []
+    published = []
+    for ad in ads:
+        try:
+            if not DIGEST_MODE:
+                await channel_limiter.acquire()
+            await publish_ad_to_channel(ad)
+        except Exception as e:
+            channel_failed += 1
+            logger.error("Error sending ad %s to channel: %s", ad['id'], e, extra={'ad_id': ad['id']})
+            continue
         
-    except Exception as e:
-        logger.error(f"Error refunding stars for ad {ad_id}: {e}")
-        return False
+        user_language = await db.get_user_language(ad['user_id'])
+        notifications.append((ad['user_id'], get_text('ad_approved', user_language, channel_name=CHANNEL_NAME)))
+        published.append(ad)
+    
+    notify_failed = await notify_users(notifications)
+    spawn_background(dispatch_price_alerts(published))
+    
+    summary = "✅ تایید گروهی تکمیل شد!\n\n"
+    summary += f"✅ تایید شده: {len(approved_ids)}\n"
+    summary += f"⏭ قبلاً بررسی شده: {len(ad_ids) - len(approved_ids)}\n"
+    summary += f"❌ خطای انتشار در کانال: {channel_failed}\n"
+    summary += f"📩 خطای اطلاع‌رسانی: {notify_failed}"
+    return summary
+
+async def bulk_reject_ads(ad_ids: list, with_refund: bool) -> str:
+    """Reject selected ads, optionally refund them, and notify their owners"""
+    rejected_ids = await db.bulk_update_ad_status(ad_ids, 'rejected')
+    ads = await db.get_ads(rejected_ids)
+    
+    refund_failed = 0
+    notifications = []
+    for ad in ads:
+        refund_status = ""
+        if with_refund:
+            await message_limiter.acquire()
+            if await refund_stars(ad['id']):
+                refund_status = "\n💰 استارز با موفقیت بازگردانده شد."
+            else:
+                refund_failed += 1
+                refund_status = "\n❌ خطا در بازگرداندن استارز."
+        notifications.append((ad['user_id'], f"{AD_REJECTED_MESSAGE}\n\n📝 دلیل رد: توضیحات ندارد{refund_status}"))
+    
+    notify_failed = await notify_users(notifications)
+    
+    summary = "❌ رد گروهی تکمیل شد!\n\n"
+    summary += f"❌ رد شده: {len(rejected_ids)}\n"
+    summary += f"⏭ قبلاً بررسی شده: {len(ad_ids) - len(rejected_ids)}\n"
+    if with_refund:
+        summary += f"💸 خطای ریفاند: {refund_failed}\n"
+    summary += f"📩 خطای اطلاع‌رسانی: {notify_failed}"
+    return summary
 
 # Support handlers
 @dp.message(F.text.in_(["🆘 پشتیبانی", "🆘 Поддержка", "🆘 Support"]))
@@ -1149,7 +2180,7 @@ async def process_admin_response(message: Message, state: FSMContext):
         # Send log to super admin if response is from support admin
         if message.from_user.id == SUPPORT_ADMIN_ID and SUPER_ADMIN_ID != SUPPORT_ADMIN_ID:
             admin_log = f"📩 پاسخ پشتیبانی ارسال شد\n\n👤 کاربر: {original_request['user_id']}\n📝 پیام اصلی: {original_request['message']}\n💬 پاسخ ادمین: {response_text}\n👨‍💼 پاسخ داده شده توسط: {message.from_user.first_name or ''} ({message.from_user.id})\n📅 تاریخ: {original_request['created_at']}"
-            await bot.send_message(SUPER_ADMIN_ID, admin_log)
+            await send_admin_log(admin_log)
         
         await message.answer(get_text('response_sent', 'fa'))
     else:
@@ -1175,6 +2206,7 @@ async def support_admin_panel(message: Message):
     keyboard = []
     if pending_ads:
         keyboard.append([InlineKeyboardButton(text=get_text('view_pending_ads', 'fa'), callback_data="view_pending_ads")])
+        keyboard.append([InlineKeyboardButton(text="🗂 مدیریت گروهی", callback_data="bulk_moderation")])
     if pending_support:
         keyboard.append([InlineKeyboardButton(text=get_text('view_support_requests', 'fa'), callback_data="view_support_requests")])
     
@@ -1253,13 +2285,13 @@ async def super_admin_panel(message: Message):
     await message.answer(panel_text, reply_markup=keyboard)
 
 # Super Admin Reply Keyboard Handlers
-@dp.message(F.text.in_(["👥 لیست کاربران", "👥 Список пользователей", "👥 List Users"]))
+@dp.message(F.text.in_(["👥 لیست کاربران", "👥 Список пользователей", "👥 List Users"]), flags={'low_priority': True})
 async def list_users_message(message: Message):
     """List users via reply keyboard"""
     if message.from_user.id != SUPER_ADMIN_ID:
         return
     
-    users = await db.get_all_users()
+    total, users = await db.get_users_page(10)
     
     if not users:
         await message.answer("هیچ کاربری وجود ندارد.")
@@ -1268,13 +2300,13 @@ async def list_users_message(message: Message):
     # Show first 10 users
     users_text = "👥 لیست کاربران (10 کاربر اول):\n\n"
     
-    for i, user in enumerate(users[:10], 1):
+    for i, user in enumerate(users, 1):
         users_text += f"{i}. {user['first_name'] or ''} {user['last_name'] or ''}\n"
         users_text += f"   🆔 {user['user_id']} | @{user['username'] or 'ندارد'}\n"
         users_text += f"   📅 {user['created_at'][:10]}\n\n"
     
-    if len(users) > 10:
-        users_text += f"... و {len(users) - 10} کاربر دیگر"
+    if total > 10:
+        users_text += f"... و {total - 10} کاربر دیگر"
     
     await message.answer(users_text)
 
@@ -1284,7 +2316,7 @@ async def search_user_message(message: Message, state: FSMContext):
     if message.from_user.id != SUPER_ADMIN_ID:
         return
     
-    await message.answer("🔍 لطفاً ID کاربر مورد نظر را وارد کنید:")
+    await message.answer("🔍 لطفاً آیدی عددی، یوزرنیم یا نام کاربر مورد نظر را وارد کنید:")
     await state.set_state(AdminStates.waiting_for_user_id)
 
 @dp.message(F.text.in_(["👤 دیدن اطلاعات کاربر", "👤 Просмотр информации о пользователе", "👤 View User Info"]))
@@ -1293,19 +2325,7 @@ async def view_user_info_message(message: Message):
     if message.from_user.id != SUPER_ADMIN_ID:
         return
     
-    users = await db.get_all_users()
-    
-    if not users:
-        await message.answer("هیچ کاربری وجود ندارد.")
-        return
-    
-    # Show users with inline keyboard for selection
-    keyboard = []
-    for user in users[:20]:  # Show first 20 users
-        name = f"{user['first_name'] or ''} {user['last_name'] or ''}" or f"User {user['user_id']}"
-        keyboard.append([InlineKeyboardButton(text=f"{name[:30]}...", callback_data=f"user_info_{user['user_id']}")])
-    
-    await message.answer("👤 انتخاب کاربر برای مشاهده اطلاعات:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+    await show_users_page(message, 0)
 
 @dp.message(F.text.in_(["💰 ریفاند کلی استارز", "💰 Возврат всех звезд", "💰 Refund All Stars"]))
 async def refund_all_stars_message(message: Message):
@@ -1313,8 +2333,8 @@ async def refund_all_stars_message(message: Message):
     if message.from_user.id != SUPER_ADMIN_ID:
         return
     
-    # Get total stars to refund
-    total_stars = await db.get_total_stars_paid()
+    # Get total stars to refund (paid minus already refunded)
+    total_stars = (await db.get_ledger_balance())['balance']
     
     if total_stars == 0:
         await message.answer("💰 هیچ ستاره‌ای برای ریفاند وجود ندارد.")
@@ -1331,14 +2351,14 @@ async def refund_all_stars_message(message: Message):
         reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
     )
 
-@dp.message(F.text.in_(["📊 آمار تفصیلی", "📊 Подробная статистика", "📊 Detailed Statistics"]))
+@dp.message(F.text.in_(["📊 آمار تفصیلی", "📊 Подробная статистика", "📊 Detailed Statistics"]), flags={'low_priority': True})
 async def detailed_stats_message(message: Message):
     """Show detailed statistics via reply keyboard"""
     if message.from_user.id != SUPER_ADMIN_ID:
         return
     
     stats = await db.get_user_stats()
-    total_stars = await db.get_total_stars_paid()
+    ledger_balance = await db.get_ledger_balance()
     
     stats_text = "📊 آمار تفصیلی سیستم\n\n"
     stats_text += f"👥 کل کاربران: {stats.get('total_users', 0)}\n"
@@ -1348,18 +2368,20 @@ async def detailed_stats_message(message: Message):
     stats_text += f"⏳ آگهی‌های در انتظار: {stats.get('pending_ads', 0)}\n"
     stats_text += f"🆘 کل درخواست‌های پشتیبانی: {stats.get('total_support_requests', 0)}\n"
     stats_text += f"⏳ درخواست‌های پشتیبانی در انتظار: {stats.get('pending_support_requests', 0)}\n"
-    stats_text += f"💰 کل ستاره‌های پرداخت شده: {total_stars}\n"
+    stats_text += f"💰 کل ستاره‌های پرداخت شده: {ledger_balance['charged']}\n"
+    stats_text += f"💸 کل ستاره‌های ریفاند شده: {ledger_balance['refunded']}\n"
+    stats_text += f"📒 مانده خالص: {ledger_balance['balance']}\n"
     
     await message.answer(stats_text)
 
-@dp.callback_query(F.data == "list_users")
+@dp.callback_query(F.data == "list_users", flags={'low_priority': True})
 async def list_users(callback: CallbackQuery):
     """List all users"""
     if callback.from_user.id != SUPER_ADMIN_ID:
         await callback.answer("دسترسی ندارید.", show_alert=True)
         return
     
-    users = await db.get_all_users()
+    total, users = await db.get_users_page(10)
     
     if not users:
         await callback.answer("هیچ کاربری وجود ندارد.", show_alert=True)
@@ -1368,13 +2390,13 @@ async def list_users(callback: CallbackQuery):
     # Show first 10 users
     users_text = "👥 لیست کاربران (10 کاربر اول):\n\n"
     
-    for i, user in enumerate(users[:10], 1):
+    for i, user in enumerate(users, 1):
         users_text += f"{i}. {user['first_name'] or ''} {user['last_name'] or ''}\n"
         users_text += f"   🆔 {user['user_id']} | @{user['username'] or 'ندارد'}\n"
         users_text += f"   📅 {user['created_at'][:10]}\n\n"
     
-    if len(users) > 10:
-        users_text += f"... و {len(users) - 10} کاربر دیگر"
+    if total > 10:
+        users_text += f"... و {total - 10} کاربر دیگر"
     
     await callback.message.answer(users_text)
     await callback.answer()
@@ -1386,7 +2408,7 @@ async def search_user_callback(callback: CallbackQuery, state: FSMContext):
         await callback.answer("دسترسی ندارید.", show_alert=True)
         return
     
-    await callback.message.answer("🔍 آیدی کاربر را وارد کنید:")
+    await callback.message.answer("🔍 آیدی عددی، یوزرنیم یا نام کاربر را وارد کنید:")
     await state.set_state(AdminStates.waiting_for_user_id)
     await callback.answer()
 
@@ -1397,27 +2419,68 @@ async def view_user_info_callback(callback: CallbackQuery):
         await callback.answer("دسترسی ندارید.", show_alert=True)
         return
     
-    users = await db.get_all_users()
+    await show_users_page(callback.message, 0)
+    await callback.answer()
+
+async def show_users_page(message: Message, page: int, query: str = None, edit: bool = False):
+    """Show one page of users (newest first, or matches of a username/name search) with a button per user"""
+    truncated = False
+    if query:
+        total, users, truncated = await db.search_users(query, limit=USERS_PAGE_SIZE, offset=page * USERS_PAGE_SIZE)
+    else:
+        total, users = await db.get_users_page(USERS_PAGE_SIZE, offset=page * USERS_PAGE_SIZE)
     
-    if not users:
-        await callback.answer("هیچ کاربری وجود ندارد.", show_alert=True)
+    if not total:
+        await message.answer(f"❌ کاربری برای «{query}» یافت نشد." if query else "هیچ کاربری وجود ندارد.")
         return
     
-    # Show first 20 users with inline buttons
-    users_text = "👤 انتخاب کاربر برای مشاهده اطلاعات:\n\n"
-    keyboard = []
+    pages = (total + USERS_PAGE_SIZE - 1) // USERS_PAGE_SIZE
+    if query:
+        users_text = f"🔍 نتایج «{query}»: {total}{'+' if truncated else ''} کاربر (صفحه {page + 1} از {pages})"
+        if truncated:
+            users_text += "\nبرای نتایج دقیق‌تر عبارت کامل‌تری وارد کنید."
+    else:
+        users_text = f"👤 انتخاب کاربر برای مشاهده اطلاعات:\n\n{total} کاربر (صفحه {page + 1} از {pages})"
     
-    for i, user in enumerate(users[:20], 1):
+    keyboard = []
+    for i, user in enumerate(users, page * USERS_PAGE_SIZE + 1):
         user_name = f"{user['first_name'] or ''} {user['last_name'] or ''}".strip() or "بدون نام"
-        username = f"@{user['username']}" if user['username'] else "بدون یوزرنیم"
-        
-        button_text = f"{i}. {user_name} ({user['user_id']})"
-        keyboard.append([InlineKeyboardButton(text=button_text, callback_data=f"user_info_{user['user_id']}")])
+        username = f" @{user['username']}" if user['username'] else ""
+        button_text = f"{i}. {user_name}{username} ({user['user_id']})"
+        keyboard.append([InlineKeyboardButton(text=button_text[:64], callback_data=f"user_info_{user['user_id']}")])
+    
+    # Search pages keep the query in state data, so the buttons only carry the page number
+    prefix = "user_search_page_" if query else "users_page_"
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton(text="◀️ قبلی", callback_data=f"{prefix}{page - 1}"))
+    if page + 1 < pages:
+        navigation.append(InlineKeyboardButton(text="بعدی ▶️", callback_data=f"{prefix}{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    
+    markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
+    if edit:
+        await message.edit_text(users_text, reply_markup=markup)
+    else:
+        await message.answer(users_text, reply_markup=markup)
+
+@dp.callback_query(F.data.startswith("users_page_") | F.data.startswith("user_search_page_"))
+async def users_page_callback(callback: CallbackQuery, state: FSMContext):
+    """Show another page of the user list or of user search results"""
+    if callback.from_user.id != SUPER_ADMIN_ID:
+        await callback.answer("دسترسی ندارید.", show_alert=True)
+        return
     
-    if len(users) > 20:
-        users_text += f"نمایش 20 کاربر اول از {len(users)} کاربر"
+    page = int(callback.data.rsplit("_", 1)[1])
+    query = None
+    if callback.data.startswith("user_search_page_"):
+        query = (await state.get_data()).get('user_search_query')
+        if not query:
+            await callback.answer("جستجو منقضی شده است. لطفاً دوباره جستجو کنید.", show_alert=True)
+            return
     
-    await callback.message.answer(users_text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+    await show_users_page(callback.message, page, query=query, edit=True)
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("user_info_"))
@@ -1464,8 +2527,16 @@ async def process_user_search(message: Message, state: FSMContext):
     if message.from_user.id != SUPER_ADMIN_ID:
         return
     
+    query = (message.text or '').strip()
+    if not query.isdigit():
+        # Username or name: list the matches, each opening the user's details
+        await state.set_state(None)
+        await state.update_data(user_search_query=query)
+        await show_users_page(message, 0, query=query)
+        return
+    
     try:
-        user_id = int(message.text)
+        user_id = int(query)
         user_info = await db.get_user_by_id(user_id)
         
         if not user_info:
@@ -1540,27 +2611,31 @@ async def confirm_refund_all_handler(callback: CallbackQuery):
     total_count = len(paid_ads)
     
     for ad in paid_ads:
+        if ad.get('refund_status') == 'refunded':
+            total_count -= 1
+            continue
         try:
             if ad['telegram_payment_charge_id']:
                 # Refund the stars
-                refund_result = await bot(RefundStarPayment(
+                refund_result = await call_with_retry(bot, RefundStarPayment(
                     user_id=ad['user_id'],
                     telegram_payment_charge_id=ad['telegram_payment_charge_id']
-                ))
+                ), db=db, context={'kind': 'refund', 'ad_id': ad['id']})
                 
                 if refund_result:
                     success_count += 1
-                    logger.info(f"Successfully refunded stars for ad {ad['id']} (user {ad['user_id']})")
+                    await db.update_refund_status(ad['id'], True)
+                    item_logger.info("Successfully refunded stars for ad %s (user %s)", ad['id'], ad['user_id'], extra={'ad_id': ad['id']})
                 else:
                     failed_count += 1
-                    logger.error(f"Failed to refund stars for ad {ad['id']} (user {ad['user_id']})")
+                    logger.error("Failed to refund stars for ad %s (user %s)", ad['id'], ad['user_id'], extra={'ad_id': ad['id']})
             else:
                 failed_count += 1
-                logger.error(f"No payment charge ID for ad {ad['id']}")
+                logger.error("No payment charge ID for ad %s", ad['id'], extra={'ad_id': ad['id']})
                 
         except Exception as e:
             failed_count += 1
-            logger.error(f"Error refunding stars for ad {ad['id']}: {e}")
+            logger.error("Error refunding stars for ad %s: %s", ad['id'], e, extra={'ad_id': ad['id']})
     
     # Show results
     result_text = f"✅ ریفاند کلی استارز تکمیل شد!\n\n"
@@ -1695,9 +2770,9 @@ async def process_manual_refund_amount(message: Message, state: FSMContext):
     data = await state.get_data()
     target_user_id = data.get('target_user_id')
     
-    # Get user's latest payment charge ID
-    latest_payment = await db.get_latest_payment_charge_id(target_user_id)
-    if not latest_payment:
+    # Telegram refunds whole charges, so pick unrefunded charges (newest first) that fit in the amount
+    refundable_payments = await db.get_refundable_payments(target_user_id)
+    if not refundable_payments:
         await message.answer(
             get_text('manual_refund_no_payment_history', language),
             reply_markup=get_back_keyboard(language)
@@ -1705,35 +2780,120 @@ async def process_manual_refund_amount(message: Message, state: FSMContext):
         await state.clear()
         return
     
+    selected_payments = []
+    selected_amount = 0
+    for payment in refundable_payments:
+        if selected_amount + payment['stars_paid'] <= amount:
+            selected_payments.append(payment)
+            selected_amount += payment['stars_paid']
+    
+    if not selected_payments:
+        await message.answer(
+            get_text('manual_refund_amount_too_small', language,
+                     min_amount=min(payment['stars_paid'] for payment in refundable_payments)),
+            reply_markup=get_back_keyboard(language)
+        )
+        return
+    
+    refunded_amount = 0
     try:
-        # Perform the refund
-        await bot(RefundStarPayment(
-            user_id=target_user_id,
-            telegram_payment_charge_id=latest_payment['telegram_payment_charge_id']
-        ))
-        
-        # Update database
-        await db.update_refund_status(latest_payment['id'], True)
+        for payment in selected_payments:
+            # Perform the refund
+            await bot(RefundStarPayment(
+                user_id=target_user_id,
+                telegram_payment_charge_id=payment['telegram_payment_charge_id']
+            ))
+            
+            # Update database and ledger
+            await db.update_refund_status(payment['id'], True)
+            refunded_amount += payment['stars_paid']
         
         # Notify admin of success
-        success_message = get_text('manual_refund_success', language, user_id=target_user_id, amount=amount)
+        success_message = get_text('manual_refund_success', language, user_id=target_user_id, amount=refunded_amount)
         await message.answer(success_message, reply_markup=get_super_admin_keyboard(language))
         
-        # Notify user
-        target_user = await db.get_user(target_user_id)
-        target_language = target_user.get('language', 'fa') if target_user else 'fa'
-        user_notification = get_text('manual_refund_user_notification', target_language, amount=amount)
-        await bot.send_message(target_user_id, user_notification)
-        
-        logger.info(f"Manual refund successful: {amount} stars to user {target_user_id}")
+        logger.info("Manual refund successful: %s stars to user %s", refunded_amount, target_user_id)
         
     except Exception as e:
         error_message = get_text('manual_refund_failed', language, error=str(e))
+        if refunded_amount:
+            error_message += "\n" + get_text('manual_refund_success', language, user_id=target_user_id, amount=refunded_amount)
         await message.answer(error_message, reply_markup=get_super_admin_keyboard(language))
-        logger.error(f"Manual refund failed for user {target_user_id}: {e}")
+        logger.error("Manual refund failed for user %s: %s", target_user_id, e)
+    
+    if refunded_amount:
+        # Notify user
+        target_user = await db.get_user(target_user_id)
+        target_language = target_user.get('language', 'fa') if target_user else 'fa'
+        user_notification = get_text('manual_refund_user_notification', target_language, amount=refunded_amount)
+        try:
+            await bot.send_message(target_user_id, user_notification)
+        except Exception as e:
+            logger.error("Failed to notify user %s about manual refund: %s", target_user_id, e)
     
     await state.clear()
 
+@dp.message(Command('reconcile_ledger'))
+async def reconcile_ledger_command(message: Message):
+    """Re-derive ledger balances from ledger entries and report mismatches"""
+    if message.from_user.id != SUPER_ADMIN_ID:
+        return
+    
+    mismatches = await db.reconcile_ledger()
+    if not mismatches:
+        ledger_balance = await db.get_ledger_balance()
+        await message.answer(f"✅ دفتر پرداخت‌ها سازگار است.\n📒 تعداد ثبت‌ها: {ledger_balance['entries']}\n💰 مانده خالص: {ledger_balance['balance']}")
+        return
+    
+    text = f"⚠️ {len(mismatches)} مانده ناسازگار یافت شد:\n\n"
+    for mismatch in mismatches[:20]:
+        text += f"🆔 {mismatch['user_id']}: ذخیره شده {mismatch['stored_balance']} | محاسبه شده {mismatch['derived_balance']}\n"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔧 بازسازی مانده‌ها از دفتر", callback_data="ledger_rebuild")]
+    ])
+    await message.answer(text, reply_markup=keyboard)
+
+@dp.callback_query(F.data == "ledger_rebuild")
+async def rebuild_ledger_balances(callback: CallbackQuery):
+    """Rebuild ledger balances from ledger entries"""
+    if callback.from_user.id != SUPER_ADMIN_ID:
+        await callback.answer("دسترسی ندارید.", show_alert=True)
+        return
+    
+    mismatches = await db.reconcile_ledger(fix=True)
+    await callback.message.edit_text(f"✅ مانده‌ها بازسازی شدند ({len(mismatches)} مورد اصلاح شد).")
+    await callback.answer()
+
+@dp.message(Command('reconcile_stars'))
+async def reconcile_stars_command(message: Message):
+    """Reconcile new Star transactions now and show open discrepancies"""
+    if message.from_user.id != SUPER_ADMIN_ID:
+        return
+    
+    try:
+        summary = await reconcile_star_transactions(bot, db)
+    except Exception as e:
+        await message.answer(f"❌ خطا در دریافت تراکنش‌های استارز: {e}")
+        return
+    
+    text = "🔎 تطبیق تراکنش‌های استارز\n\n"
+    text += f"📥 تراکنش‌های جدید: {summary['transactions']}\n"
+    text += f"⚠️ مغایرت‌های جدید: {summary['discrepancies']}\n"
+    
+    open_summary = await db.get_discrepancy_summary()
+    if open_summary:
+        text += "\n📋 مغایرت‌های باز:\n"
+        for row in open_summary:
+            text += f"• {row['kind']}: {row['count']}\n"
+        
+        text += "\n🕐 آخرین موارد:\n"
+        for discrepancy in await db.get_open_discrepancies(limit=10):
+            ad_text = f"آگهی {discrepancy['ad_id']}" if discrepancy['ad_id'] else "بدون آگهی"
+            text += f"#{discrepancy['id']} {discrepancy['kind']} | {ad_text} | {discrepancy['details']}\n"
+    
+    await message.answer(text)
+
 # Refund by Transaction ID Handlers
 @dp.message(F.text.in_(["🔍 ریفاند با Transaction ID", "🔍 Возврат по Transaction ID", "🔍 Refund by Transaction ID"]))
 async def refund_by_transaction_button_handler(message: Message, state: FSMContext):
@@ -1808,22 +2968,496 @@ async def process_refund_by_transaction_id(message: Message, state: FSMContext):
         user_notification = get_text('manual_refund_user_notification', target_language, amount=payment_data['stars_paid'])
         await bot.send_message(payment_data['user_id'], user_notification)
         
-        logger.info(f"Refund by transaction ID successful: {payment_data['stars_paid']} stars to user {payment_data['user_id']} (Transaction: {transaction_id})")
+        logger.info("Refund by transaction ID successful: %s stars to user %s (Transaction: %s)", payment_data['stars_paid'], payment_data['user_id'], transaction_id)
         
     except Exception as e:
         error_message = get_text('refund_by_transaction_failed', language, error=str(e))
         await message.answer(error_message, reply_markup=get_super_admin_keyboard(language))
-        logger.error(f"Refund by transaction ID failed for transaction {transaction_id}: {e}")
+        logger.error("Refund by transaction ID failed for transaction %s: %s", transaction_id, e)
+    
+    await state.clear()
+
+# Performance Handlers
+def format_histogram_stats(title: str, histogram: metrics.Histogram, limit: int = 8) -> str:
+    """Render the slowest series of a latency histogram"""
+    rows = histogram.stats()[:limit]
+    if not rows:
+        return f"{title}\nبدون داده\n"
+    
+    text = f"{title}\n"
+    for row in rows:
+        text += f"• {row['label']}: {row['count']}× | میانگین {row['avg'] * 1000:.1f}ms | p95 ≤ {row['p95'] * 1000:.0f}ms\n"
+    return text
+
+@dp.message(Command('perf'))
+async def perf_command(message: Message):
+    """Show handler, database and Bot API latency"""
+    if message.from_user.id != SUPER_ADMIN_ID:
+        return
+    
+    statements = metrics.db_statements_per_update
+    updates = statements.count()
+    avg_statements = statements.sums.get('', 0) / updates if updates else 0
+    
+    text = "⏱ عملکرد ربات\n\n"
+    text += format_histogram_stats("🧩 هندلرها:", metrics.handler_seconds) + "\n"
+    text += format_histogram_stats("🗄 متدهای دیتابیس:", metrics.db_method_seconds) + "\n"
+    text += format_histogram_stats("📡 درخواست‌های Bot API:", metrics.api_call_seconds) + "\n"
+    text += f"📊 آپدیت‌ها: {updates} | میانگین کوئری در هر آپدیت: {avg_statements:.1f} | p95 ≤ {statements.quantile(0.95):.0f}"
+    
+    await message.answer(text)
+
+profile_lock = asyncio.Lock()
+
+def memory_structure_sizes() -> Dict[str, Any]:
+    """Sizes of in-process structures reported by /profile memory"""
+    sizes = {'user_ads': lambda: len(user_ads), 'user_ads_bytes': user_ads.approximate_bytes}
+    if isinstance(storage, TTLMemoryStorage):
+        sizes['fsm_storage'] = lambda: len(storage.storage)
+    return sizes
+
+async def run_profile(chat_id: int, seconds: int, mode: str):
+    """Profile in the background so the admin's other updates aren't queued behind the window"""
+    async with profile_lock:
+        try:
+            if mode == 'memory':
+                summary, report = await profile_memory(seconds, memory_structure_sizes())
+            else:
+                summary, report = await profile_cpu(seconds)
+            await bot.send_message(chat_id, summary[:4000])
+            await bot.send_document(chat_id, BufferedInputFile(report.encode(), filename=f"profile-{mode}.txt"))
+        except Exception as e:
+            logger.error("Error profiling: %s", e)
+            await bot.send_message(chat_id, f"❌ خطا در پروفایل: {e}")
+
+@dp.message(Command('profile'))
+async def profile_command(message: Message):
+    """Handle /profile <seconds> [memory]"""
+    if message.from_user.id != SUPER_ADMIN_ID:
+        return
+    
+    args = message.text.split()[1:]
+    try:
+        seconds = int(args[0]) if args else 10
+    except ValueError:
+        seconds = 0
+    mode = args[1] if len(args) > 1 else 'cpu'
+    if not 1 <= seconds <= 120 or mode not in ('cpu', 'memory'):
+        await message.answer("❌ استفاده: /profile <1-120 ثانیه> [memory]")
+        return
+    
+    if profile_lock.locked():
+        await message.answer("⏳ یک پروفایل دیگر در حال اجراست.")
+        return
+    
+    await message.answer(f"⏱ پروفایل {'حافظه' if mode == 'memory' else 'CPU'} به مدت {seconds} ثانیه شروع شد...")
+    spawn_background(run_profile(message.chat.id, seconds, mode))
+
+# Dead-letter Handlers
+@dp.message(Command('dead_letters'))
+async def dead_letters_command(message: Message):
+    """Show failed Bot API calls waiting in the dead-letter table"""
+    if message.from_user.id != SUPER_ADMIN_ID:
+        return
+    
+    summary = await db.get_dead_letter_summary()
+    if not summary:
+        await message.answer("✅ هیچ درخواست ناموفقی در صف وجود ندارد.")
+        return
+    
+    text = "📮 درخواست‌های ناموفق (Dead Letters)\n\n"
+    for row in summary:
+        text += f"• {row['method']} ({row['error_kind']}): {row['count']}\n"
+    
+    text += "\n🕐 آخرین موارد:\n"
+    for entry in await db.get_dead_letters(limit=5):
+        text += f"#{entry['id']} {entry['method']} - {(entry['error'] or '')[:80]}\n"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔁 ارسال مجدد همه", callback_data="dead_letters_replay")],
+        [InlineKeyboardButton(text="🗑 حذف همه", callback_data="dead_letters_discard")]
+    ])
+    await message.answer(text, reply_markup=keyboard)
+
+dead_letter_lock = asyncio.Lock()
+
+async def run_dead_letter_replay(progress_message: Message):
+    """Replay dead letters in the background; rate-limited channel posts can take minutes"""
+    async with dead_letter_lock:
+        try:
+            result = await replay_dead_letters(bot, db, on_replayed={
+                'channel_post': store_replayed_channel_post,
+                'refund': store_replayed_refund,
+                'bump_refund': store_replayed_bump_refund
+            })
+        except Exception as e:
+            logger.error("Error replaying dead letters: %s", e)
+            await progress_message.edit_text(f"❌ خطا در ارسال مجدد: {e}")
+            return
+    
+    result_text = "🔁 ارسال مجدد تکمیل شد!\n\n"
+    result_text += f"✅ موفق: {result['replayed']}\n"
+    result_text += f"❌ ناموفق: {result['failed']}"
+    await progress_message.edit_text(result_text)
+
+@dp.callback_query(F.data == "dead_letters_replay")
+async def replay_dead_letters_handler(callback: CallbackQuery):
+    """Replay all pending dead letters"""
+    if callback.from_user.id != SUPER_ADMIN_ID:
+        await callback.answer("دسترسی ندارید.", show_alert=True)
+        return
+    
+    if dead_letter_lock.locked():
+        await callback.answer("⏳ ارسال مجدد در حال اجراست.", show_alert=True)
+        return
+    
+    await callback.answer()
+    await callback.message.edit_text("🔄 در حال ارسال مجدد درخواست‌های ناموفق...")
+    spawn_background(run_dead_letter_replay(callback.message))
+
+@dp.callback_query(F.data == "dead_letters_discard")
+async def discard_dead_letters_handler(callback: CallbackQuery):
+    """Discard all pending dead letters"""
+    if callback.from_user.id != SUPER_ADMIN_ID:
+        await callback.answer("دسترسی ندارید.", show_alert=True)
+        return
+    
+    discarded = await db.discard_dead_letters()
+    await callback.message.edit_text(f"🗑 {discarded} درخواست ناموفق حذف شد.")
+    await callback.answer()
+
+# Broadcast Handlers
+def format_broadcast_progress(broadcast: Dict[str, Any]) -> str:
+    """Build the broadcast progress report"""
+    status_titles = {
+        'running': '🔄 در حال ارسال',
+        'done': '✅ ارسال همگانی تکمیل شد',
+        'cancelled': '⛔ ارسال همگانی لغو شد'
+    }
+    processed = broadcast['sent_count'] + broadcast['failed_count'] + broadcast['blocked_count']
+    text = f"📣 {status_titles.get(broadcast['status'], broadcast['status'])} (#{broadcast['id']})\n\n"
+    text += f"📊 پیشرفت: {processed} از {broadcast['total_count']}\n"
+    text += f"✅ موفق: {broadcast['sent_count']}\n"
+    text += f"🚫 ربات را مسدود کرده‌اند: {broadcast['blocked_count']}\n"
+    text += f"❌ ناموفق: {broadcast['failed_count']}"
+    return text
+
+async def report_broadcast_progress(broadcast: Dict[str, Any]):
+    """Edit the admin's progress message of a broadcast"""
+    if not broadcast or not broadcast.get('progress_message_id'):
+        return
+    
+    keyboard = None
+    if broadcast['status'] == 'running':
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="⛔ توقف ارسال", callback_data=f"broadcast_cancel_{broadcast['id']}")]
+        ])
+    
+    try:
+        await bot.edit_message_text(
+            format_broadcast_progress(broadcast),
+            chat_id=broadcast['progress_chat_id'],
+            message_id=broadcast['progress_message_id'],
+            reply_markup=keyboard
+        )
+    except Exception as e:
+        logger.error("Error updating broadcast progress for broadcast %s: %s", broadcast['id'], e)
+
+broadcast_runner = BroadcastRunner(
+    bot, db, message_limiter,
+    concurrency=BROADCAST_CONCURRENCY,
+    on_progress=report_broadcast_progress,
+    load_guard=load_guard
+)
+
+@dp.message(Command('broadcast'), flags={'low_priority': True})
+async def broadcast_command(message: Message, state: FSMContext):
+    """Handle /broadcast command"""
+    if message.from_user.id != SUPER_ADMIN_ID:
+        return
+    
+    await message.answer("📣 پیامی که می‌خواهید برای همه کاربران ارسال شود را بفرستید (متن، عکس یا هر نوع پیام دیگر):")
+    await state.set_state(BroadcastStates.waiting_for_broadcast_message)
+
+@dp.message(StateFilter(BroadcastStates.waiting_for_broadcast_message))
+async def process_broadcast_message(message: Message, state: FSMContext):
+    """Save the broadcast message as a draft and ask for confirmation"""
+    if message.from_user.id != SUPER_ADMIN_ID:
+        return
     
+    broadcast_id = await db.create_broadcast(message.from_user.id, message.chat.id, message.message_id)
+    active_users = await db.count_active_users()
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ شروع ارسال", callback_data=f"broadcast_confirm_{broadcast_id}")],
+        [InlineKeyboardButton(text="❌ لغو", callback_data=f"broadcast_cancel_{broadcast_id}")]
+    ])
+    await message.reply(
+        f"⚠️ این پیام برای {active_users} کاربر فعال ارسال خواهد شد. آیا مطمئن هستید؟",
+        reply_markup=keyboard
+    )
     await state.clear()
 
+@dp.callback_query(F.data.startswith("broadcast_confirm_"), flags={'low_priority': True})
+async def confirm_broadcast(callback: CallbackQuery):
+    """Start a confirmed broadcast"""
+    if callback.from_user.id != SUPER_ADMIN_ID:
+        await callback.answer("دسترسی ندارید.", show_alert=True)
+        return
+    
+    broadcast_id = int(callback.data.split("_")[2])
+    broadcast = await db.get_broadcast(broadcast_id)
+    if not broadcast or broadcast['status'] != 'draft':
+        await callback.answer("این ارسال همگانی قبلاً شروع یا لغو شده است.", show_alert=True)
+        return
+    
+    total_count = await db.count_active_users()
+    await db.start_broadcast(broadcast_id, total_count, callback.message.chat.id, callback.message.message_id)
+    await report_broadcast_progress(await db.get_broadcast(broadcast_id))
+    spawn_background(broadcast_runner.run(broadcast_id))
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("broadcast_cancel_"))
+async def cancel_broadcast(callback: CallbackQuery):
+    """Cancel a draft or running broadcast"""
+    if callback.from_user.id != SUPER_ADMIN_ID:
+        await callback.answer("دسترسی ندارید.", show_alert=True)
+        return
+    
+    broadcast_id = int(callback.data.split("_")[2])
+    broadcast = await db.get_broadcast(broadcast_id)
+    if not broadcast or broadcast['status'] not in ('draft', 'running'):
+        await callback.answer("این ارسال همگانی فعال نیست.", show_alert=True)
+        return
+    
+    # A running broadcast stops after its current batch
+    await db.finish_broadcast(broadcast_id, 'cancelled')
+    await callback.message.edit_text(format_broadcast_progress(await db.get_broadcast(broadcast_id)))
+    await callback.answer()
+
+async def restart_ad_lifecycle(ad_ids: list):
+    """Schedule the availability reminder of ads that were just listed, relisted, confirmed or bumped"""
+    if AD_REMIND_AFTER_HOURS > 0 and ad_ids:
+        await db.set_ad_timers(ad_ids, 'remind', time.time() + AD_REMIND_AFTER_HOURS * 3600)
+
+async def fire_ad_timer(ad_id: int, kind: str, due_at: float):
+    """Send an availability reminder or expire an unconfirmed ad"""
+    ad = await db.get_ad(ad_id)
+    if not ad or ad['status'] != 'approved' or ad.get('sold_status') != 'available':
+        await db.claim_ad_timer(ad_id, kind, due_at)
+        return
+    language = await db.get_user_language(ad['user_id'])
+    
+    if kind == 'remind':
+        # Claiming moves the ad to its expiry step, so a reminder is sent at most once
+        if not await db.claim_ad_timer(ad_id, kind, due_at, ('expire', time.time() + AD_CONFIRM_HOURS * 3600)):
+            return
+        keyboard = [
+            [InlineKeyboardButton(text=get_text('confirm_available_button', language), callback_data=f"confirm_available_{ad_id}")],
+            [InlineKeyboardButton(text=get_text('mark_as_sold_button', language), callback_data=f"mark_sold_{ad_id}")]
+        ]
+        if BUMP_STARS:
+            keyboard.append([InlineKeyboardButton(text=get_text('bump_button', language, stars=BUMP_STARS), callback_data=f"bump_{ad_id}")])
+        await message_limiter.acquire()
+        await call_with_retry(bot, SendMessage(
+            chat_id=ad['user_id'],
+            text=get_text('ad_reminder', language, link=ad['gift_link'], price=ad['price'], hours=AD_CONFIRM_HOURS),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+        ), db=db)
+    else:
+        # The seller may have marked the ad sold since the timer was claimed
+        if not await db.claim_ad_timer(ad_id, kind, due_at) or not await db.update_sold_status(ad_id, 'expired', only_from='available'):
+            return
+        await channel_limiter.acquire()
+        await update_channel_ad_text(ad_id, 'expired')
+        await message_limiter.acquire()
+        await call_with_retry(bot, SendMessage(
+            chat_id=ad['user_id'],
+            text=get_text('ad_expired_notice', language, link=ad['gift_link']),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(
+                text=get_text('mark_as_available_button', language), callback_data=f"mark_available_{ad_id}"
+            )]])
+        ), db=db)
+    
+    metrics.ad_lifecycle_events.inc(kind)
+    item_logger.info("Ad lifecycle step %s for ad %s", kind, ad_id, extra={'ad_id': ad_id})
+
+async def lifecycle_scheduler():
+    """
+    Fire ad lifecycle timers on time. Timers due within the horizon are loaded from the due time
+    index into a timing wheel every half horizon; the wheel is advanced once per second. A timer
+    changed after it was loaded is skipped when claimed, so the wheel never has to be kept in sync.
+    """
+    try:
+        # Ads listed before reminders were enabled
+        scheduled = await db.schedule_missing_reminders(AD_REMIND_AFTER_HOURS * 3600)
+        if scheduled:
+            logger.info("Scheduled reminders for %d listed ads", scheduled)
+    except Exception as e:
+        logger.error("Error scheduling missing ad reminders: %s", e)
+    
+    wheel = TimerWheel()
+    next_load = 0
+    while True:
+        now = time.time()
+        try:
+            if now >= next_load:
+                timers = await db.get_due_ad_timers(now + LIFECYCLE_HORIZON_SECONDS, LIFECYCLE_LOAD_LIMIT)
+                for ad_id, kind, due_at in timers:
+                    wheel.schedule((ad_id, kind, due_at), due_at)
+                next_load = now + LIFECYCLE_HORIZON_SECONDS / 2
+                if len(timers) == LIFECYCLE_LOAD_LIMIT:
+                    # A full load holds every timer up to the last one's due time; read on from there
+                    next_load = min(next_load, timers[-1][2])
+                metrics.ad_timers_loaded.set(len(wheel))
+            
+            for ad_id, kind, due_at in wheel.advance(now):
+                try:
+                    await fire_ad_timer(ad_id, kind, due_at)
+                except Exception as e:
+                    logger.error("Error running %s timer of ad %s: %s", kind, ad_id, e, extra={'ad_id': ad_id})
+        except Exception as e:
+            logger.error("Error in ad lifecycle scheduler: %s", e)
+        await asyncio.sleep(1)
+
+async def state_sweeper(sweep_fsm: bool):
+    """Evict idle drafts (and FSM states when this process owns the sweep) and publish their sizes"""
+    while True:
+        try:
+            evicted_before = user_ads.evicted
+            user_ads.sweep()
+            metrics.evicted_entries.inc('drafts', user_ads.evicted - evicted_before)
+            metrics.draft_entries.set(len(user_ads))
+            metrics.draft_bytes.set(user_ads.approximate_bytes())
+            if sweep_fsm:
+                metrics.evicted_entries.inc('fsm', await storage.sweep(FSM_TTL_SECONDS))
+                metrics.fsm_entries.set(await storage.entry_count())
+        except Exception as e:
+            logger.error("Error sweeping idle states: %s", e)
+        await asyncio.sleep(STATE_SWEEP_INTERVAL_SECONDS)
+
+async def start_background_jobs():
+    """Start the jobs that must run in exactly one process"""
+    # Reconcile Star transactions in the background
+    if RECONCILE_INTERVAL_SECONDS > 0:
+        spawn_background(reconciliation_worker(bot, db, RECONCILE_INTERVAL_SECONDS))
+    
+    # Resume broadcasts interrupted by a restart
+    for broadcast in await db.get_running_broadcasts():
+        spawn_background(broadcast_runner.run(broadcast['id']))
+    
+    # Publish queued digests in the background
+    if DIGEST_MODE:
+        spawn_background(digest_worker())
+    
+    # Remind sellers of old listings and expire the unconfirmed ones
+    if AD_REMIND_AFTER_HOURS > 0:
+        spawn_background(lifecycle_scheduler())
+
 async def main():
     """Main function"""
     # Initialize database
     await db.init_db()
     
+    # Measure event loop lag for load shedding
+    spawn_background(load_guard.monitor())
+    
+    # Drop abandoned drafts and FSM states
+    spawn_background(state_sweeper(sweep_fsm=True))
+    
+    # Expose metrics for Prometheus
+    if METRICS_PORT:
+        await metrics.start_metrics_server(METRICS_PORT)
+    
+    await start_background_jobs()
+    
+    if update_recorder:
+        update_recorder.start()
+    
     # Start polling
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if update_recorder:
+            update_recorder.close()
+        log_listener.stop()
+
+async def worker_main(index: int, update_queue):
+    """Handle the updates routed to one worker process"""
+    spawn_background(load_guard.monitor())
+    
+    # Drafts live in each worker; the shared FSM table is swept by the admin worker only
+    spawn_background(state_sweeper(sweep_fsm=index == ADMIN_WORKER))
+    
+    if METRICS_PORT:
+        await metrics.start_metrics_server(METRICS_PORT + index)
+    
+    if index == ADMIN_WORKER:
+        await start_background_jobs()
+    
+    try:
+        await consume_updates(bot, dp, update_queue)
+    finally:
+        await bot.session.close()
+
+def run_worker(index: int, update_queue, limiters):
+    """Entry point of a worker process"""
+    global log_listener, channel_limiter, message_limiter
+    # Threads don't survive fork, so the child needs its own log listener
+    log_listener = configure_logging()
+    channel_limiter, message_limiter = limiters
+    broadcast_runner.limiter = message_limiter
+    if update_recorder:
+        # One capture file per worker, e.g. worker1-updates.jsonl.gz
+        directory, name = os.path.split(RECORD_UPDATES_PATH)
+        update_recorder.start(os.path.join(directory, f"worker{index}-{name}"))
+    try:
+        asyncio.run(worker_main(index, update_queue))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if update_recorder:
+            update_recorder.close()
+        log_listener.stop()
+
+def run_sharded():
+    """Poll in this process and route each update by user to one of the worker processes"""
+    logger.warning("Multi-process mode (WORKERS=%d) is experimental and has measured slower than a single process", WORKERS)
+    asyncio.run(db.init_db())
+    
+    # Workers are forked before any event loop or HTTP session exists in this process
+    context = multiprocessing.get_context('fork')
+    queues = [context.Queue() for _ in range(WORKERS + 1)]
+    limiters = (
+        SharedRateLimiter(CHANNEL_POSTS_PER_MINUTE, per=60),
+        SharedRateLimiter(MESSAGES_PER_SECOND, burst=MESSAGES_PER_SECOND)
+    )
+    processes = [
+        context.Process(target=run_worker, args=(index, queue, limiters), name=f"worker-{index}")
+        for index, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+    
+    admin_ids = {SUPER_ADMIN_ID, SUPPORT_ADMIN_ID}
+    try:
+        asyncio.run(run_ingress(
+            bot, queues,
+            lambda update: route_update(update, WORKERS, admin_ids),
+            allowed_updates=dp.resolve_used_update_types()
+        ))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Let workers finish the updates they already received
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join()
+        log_listener.stop()
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    if WORKERS:
+        run_sharded()
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,186 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+class Histogram:
+    """Cumulative histogram with one series per label value"""
+    
+    def __init__(self, name: str, help_text: str, label: Optional[str] = None,
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        # label value -> [bucket counts..., +Inf count], sum
+        self.series: Dict[str, List[int]] = {}
+        self.sums: Dict[str, float] = {}
+    
+    def observe(self, value: float, label_value: str = ''):
+        counts = self.series.get(label_value)
+        if counts is None:
+            counts = self.series[label_value] = [0] * (len(self.buckets) + 1)
+            self.sums[label_value] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[label_value] += value
+    
+    def count(self, label_value: str = '') -> int:
+        return sum(self.series.get(label_value, ()))
+    
+    def quantile(self, q: float, label_value: str = '') -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls into"""
+        counts = self.series.get(label_value)
+        if not counts:
+            return 0.0
+        rank = q * sum(counts)
+        seen = 0
+        for i, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+    
+    def stats(self) -> List[Dict]:
+        """Per-label count, mean and p95, slowest total time first"""
+        rows = []
+        for label_value, counts in self.series.items():
+            total = sum(counts)
+            rows.append({
+                'label': label_value,
+                'count': total,
+                'total': self.sums[label_value],
+                'avg': self.sums[label_value] / total if total else 0.0,
+                'p95': self.quantile(0.95, label_value)
+            })
+        return sorted(rows, key=lambda row: row['total'], reverse=True)
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value, counts in sorted(self.series.items()):
+            labels = f'{self.label}="{label_value}",' if self.label else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels}le="{le}"}} {cumulative}')
+            selector = f'{{{labels.rstrip(",")}}}' if labels else ''
+            lines.append(f"{self.name}_sum{selector} {self.sums[label_value]}")
+            lines.append(f"{self.name}_count{selector} {cumulative}")
+        return lines
+
+class Counter:
+    """Monotonic counter with one series per label value"""
+    
+    def __init__(self, name: str, help_text: str, label: Optional[str] = None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.values: Dict[str, float] = {}
+    
+    def inc(self, label_value: str = '', amount: float = 1):
+        self.values[label_value] = self.values.get(label_value, 0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_value, value in sorted(self.values.items()):
+            selector = f'{{{self.label}="{label_value}"}}' if self.label else ''
+            lines.append(f"{self.name}{selector} {value}")
+        return lines
+
+class Gauge:
+    """Value that can go up and down"""
+    
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0.0
+    
+    def set(self, value: float):
+        self.value = value
+    
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+
+handler_seconds = Histogram('bot_handler_seconds', 'Time spent in update handlers', 'handler')
+handler_errors = Counter('bot_handler_errors_total', 'Handlers that raised an exception', 'handler')
+db_method_seconds = Histogram('bot_db_method_seconds', 'Time spent in Database methods', 'method')
+db_statements_per_update = Histogram('bot_db_statements_per_update', 'SQL statements executed per update',
+                                     buckets=COUNT_BUCKETS)
+api_call_seconds = Histogram('bot_api_call_seconds', 'Time spent in Bot API calls', 'method')
+api_call_errors = Counter('bot_api_call_errors_total', 'Bot API calls that raised an exception', 'method')
+
+loop_lag_seconds = Gauge('bot_event_loop_lag_seconds', 'Most recent event loop scheduling delay')
+handlers_in_flight = Gauge('bot_handlers_in_flight', 'Handlers currently running')
+shed_handlers = Counter('bot_shed_handlers_total', 'Low-priority handlers refused while overloaded', 'handler')
+
+draft_entries = Gauge('bot_draft_entries', 'In-flight ad drafts held in memory')
+draft_bytes = Gauge('bot_draft_bytes', 'Approximate memory held by in-flight ad drafts')
+fsm_entries = Gauge('bot_fsm_entries', 'FSM states held in storage')
+inline_cache_lookups = Counter('bot_inline_cache_lookups_total', 'Inline searches answered from the result cache (hit) or the database (miss)', 'result')
+evicted_entries = Counter('bot_evicted_entries_total', 'Drafts and FSM states dropped by TTL or size cap', 'store')
+price_alert_notifications = Counter('bot_price_alert_notifications_total', 'Price alert notifications by result', 'result')
+ad_lifecycle_events = Counter('bot_ad_lifecycle_events_total', 'Availability reminders sent, ads expired and ads bumped', 'event')
+ad_timers_loaded = Gauge('bot_ad_timers_loaded', 'Ad lifecycle timers held in the timing wheel')
+
+REGISTRY = [handler_seconds, handler_errors, db_method_seconds, db_statements_per_update,
+            api_call_seconds, api_call_errors, loop_lag_seconds, handlers_in_flight, shed_handlers,
+            draft_entries, draft_bytes, fsm_entries, evicted_entries, inline_cache_lookups, price_alert_notifications,
+            ad_lifecycle_events, ad_timers_loaded]
+
+class UpdateStats:
+    """Per-update counters, bound to the task handling the update through a context variable"""
+    
+    def __init__(self):
+        self.statements = 0
+    
+    def count_statement(self, statement: str):
+        # Called from the aiosqlite worker thread; a lost increment under contention only skews a metric
+        self.statements += 1
+
+update_stats: contextvars.ContextVar[Optional[UpdateStats]] = contextvars.ContextVar('update_stats', default=None)
+
+def instrument_methods(histogram: Histogram):
+    """Class decorator timing every public coroutine method into the given histogram"""
+    def decorator(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_') or not inspect.iscoroutinefunction(method):
+                continue
+            
+            def wrap(method, name=name):
+                @functools.wraps(method)
+                async def timed(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await method(*args, **kwargs)
+                    finally:
+                        histogram.observe(time.perf_counter() - start, name)
+                return timed
+            
+            setattr(cls, name, wrap(method))
+        return cls
+    return decorator
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+async def start_metrics_server(port: int, host: str = '0.0.0.0') -> web.AppRunner:
+    """Serve the metrics in Prometheus text format on /metrics"""
+    async def handle(request):
+        return web.Response(text=render_metrics(), content_type='text/plain', charset='utf-8')
+    
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,195 @@
+"""
+Dispatcher and session middlewares.
+
+    python middlewares.py 10000    # per-user serialization with 10k active users: ordering, leftover locks, cost
+"""
+import asyncio
+import random
+import sys
+import time
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.dispatcher.flags import get_flag
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods.base import TelegramMethod
+from aiogram.types import CallbackQuery, InlineQuery, Message, TelegramObject
+
+import metrics
+from logging_config import bind_log_context, log_context
+from load_guard import LoadGuard
+from recording import UpdateRecorder
+from translations import get_text, TRANSLATIONS
+
+class UpdateRecorderMiddleware(BaseMiddleware):
+    """
+    Outer update middleware capturing incoming updates for replay; anonymising and writing happen off the loop.
+    Register it after UserSerialMiddleware so the sender's FSM state is read after their earlier updates finished.
+    """
+    
+    def __init__(self, recorder: UpdateRecorder):
+        self.recorder = recorder
+    
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        state = data.get('state')
+        raw_state = await state.get_state() if state else None
+        self.recorder.record(event.model_dump(mode='json', exclude_none=True, by_alias=True), raw_state)
+        return await handler(event, data)
+
+class UserSerialMiddleware(BaseMiddleware):
+    """
+    Outer update middleware running each user's updates one at a time, in arrival order,
+    while updates from different users run concurrently.
+    A user's lock lives only while that user has updates running or waiting.
+    Checkout queries must be answered within 10 seconds and inline queries are read-only,
+    so neither waits behind the user's other updates.
+    """
+    
+    UNSERIALIZED = {'pre_checkout_query', 'inline_query'}
+    
+    def __init__(self):
+        # user_id -> [lock, number of updates holding or waiting for it]
+        self.locks: Dict[int, List] = {}
+    
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get('event_from_user')
+        if not user or event.event_type in self.UNSERIALIZED:
+            return await handler(event, data)
+        
+        entry = self.locks.get(user.id)
+        if entry is None:
+            entry = self.locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock wakes waiters in FIFO order, which keeps the user's updates in sequence
+            async with entry[0]:
+                return await handler(event, data)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[user.id]
+
+class UpdateStatsMiddleware(BaseMiddleware):
+    """Outer update middleware counting the SQL statements each update executes"""
+    
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        stats = metrics.UpdateStats()
+        token = metrics.update_stats.set(stats)
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.update_stats.reset(token)
+            metrics.db_statements_per_update.observe(stats.statements)
+
+class LogContextMiddleware(BaseMiddleware):
+    """Outer update middleware adding the update and user IDs to every log record of the update"""
+    
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get('event_from_user')
+        token = bind_log_context(update_id=getattr(event, 'update_id', None), user_id=user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            log_context.reset(token)
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Inner middleware timing the handler that matched the event and naming it in the log context"""
+    
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object else 'unknown'
+        token = bind_log_context(handler=name)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.handler_errors.inc(name)
+            raise
+        finally:
+            metrics.handler_seconds.observe(time.perf_counter() - start, name)
+            log_context.reset(token)
+
+class LoadSheddingMiddleware(BaseMiddleware):
+    """Inner middleware counting running handlers and refusing low_priority ones while overloaded"""
+    
+    def __init__(self, guard: LoadGuard):
+        self.guard = guard
+    
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if self.guard.overloaded and get_flag(data, 'low_priority'):
+            metrics.shed_handlers.inc(data['handler'].callback.__name__)
+            # Use the Telegram client language; the stored preference would cost a query while overloaded
+            user = data.get('event_from_user')
+            language = user.language_code if user and user.language_code in TRANSLATIONS['server_busy'] else 'fa'
+            text = get_text('server_busy', language)
+            if isinstance(event, CallbackQuery):
+                await event.answer(text, show_alert=True)
+            elif isinstance(event, Message):
+                await event.answer(text)
+            elif isinstance(event, InlineQuery):
+                # No results rather than letting the query time out; not cached, so a retry can succeed
+                await event.answer([], cache_time=0)
+            return None
+        
+        self.guard.enter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.guard.exit()
+
+class RequestTimingMiddleware(BaseRequestMiddleware):
+    """Session middleware timing every Bot API call by method"""
+    
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            metrics.api_call_errors.inc(name)
+            raise
+        finally:
+            metrics.api_call_seconds.observe(time.perf_counter() - start, name)
+
+async def _benchmark_serial(users: int, updates: int, serialize: bool) -> tuple:
+    """Seconds to handle the updates and how many ran before an earlier update of the same user finished"""
+    rng = random.Random(1)
+    middleware = UserSerialMiddleware()
+    finished: Dict[int, int] = {}
+    out_of_order = 0
+    
+    async def handler(event, data):
+        nonlocal out_of_order
+        await asyncio.sleep(rng.uniform(0, 0.005))
+        user_id = data['event_from_user'].id
+        if finished.get(user_id, -1) > event.sequence:
+            out_of_order += 1
+        finished[user_id] = max(finished.get(user_id, -1), event.sequence)
+    
+    senders = [SimpleNamespace(id=user_id) for user_id in range(1, users + 1)]
+    began = time.perf_counter()
+    tasks = []
+    for sequence in range(updates):
+        # Updates are handled as tasks in arrival order, as polling does
+        event = SimpleNamespace(event_type='message', sequence=sequence)
+        data = {'event_from_user': rng.choice(senders)}
+        tasks.append(asyncio.create_task(middleware(handler, event, data) if serialize else handler(event, data)))
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - began, out_of_order, len(middleware.locks)
+
+def benchmark(users: int, updates: int = 50000) -> str:
+    """Handle updates from users with 0-5ms handlers, with and without per-user serialization"""
+    serial, serial_disorder, leftover = asyncio.run(_benchmark_serial(users, updates, True))
+    unordered, disorder, _ = asyncio.run(_benchmark_serial(users, updates, False))
+    return (f"{updates} updates from {users} users: serialized {serial:.2f}s, {serial_disorder} out of order, "
+            f"{leftover} locks left; unserialized {unordered:.2f}s, {disorder} out of order")
+
+if __name__ == '__main__':
+    print(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000))
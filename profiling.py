@@ -0,0 +1,104 @@
+import asyncio
+import os
+import selectors
+import signal
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable, Dict, List, Tuple
+
+# Event loop internals are left out of the stacks so the report shows bot code
+SKIPPED_PATHS = (os.path.dirname(asyncio.__file__), os.path.dirname(selectors.__file__) + os.sep + 'selectors.py')
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """
+    Sample the stack of the event loop thread on a CPU-time timer (SIGPROF).
+    The handler runs between bytecodes of the loop thread, so samples land in the coroutine actually
+    executing, with its awaiting callers above it; time spent waiting for I/O produces no samples.
+    """
+    
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+    
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            if not frame.f_code.co_filename.startswith(SKIPPED_PATHS):
+                stack.append(frame_label(frame))
+            frame = frame.f_back
+        self.samples += 1
+        self.stacks[tuple(reversed(stack)) or ('<event loop>',)] += 1
+    
+    async def run(self, seconds: float):
+        """Profile for the given window; must be awaited on the main thread, where signal handlers run"""
+        previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, previous)
+    
+    def top(self, limit: int = 15) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+        """Functions by samples on top of the stack (self) and anywhere in the stack (total)"""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        return own.most_common(limit), total.most_common(limit)
+    
+    def collapsed(self) -> str:
+        """Stacks in collapsed format ("outer;inner count"), readable by flamegraph tools"""
+        return '\n'.join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()) + '\n'
+
+async def profile_cpu(seconds: float, limit: int = 15) -> Tuple[str, str]:
+    """Profile the running loop and return a summary message and a detailed report"""
+    profiler = SamplingProfiler()
+    await profiler.run(seconds)
+    own, total = profiler.top(limit)
+    samples = max(profiler.samples, 1)
+    
+    cpu = profiler.samples * profiler.interval
+    summary = f"⏱ {seconds:g}s | {profiler.samples} samples | CPU {cpu:.2f}s ({cpu * 100 / seconds:.0f}%)\n\n"
+    summary += "🔥 self:\n"
+    summary += ''.join(f"{count * 100 / samples:5.1f}% {label}\n" for label, count in own)
+    summary += "\n📚 total:\n"
+    summary += ''.join(f"{count * 100 / samples:5.1f}% {label}\n" for label, count in total)
+    return summary, summary + "\n# collapsed stacks\n" + profiler.collapsed()
+
+async def profile_memory(seconds: float, sizes: Dict[str, Callable[[], int]], limit: int = 15) -> Tuple[str, str]:
+    """Diff tracemalloc snapshots taken at the start and end of the window, plus the sizes of named structures"""
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(10)
+    before_sizes = {name: size() for name, size in sizes.items()}
+    before = tracemalloc.take_snapshot()
+    start = time.monotonic()
+    try:
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+    after_sizes = {name: size() for name, size in sizes.items()}
+    
+    stats = after.compare_to(before, 'lineno')
+    growth = sum(stat.size_diff for stat in stats)
+    summary = f"🧠 {time.monotonic() - start:.0f}s | traced growth {growth / 1024:+.1f} KiB\n\n"
+    summary += "📦 structures:\n"
+    summary += ''.join(f"{name}: {before_sizes[name]} → {after_sizes[name]}\n" for name in sizes)
+    summary += "\n📈 top growth:\n"
+    summary += ''.join(
+        f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d}) {os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}\n"
+        for stat in stats[:limit]
+    )
+    report = summary + "\n# all differences\n" + '\n'.join(str(stat) for stat in stats if stat.size_diff) + '\n'
+    return summary, report
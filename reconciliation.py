@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from typing import Any, Dict, List
+
+from aiogram import Bot
+from aiogram.methods import GetStarTransactions
+from aiogram.types import StarTransaction, TransactionPartnerUser
+
+from database import Database
+from retry import call_with_retry
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_KEY = 'star_transactions_offset'
+
+def transaction_row(transaction: StarTransaction) -> Dict[str, Any]:
+    """Flatten a Star transaction; incoming payments have a source, outgoing refunds a receiver"""
+    direction = 'in' if transaction.source else 'out'
+    partner = transaction.source or transaction.receiver
+    user_id = partner.user.id if isinstance(partner, TransactionPartnerUser) else None
+    return {
+        'id': transaction.id,
+        'direction': direction,
+        'user_id': user_id,
+        'amount': transaction.amount,
+        'date': transaction.date.isoformat() if transaction.date else None
+    }
+
+def find_discrepancies(rows: List[Dict[str, Any]], ads: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Compare one page of transactions with the ads that share their charge IDs"""
+    discrepancies = []
+    
+    def add(row, ad, kind, details):
+        discrepancies.append({
+            'transaction_id': row['id'],
+            'ad_id': ad['id'] if ad else None,
+            'kind': kind,
+            'details': details
+        })
+    
+    for row in rows:
+        ad = ads.get(row['id'])
+        if row['direction'] == 'in':
+            if not ad:
+                add(row, None, 'unknown_charge', f"{row['amount']} stars from user {row['user_id']} with no ad")
+                continue
+            if ad['payment_status'] != 'paid':
+                add(row, ad, 'unpaid_charge', f"ad payment_status is {ad['payment_status']}")
+            if ad['stars_paid'] != row['amount']:
+                add(row, ad, 'amount_mismatch', f"ad has {ad['stars_paid']} stars, Telegram has {row['amount']}")
+        elif row['user_id'] is not None:
+            # Outgoing transactions to users are refunds of the charge with the same ID
+            if not ad:
+                add(row, None, 'unknown_refund', f"{row['amount']} stars to user {row['user_id']} with no ad")
+            elif ad['refund_status'] != 'refunded':
+                add(row, ad, 'refund_not_recorded', "Telegram refunded the charge but the ad isn't marked refunded")
+    
+    return discrepancies
+
+async def reconcile_star_transactions(bot: Bot, db: Database, page_size: int = 100) -> Dict[str, int]:
+    """Process Star transactions added since the stored watermark and record discrepancies"""
+    offset = int(await db.get_job_state(WATERMARK_KEY, '0'))
+    summary = {'transactions': 0, 'discrepancies': 0}
+    
+    while True:
+        result = await call_with_retry(bot, GetStarTransactions(offset=offset, limit=page_size))
+        if not result.transactions:
+            break
+        
+        rows = [transaction_row(transaction) for transaction in result.transactions]
+        ads = await db.get_ads_by_charge_ids(list({row['id'] for row in rows}))
+        discrepancies = find_discrepancies(rows, ads)
+        
+        offset += len(rows)
+        await db.save_star_transactions_page(rows, discrepancies, WATERMARK_KEY, offset)
+        summary['transactions'] += len(rows)
+        summary['discrepancies'] += len(discrepancies)
+        
+        if len(result.transactions) < page_size:
+            break
+    
+    summary['discrepancies'] += await db.record_missing_refunds()
+    return summary
+
+async def reconciliation_worker(bot: Bot, db: Database, interval: int):
+    """Run the reconciliation job periodically"""
+    while True:
+        try:
+            summary = await reconcile_star_transactions(bot, db)
+            if summary['transactions'] or summary['discrepancies']:
+                logger.info("Star reconciliation processed %s transactions, found %s discrepancies",
+                            summary['transactions'], summary['discrepancies'])
+        except Exception as e:
+            logger.error("Error reconciling Star transactions: %s", e)
+        await asyncio.sleep(interval)
@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+import hmac
+import json
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+# Keys whose integer values identify a user or chat
+ID_KEYS = {'user_id', 'chat_id'}
+ID_OBJECTS = {'from', 'from_user', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat', 'via_bot'}
+# Personal fields dropped from users and chats; first_name is required by the User type, so it is replaced
+PERSONAL_KEYS = {'last_name', 'username', 'title', 'phone_number', 'bio'}
+CHARGE_KEYS = {'telegram_payment_charge_id', 'provider_payment_charge_id'}
+# Callback data prefixes followed by a user ID
+USER_ID_CALLBACKS = ('user_info_',)
+
+class Anonymizer:
+    """
+    Replace user/chat IDs with stable pseudonyms and drop names.
+    The admin IDs map to 1 and 2 so a replay can run with SUPER_ADMIN_ID=1 and SUPPORT_ADMIN_ID=2.
+    Message text sent in one of scrubbed_states (support messages, typed user IDs) is replaced as well.
+    """
+    
+    def __init__(self, salt: bytes, super_admin_id: int, support_admin_id: int, scrubbed_states: Iterable[str] = ()):
+        self.salt = salt
+        self.fixed = {super_admin_id: 1, support_admin_id: 2}
+        self.scrubbed_states = set(scrubbed_states)
+    
+    def _digest(self, value: Any) -> int:
+        return int.from_bytes(hmac.new(self.salt, str(value).encode(), hashlib.sha256).digest()[:8], 'big')
+    
+    def pseudonym(self, value: int) -> int:
+        if value in self.fixed:
+            return self.fixed[value]
+        # Keep the sign so group and channel IDs stay negative
+        pseudonym = 1_000_000_000 + self._digest(value) % 1_000_000_000
+        return -pseudonym if value < 0 else pseudonym
+    
+    def anonymize(self, value: Any, key: Optional[str] = None, in_id_object: bool = False) -> Any:
+        if isinstance(value, dict):
+            result = {}
+            for child_key, child in value.items():
+                if child_key in PERSONAL_KEYS:
+                    continue
+                if child_key == 'first_name':
+                    result[child_key] = 'User'
+                    continue
+                result[child_key] = self.anonymize(child, child_key, key in ID_OBJECTS)
+            return result
+        if isinstance(value, list):
+            return [self.anonymize(item, key, in_id_object) for item in value]
+        if isinstance(value, int) and not isinstance(value, bool) and (key in ID_KEYS or (key == 'id' and in_id_object)):
+            return self.pseudonym(value)
+        if key in CHARGE_KEYS and isinstance(value, str):
+            return f"anon_{self._digest(value):x}"
+        if key == 'data' and isinstance(value, str):
+            for prefix in USER_ID_CALLBACKS:
+                if value.startswith(prefix) and value[len(prefix):].isdigit():
+                    return f"{prefix}{self.pseudonym(int(value[len(prefix):]))}"
+        return value
+    
+    def scrub_text(self, text: str) -> str:
+        """A typed ID becomes its pseudonym so lookups still match on replay; other text becomes a digest"""
+        stripped = text.strip()
+        if stripped.isdigit():
+            return str(self.pseudonym(int(stripped)))
+        return f"anon_{self._digest(stripped):x}"
+    
+    def anonymize_update(self, update: Dict[str, Any], state: Optional[str] = None) -> Dict[str, Any]:
+        update = self.anonymize(update)
+        message = update.get('message')
+        if message and state in self.scrubbed_states:
+            for key in ('text', 'caption'):
+                if key in message:
+                    message[key] = self.scrub_text(message[key])
+            # Entity offsets point into the original text
+            message.pop('entities', None)
+            message.pop('caption_entities', None)
+        return update
+
+class UpdateRecorder:
+    """Append anonymised updates as JSON lines (gzip when the path ends in .gz) from a writer thread"""
+    
+    def __init__(self, path: str, anonymizer: Anonymizer):
+        self.path = path
+        self.anonymizer = anonymizer
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self, path: Optional[str] = None):
+        """Start the writer thread; call it in the process that handles updates, since threads don't survive fork"""
+        if path:
+            self.path = path
+        self._thread = threading.Thread(target=self._write, name='update-recorder', daemon=True)
+        self._thread.start()
+    
+    def record(self, update: Dict[str, Any], state: Optional[str] = None):
+        """state is the sender's FSM state when the update is handled"""
+        self._queue.put({'ts': round(time.time(), 3), 'update': update, 'state': state})
+    
+    def _write(self):
+        opener = gzip.open if self.path.endswith('.gz') else open
+        # Every record is flushed so a crash loses at most the line being written
+        with opener(self.path, 'at', encoding='utf-8') as output:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    return
+                entry['update'] = self.anonymizer.anonymize_update(entry['update'], entry.pop('state'))
+                output.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+                output.flush()
+    
+    def close(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
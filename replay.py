@@ -0,0 +1,144 @@
+"""
+Replay captured updates (RECORD_UPDATES_PATH) against a fresh database and a local fake Bot API,
+and compare the Bot API calls made by two code versions.
+
+    python replay.py run updates.jsonl.gz --api-url http://localhost:8081 --output calls-new.jsonl --speed 10
+    python replay.py compare calls-old.jsonl calls-new.jsonl
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+def read_lines(path: str) -> List[Dict[str, Any]]:
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as source:
+        return [json.loads(line) for line in source if line.strip()]
+
+async def replay(args) -> int:
+    if os.path.exists(args.database):
+        if not args.overwrite_database:
+            print(f"{args.database} exists; pass --overwrite-database to delete it and start from a fresh database", file=sys.stderr)
+            return 2
+        os.remove(args.database)
+    # main.py reads its configuration at import time
+    os.environ.update({
+        'DATABASE_PATH': args.database,
+        'BOT_API_URL': args.api_url,
+        'SUPER_ADMIN_ID': '1',
+        'SUPPORT_ADMIN_ID': '2',
+        'RECORD_UPDATES_PATH': '',
+        'RECONCILE_INTERVAL_SECONDS': '0',
+        'WORKERS': '0'
+    })
+    os.environ.setdefault('BOT_TOKEN', '123456:replay')
+    
+    import main
+    from aiogram.types import Update
+    from logging_config import log_context
+    
+    calls = []
+    
+    class CallRecorder:
+        """Session middleware recording every Bot API call with the update that caused it"""
+        
+        async def __call__(self, make_request, bot, method):
+            calls.append({
+                'update_id': log_context.get().get('update_id'),
+                'method': type(method).__name__,
+                'params': {
+                    key: value for key, value in method.model_dump(mode='json', exclude_none=True, fallback=str).items()
+                    if not isinstance(value, str) or not value.startswith('Default(')
+                }
+            })
+            return await make_request(bot, method)
+    
+    main.bot.session.middleware(CallRecorder())
+    await main.db.init_db()
+    
+    entries = read_lines(args.capture)
+    latencies = []
+    errors = 0
+    
+    async def feed(update: Update):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            await main.dp.feed_update(main.bot, update)
+        except Exception as e:
+            errors += 1
+            print(f"update {update.update_id} failed: {e}", file=sys.stderr)
+        latencies.append(time.perf_counter() - start)
+    
+    tasks = []
+    started = time.perf_counter()
+    first_ts = entries[0]['ts'] if entries else 0
+    for entry in entries:
+        if args.speed > 0:
+            delay = (entry['ts'] - first_ts) / args.speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        update = Update.model_validate(entry['update'], context={'bot': main.bot})
+        tasks.append(asyncio.create_task(feed(update)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await main.bot.session.close()
+    main.log_listener.stop()
+    
+    with open(args.output, 'w', encoding='utf-8') as output:
+        for call in calls:
+            output.write(json.dumps(call, ensure_ascii=False, sort_keys=True) + '\n')
+    
+    latencies.sort()
+    if latencies:
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000
+        print(f"{len(entries)} updates in {elapsed:.2f}s ({len(entries) / elapsed:.0f}/s), "
+              f"p50 {p50:.1f}ms, p95 {p95:.1f}ms, {errors} errors, {len(calls)} API calls")
+    return 1 if errors else 0
+
+def compare(args) -> int:
+    """Compare the API calls per update; calls of one update keep their order, updates may interleave"""
+    def grouped(path):
+        groups = defaultdict(list)
+        for call in read_lines(path):
+            groups[call['update_id']].append((call['method'], call['params']))
+        return groups
+    
+    old, new = grouped(args.old), grouped(args.new)
+    differing = [update_id for update_id in sorted(set(old) | set(new), key=str) if old.get(update_id) != new.get(update_id)]
+    for update_id in differing[:args.show]:
+        print(f"update {update_id}:")
+        print(f"  old: {json.dumps(old.get(update_id), ensure_ascii=False)}")
+        print(f"  new: {json.dumps(new.get(update_id), ensure_ascii=False)}")
+    print(f"{len(differing)} of {len(set(old) | set(new))} updates differ")
+    return 1 if differing else 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    run = commands.add_parser('run', help='replay a capture file')
+    run.add_argument('capture')
+    run.add_argument('--api-url', required=True, help='base URL of the fake Bot API')
+    run.add_argument('--database', default='replay.db', help='must not exist unless --overwrite-database is given')
+    run.add_argument('--overwrite-database', action='store_true', help='delete an existing --database first')
+    run.add_argument('--output', default='replay-calls.jsonl')
+    run.add_argument('--speed', type=float, default=0, help='1 = original timing, 10 = ten times faster, 0 = no delays')
+    
+    diff = commands.add_parser('compare', help='compare the API calls of two runs')
+    diff.add_argument('old')
+    diff.add_argument('new')
+    diff.add_argument('--show', type=int, default=10, help='differences to print')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == 'run':
+        sys.exit(asyncio.run(replay(args)))
+    sys.exit(compare(args))
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import logging
+import random
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiogram.methods
+import pydantic_core
+from aiogram import Bot
+from aiogram.client.default import Default
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+)
+from aiogram.methods.base import TelegramMethod
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Error classes
+RATE_LIMITED = 'rate_limited'
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+NOT_MODIFIED = 'not_modified'
+
+def classify_error(error: Exception) -> str:
+    """Classify a failed Bot API call so the caller knows whether to retry it"""
+    if isinstance(error, TelegramRetryAfter):
+        return RATE_LIMITED
+    if isinstance(error, (TelegramServerError, TelegramNetworkError, asyncio.TimeoutError, ConnectionError)):
+        return TRANSIENT
+    if isinstance(error, TelegramBadRequest) and 'message is not modified' in str(error):
+        # Editing a message to its current content is not a failure
+        return NOT_MODIFIED
+    return PERMANENT
+
+def _without_bot_defaults(value: Any) -> Any:
+    """Drop unresolved bot defaults (parse_mode etc.) so they resolve again when the call is replayed"""
+    if isinstance(value, dict):
+        return {key: _without_bot_defaults(item) for key, item in value.items() if not isinstance(item, Default)}
+    if isinstance(value, list):
+        return [_without_bot_defaults(item) for item in value]
+    return value
+
+def serialize_method(method: TelegramMethod) -> str:
+    """
+    JSON payload of a Bot API call for the dead-letter table. Fields that equal their default are kept
+    (only None is dropped), so discriminators like the 'type' of InputMedia items survive.
+    """
+    return pydantic_core.to_json(_without_bot_defaults(method.model_dump(exclude_none=True))).decode()
+
+def deserialize_method(method_name: str, payload: str) -> TelegramMethod:
+    """Rebuild a dead-lettered call, refusing payloads that don't validate back to the same call"""
+    method = getattr(aiogram.methods, method_name).model_validate_json(payload)
+    if json.loads(serialize_method(method)) != json.loads(payload):
+        raise ValueError(f"{method_name} payload does not round-trip")
+    return method
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+async def call_with_retry(bot: Bot, method: TelegramMethod, db: Optional[Database] = None,
+                          context: Optional[Dict[str, Any]] = None, max_attempts: int = 5,
+                          base_delay: float = 1.0, max_delay: float = 60.0) -> Any:
+    """
+    Call a Bot API method, retrying rate-limited and transient failures.
+    Calls that still fail are stored in the dead-letter table (when db is given) and the error is re-raised.
+    """
+    for attempt in range(max_attempts):
+        try:
+            return await bot(method)
+        except Exception as e:
+            kind = classify_error(e)
+            if kind == NOT_MODIFIED:
+                return None
+            
+            if kind != PERMANENT and attempt < max_attempts - 1:
+                if kind == RATE_LIMITED:
+                    delay = e.retry_after + random.uniform(0, 1)
+                else:
+                    delay = backoff_delay(attempt, base_delay, max_delay)
+                logger.warning("%s failed (%s), retrying in %.1fs: %s", type(method).__name__, kind, delay, e)
+                await asyncio.sleep(delay)
+                continue
+            
+            if db:
+                await db.add_dead_letter(
+                    type(method).__name__,
+                    serialize_method(method),
+                    str(e),
+                    kind,
+                    json.dumps(context) if context else None
+                )
+            raise
+
+async def replay_dead_letters(bot: Bot, db: Database,
+                              on_replayed: Optional[Dict[str, Callable[[Any, Dict[str, Any]], Awaitable[None]]]] = None,
+                              batch_size: int = 100) -> Dict[str, int]:
+    """
+    Replay every pending dead letter once.
+    on_replayed maps a context 'kind' to a callback run with the API result, e.g. to store a channel message ID.
+    """
+    summary = {'replayed': 0, 'failed': 0}
+    last_id = 0
+    while True:
+        entries: List[Dict[str, Any]] = await db.get_dead_letters(status='pending', limit=batch_size, after_id=last_id)
+        if not entries:
+            return summary
+        
+        for entry in entries:
+            last_id = entry['id']
+            context = json.loads(entry['context']) if entry['context'] else {}
+            try:
+                method = deserialize_method(entry['method'], entry['payload'])
+                result = await call_with_retry(bot, method, max_attempts=3)
+                if on_replayed and context.get('kind') in on_replayed:
+                    await on_replayed[context['kind']](result, context)
+                await db.update_dead_letter(entry['id'], 'replayed')
+                summary['replayed'] += 1
+            except Exception as e:
+                await db.update_dead_letter(entry['id'], 'pending', str(e))
+                summary['failed'] += 1
@@ -0,0 +1,138 @@
+"""
+Multi-process update handling: one ingress process routing updates by user to worker processes.
+
+    python sharding.py 4    # throughput with 0-4 workers, for I/O-bound and CPU-bound handlers
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from typing import Callable, Collection, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import Update
+
+from retry import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+# Worker 0 handles admins and updates without a user; users are spread over workers 1..N
+ADMIN_WORKER = 0
+
+def route_update(update: Update, workers: int, admin_ids: Collection[int]) -> int:
+    """Pick the worker for an update so that all updates of one user go to the same process"""
+    user = UserContextMiddleware.resolve_event_context(update).user
+    if not user or user.id in admin_ids:
+        return ADMIN_WORKER
+    return 1 + user.id % workers
+
+async def run_ingress(bot: Bot, queues: List, route: Callable[[Update], int],
+                      allowed_updates: Optional[List[str]] = None, timeout: int = 30):
+    """Long-poll getUpdates and hand every update, as JSON, to its worker's queue"""
+    offset = None
+    failures = 0
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates)
+            failures = 0
+        except Exception as e:
+            delay = backoff_delay(failures, 1.0, 30.0)
+            failures += 1
+            logger.error("Error polling updates, retrying in %.1fs: %s", delay, e)
+            await asyncio.sleep(delay)
+            continue
+        
+        for update in updates:
+            queues[route(update)].put(update.model_dump_json(exclude_unset=True))
+            offset = update.update_id + 1
+
+async def consume_updates(bot: Bot, dp: Dispatcher, update_queue):
+    """Feed updates from the ingress queue to the dispatcher until a None sentinel arrives"""
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    
+    async def process(update: Update):
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            logger.exception("Error processing update %s: %s", update.update_id, e)
+    
+    while True:
+        raw = await loop.run_in_executor(None, update_queue.get)
+        if raw is None:
+            break
+        task = asyncio.create_task(process(Update.model_validate_json(raw, context={'bot': bot})))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    
+    if tasks:
+        await asyncio.gather(*tasks)
+
+def _benchmark_dispatcher(cpu: float, io: float) -> Dispatcher:
+    """A dispatcher whose only handler spends cpu seconds computing and io seconds waiting"""
+    dp = Dispatcher()
+    
+    @dp.message()
+    async def handle(message):
+        deadline = time.perf_counter() + cpu
+        while time.perf_counter() < deadline:
+            pass
+        await asyncio.sleep(io)
+    
+    return dp
+
+def _benchmark_worker(update_queue, cpu: float, io: float):
+    asyncio.run(consume_updates(Bot('123456:benchmark'), _benchmark_dispatcher(cpu, io), update_queue))
+
+def _benchmark_run(updates: List[Update], workers: int, cpu: float, io: float) -> float:
+    """Seconds to handle every update in one process (workers=0) or routed to workers processes"""
+    began = time.perf_counter()
+    if not workers:
+        async def single():
+            bot, dp = Bot('123456:benchmark'), _benchmark_dispatcher(cpu, io)
+            # Polling handles each update as its own task, as here
+            await asyncio.gather(*(dp.feed_update(bot, update) for update in updates))
+        asyncio.run(single())
+        return time.perf_counter() - began
+    
+    context = multiprocessing.get_context('fork')
+    queues = [context.Queue() for _ in range(workers + 1)]
+    processes = [context.Process(target=_benchmark_worker, args=(queue, cpu, io)) for queue in queues]
+    for process in processes:
+        process.start()
+    # The same hand-off as run_ingress
+    for update in updates:
+        queues[route_update(update, workers, ())].put(update.model_dump_json(exclude_unset=True))
+    for queue in queues:
+        queue.put(None)
+    for process in processes:
+        process.join()
+    return time.perf_counter() - began
+
+def benchmark(max_workers: int, updates: int = 5000, users: int = 1000) -> str:
+    """
+    Compare one process with 1..max_workers worker processes, for handlers that mostly wait on I/O
+    (like the bot's) and for handlers that spend 1ms of CPU per update
+    """
+    batch = [
+        Update.model_validate({'update_id': i, 'message': {
+            'message_id': i, 'date': 0, 'text': 'x',
+            'chat': {'id': i % users + 1, 'type': 'private'},
+            'from': {'id': i % users + 1, 'is_bot': False, 'first_name': 'User'}
+        }})
+        for i in range(updates)
+    ]
+    lines = [f"{updates} updates from {users} users on {os.cpu_count()} CPUs"]
+    for label, cpu, io in (('I/O-bound (5ms wait)', 0, 0.005), ('CPU-bound (1ms CPU + 5ms wait)', 0.001, 0.005)):
+        results = []
+        for workers in [0] + [n for n in (1, 2, 4, 8, 16) if n <= max_workers]:
+            elapsed = _benchmark_run(batch, workers, cpu, io)
+            results.append(f"{workers} workers {updates / elapsed:.0f}/s")
+        lines.append(f"{label}: " + ', '.join(results))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    print(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 4))
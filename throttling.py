@@ -0,0 +1,64 @@
+import asyncio
+import multiprocessing
+import time
+
+class RateLimiter:
+    """Token bucket limiter shared by coroutines that call the Bot API"""
+    
+    def __init__(self, rate: float, per: float = 1.0, burst: int = 1):
+        self.interval = per / rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Wait until one more call is allowed"""
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) / self.interval)
+            self._updated = now
+            
+            if self._tokens < 1:
+                # Waiters queue on the lock, so calls start in FIFO order
+                await asyncio.sleep((1 - self._tokens) * self.interval)
+                self._tokens = 1.0
+                self._updated = time.monotonic()
+            
+            self._tokens -= 1
+    
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+class SharedRateLimiter:
+    """
+    Rate limiter shared by several processes (GCRA over shared memory).
+    Each call reserves the next free slot under a short process lock, then sleeps outside it.
+    """
+    
+    def __init__(self, rate: float, per: float = 1.0, burst: int = 1):
+        self.interval = per / rate
+        self.tolerance = (burst - 1) * self.interval
+        # Theoretical arrival time of the next call, on the system-wide monotonic clock
+        self._tat = multiprocessing.Value('d', 0.0)
+    
+    async def acquire(self):
+        """Wait until one more call is allowed"""
+        with self._tat.get_lock():
+            now = time.monotonic()
+            tat = max(self._tat.value, now)
+            self._tat.value = tat + self.interval
+        delay = tat - self.tolerance - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
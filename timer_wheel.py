@@ -0,0 +1,129 @@
+"""
+Hierarchical timing wheel for timers due in the near future.
+
+    python timer_wheel.py 1000000    # schedule, cancel and expiry throughput
+"""
+import math
+import random
+import sys
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+class TimerWheel:
+    """
+    Timers keyed by any hashable, due at a wall-clock time, with tick resolution.
+    Level 0 has one slot per tick; each slot of a higher level spans a full turn of the level below
+    and is redistributed downwards when that turn starts. Scheduling and cancelling are O(1) and
+    advancing costs O(1) per tick plus the timers that move or fire.
+    """
+    
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 4, start: float = None):
+        self.tick = tick
+        self.slots = slots
+        # levels[level][slot]: key -> due tick
+        self._levels: List[List[Dict[Hashable, int]]] = [[{} for _ in range(slots)] for _ in range(levels)]
+        # Timers already due at the next advance
+        self._ready: Dict[Hashable, int] = {}
+        # key -> (level, slot), or None for ready timers
+        self._where: Dict[Hashable, Optional[Tuple[int, int]]] = {}
+        self._now = math.floor((time.time() if start is None else start) / tick)
+    
+    def _insert(self, key: Hashable, due_tick: int):
+        delta = due_tick - self._now
+        if delta <= 0:
+            self._ready[key] = due_tick
+            self._where[key] = None
+            return
+        level = 0
+        while level < len(self._levels) - 1 and delta >= self.slots ** (level + 1):
+            level += 1
+        # Beyond the top level's range, park in its farthest slot and re-place on the cascade
+        if delta >= self.slots ** (level + 1):
+            slot = (self._now // self.slots ** level - 1) % self.slots
+        else:
+            slot = (due_tick // self.slots ** level) % self.slots
+        self._levels[level][slot][key] = due_tick
+        self._where[key] = (level, slot)
+    
+    def schedule(self, key: Hashable, due: float):
+        """Add a timer, or move it if the key is already scheduled"""
+        self.cancel(key)
+        self._insert(key, math.ceil(due / self.tick))
+    
+    def cancel(self, key: Hashable) -> bool:
+        if key not in self._where:
+            return False
+        where = self._where.pop(key)
+        if where is None:
+            del self._ready[key]
+        else:
+            del self._levels[where[0]][where[1]][key]
+        return True
+    
+    def advance(self, now: float = None) -> List[Hashable]:
+        """Move the wheel to now and return the keys of timers that became due, in due order"""
+        target = math.floor((time.time() if now is None else now) / self.tick)
+        fired = sorted(self._ready.items(), key=lambda item: item[1])
+        self._ready = {}
+        while self._now < target:
+            self._now += 1
+            # Cascade from the highest level whose turn starts now
+            for level in range(len(self._levels) - 1, 0, -1):
+                span = self.slots ** level
+                if self._now % span == 0:
+                    bucket = self._levels[level][(self._now // span) % self.slots]
+                    self._levels[level][(self._now // span) % self.slots] = {}
+                    for key, due_tick in bucket.items():
+                        self._insert(key, due_tick)
+            bucket = self._levels[0][self._now % self.slots]
+            self._levels[0][self._now % self.slots] = {}
+            fired.extend(sorted(self._ready.items(), key=lambda item: item[1]))
+            self._ready = {}
+            for key, due_tick in bucket.items():
+                # Only a single-level wheel parks timers here that are not due yet
+                if due_tick <= self._now:
+                    fired.append((key, due_tick))
+                else:
+                    self._insert(key, due_tick)
+        
+        for key, _ in fired:
+            del self._where[key]
+        return [key for key, _ in fired]
+    
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._where
+    
+    def __len__(self) -> int:
+        return len(self._where)
+
+def benchmark(timers: int, horizon: float = 3600):
+    """Schedule timers over the next horizon seconds, cancel a tenth of them and expire the rest"""
+    rng = random.Random(1)
+    start = 1_000_000.0
+    wheel = TimerWheel(start=start)
+    dues = [start + rng.uniform(0, horizon) for _ in range(timers)]
+    
+    began = time.perf_counter()
+    for key, due in enumerate(dues):
+        wheel.schedule(key, due)
+    scheduled = time.perf_counter() - began
+    
+    began = time.perf_counter()
+    for key in range(0, timers, 10):
+        wheel.cancel(key)
+    cancelled = time.perf_counter() - began
+    
+    began = time.perf_counter()
+    fired = 0
+    late = 0
+    for second in range(1, int(horizon) + 2):
+        keys = wheel.advance(start + second)
+        fired += len(keys)
+        late += sum(1 for key in keys if dues[key] < start + second - 1)
+    expired = time.perf_counter() - began
+    return (f"{timers} timers over {horizon:g}s: schedule {scheduled / timers * 1e6:.2f}us, "
+            f"cancel {cancelled / (timers // 10) * 1e6:.2f}us, expire {expired / max(fired, 1) * 1e6:.2f}us per timer; "
+            f"{fired} fired, {late} late, {len(wheel)} left")
+
+if __name__ == '__main__':
+    print(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000))
@@ -67,6 +67,11 @@ TRANSLATIONS = {
         "ru": "🌐 Изменить язык",
         "en": "🌐 Change Language"
     },
+    "browse_button": {
+        "fa": "🛍 مشاهده آگهی‌ها",
+        "ru": "🛍 Смотреть объявления",
+        "en": "🛍 Browse Ads"
+    },
     
     # Ad creation process
     "gift_link_request": {
@@ -94,6 +99,11 @@ TRANSLATIONS = {
         "ru": "❌ Введенная ссылка недействительна. Пожалуйста, отправьте правильную ссылку на подарок или телеграм канал.",
         "en": "❌ Invalid link entered. Please send a valid gift link or Telegram channel."
     },
+    "relist_blocked": {
+        "fa": "❌ این گیفت یا کانال در حال حاضر در کانال آگهی شده است و امکان ثبت دوباره آن وجود ندارد.",
+        "ru": "❌ Этот подарок или канал уже размещен в объявлениях, повторное размещение невозможно.",
+        "en": "❌ This gift or channel is already listed, so it can't be submitted again."
+    },
     "invalid_photo": {
         "fa": "❌ عکس ارسالی معتبر نیست. لطفاً یک عکس صحیح ارسال کنید یا 'بدون عکس' بنویسید.",
         "ru": "❌ Отправленное фото недействительно. Пожалуйста, отправьте правильное фото или напишите 'без фото'.",
@@ -124,6 +134,26 @@ TRANSLATIONS = {
         "ru": "❌ Ошибка платежа. Пожалуйста, попробуйте еще раз.",
         "en": "❌ Payment error. Please try again."
     },
+    "server_busy": {
+        "fa": "⏳ ربات در حال حاضر شلوغ است. لطفاً چند لحظه دیگر دوباره تلاش کنید.",
+        "ru": "⏳ Бот сейчас перегружен. Пожалуйста, повторите попытку через несколько секунд.",
+        "en": "⏳ The bot is busy right now. Please try again in a few moments."
+    },
+    "payment_refunded_no_draft": {
+        "fa": "❌ اطلاعات آگهی شما پیدا نشد، بنابراین استارز پرداختی بازگردانده شد. لطفاً آگهی را دوباره ثبت کنید.",
+        "ru": "❌ Данные вашего объявления не найдены, поэтому оплаченные звёзды возвращены. Пожалуйста, создайте объявление заново.",
+        "en": "❌ Your ad's details couldn't be found, so your Stars were refunded. Please create your ad again."
+    },
+    "payment_no_draft": {
+        "fa": "❌ اطلاعات آگهی شما پیدا نشد. پرداخت شما برای ادمین ارسال شد و به زودی بررسی می‌شود.",
+        "ru": "❌ Данные вашего объявления не найдены. Ваш платёж передан администратору и скоро будет проверен.",
+        "en": "❌ Your ad's details couldn't be found. Your payment was forwarded to the admin and will be reviewed soon."
+    },
+    "payment_draft_invalid": {
+        "fa": "❌ این فاکتور دیگر معتبر نیست. لطفاً آگهی را دوباره ثبت کنید.",
+        "ru": "❌ Этот счет больше не действителен. Пожалуйста, создайте объявление заново.",
+        "en": "❌ This invoice is no longer valid. Please create your ad again."
+    },
     "payment_message": {
         "fa": "💳 برای تایید آگهی، لطفاً مبلغ {amount} ستاره پرداخت کنید:",
         "ru": "💳 Для подтверждения объявления, пожалуйста, оплатите {amount} звезд:",
@@ -386,6 +416,11 @@ TRANSLATIONS = {
         "ru": "✅ Ручной возврат успешно выполнен.\n👤 Пользователь: {user_id}\n💰 Сумма: {amount} звезд",
         "en": "✅ Manual refund completed successfully.\n👤 User: {user_id}\n💰 Amount: {amount} stars"
     },
+    "manual_refund_amount_too_small": {
+        "fa": "❌ هر پرداخت فقط به صورت کامل ریفاند می‌شود. کوچک‌ترین پرداخت قابل ریفاند این کاربر {min_amount} استارز است.",
+        "ru": "❌ Каждый платеж возвращается только полностью. Наименьший платеж этого пользователя для возврата: {min_amount} звезд.",
+        "en": "❌ Each payment can only be refunded in full. This user's smallest refundable payment is {min_amount} stars."
+    },
     "manual_refund_failed": {
         "fa": "❌ خطا در انجام ریفاند دستی: {error}",
         "ru": "❌ Ошибка при выполнении ручного возврата: {error}",
@@ -529,6 +564,11 @@ TRANSLATIONS = {
         "ru": "🔴 Продано",
         "en": "🔴 Sold"
     },
+    "ad_status_expired": {
+        "fa": "⌛ منقضی شده",
+        "ru": "⌛ Истекло",
+        "en": "⌛ Expired"
+    },
     "mark_as_sold_button": {
         "fa": "🔴 علامت‌گذاری به عنوان فروش رفته",
         "ru": "🔴 Отметить как проданное",
@@ -553,6 +593,179 @@ TRANSLATIONS = {
         "fa": "وضعیت",
         "ru": "Статус",
         "en": "Status"
+    },
+    
+    # Ad catalog
+    "browse_title": {
+        "fa": "🛍 آگهی‌های موجود",
+        "ru": "🛍 Доступные объявления",
+        "en": "🛍 Available ads"
+    },
+    "browse_empty": {
+        "fa": "هیچ آگهی با این فیلترها پیدا نشد.",
+        "ru": "Объявлений с такими фильтрами не найдено.",
+        "en": "No ads match these filters."
+    },
+    "browse_all": {
+        "fa": "همه",
+        "ru": "Все",
+        "en": "All"
+    },
+    "browse_gifts": {
+        "fa": "🎁 گیفت",
+        "ru": "🎁 Подарки",
+        "en": "🎁 Gifts"
+    },
+    "browse_channels": {
+        "fa": "📺 کانال",
+        "ru": "📺 Каналы",
+        "en": "📺 Channels"
+    },
+    "browse_any_price": {
+        "fa": "💰 هر قیمتی",
+        "ru": "💰 Любая цена",
+        "en": "💰 Any price"
+    },
+    "previous_page_button": {
+        "fa": "◀️ قبلی",
+        "ru": "◀️ Назад",
+        "en": "◀️ Previous"
+    },
+    "next_page_button": {
+        "fa": "بعدی ▶️",
+        "ru": "Далее ▶️",
+        "en": "Next ▶️"
+    },
+    
+    # Price alerts
+    "alert_usage": {
+        "fa": "🔔 برای دریافت اطلاع‌رسانی وقتی گیفتی از یک کالکشن با قیمت مشخص یا کمتر آگهی شد:\n/alert <کالکشن یا لینک گیفت> <حداکثر قیمت به تون>\nمثال: /alert plushpepe 50\n\nمشاهده و حذف هشدارها: /alerts",
+        "ru": "🔔 Чтобы получить уведомление, когда подарок из коллекции будет выставлен по указанной цене или дешевле:\n/alert <коллекция или ссылка на подарок> <максимальная цена в TON>\nПример: /alert plushpepe 50\n\nПросмотр и удаление оповещений: /alerts",
+        "en": "🔔 To be notified when a gift from a collection is listed at or under a price:\n/alert <collection or gift link> <max price in TON>\nExample: /alert plushpepe 50\n\nView and delete alerts: /alerts"
+    },
+    "alert_saved": {
+        "fa": "✅ هشدار ثبت شد: {collection} با قیمت {max_price} تون یا کمتر.",
+        "ru": "✅ Оповещение сохранено: {collection} по цене до {max_price} TON.",
+        "en": "✅ Alert saved: {collection} at or under {max_price} TON."
+    },
+    "alert_limit": {
+        "fa": "❌ حداکثر {limit} هشدار می‌توانید داشته باشید. ابتدا یکی را از /alerts حذف کنید.",
+        "ru": "❌ Можно иметь не более {limit} оповещений. Сначала удалите одно в /alerts.",
+        "en": "❌ You can have at most {limit} alerts. Delete one in /alerts first."
+    },
+    "alerts_title": {
+        "fa": "🔔 هشدارهای قیمت شما:",
+        "ru": "🔔 Ваши ценовые оповещения:",
+        "en": "🔔 Your price alerts:"
+    },
+    "alerts_empty": {
+        "fa": "شما هیچ هشدار قیمتی ندارید. با /alert یک هشدار بسازید.",
+        "ru": "У вас нет ценовых оповещений. Создайте его командой /alert.",
+        "en": "You have no price alerts. Create one with /alert."
+    },
+    "alert_deleted": {
+        "fa": "🗑 هشدار حذف شد.",
+        "ru": "🗑 Оповещение удалено.",
+        "en": "🗑 Alert deleted."
+    },
+    "price_alert_match": {
+        "fa": "🔔 گیفت جدید از {collection} با قیمت {price} تون آگهی شد (هشدار شما: حداکثر {max_price} تون)\n\n🎁 {link}",
+        "ru": "🔔 Новый подарок из {collection} выставлен за {price} TON (ваше оповещение: до {max_price} TON)\n\n🎁 {link}",
+        "en": "🔔 A {collection} gift was just listed for {price} TON (your alert: up to {max_price} TON)\n\n🎁 {link}"
+    },
+    
+    # Market stats
+    "market_usage": {
+        "fa": "📈 آمار بازار یک کالکشن: /market <کالکشن یا لینک گیفت>\nمثال: /market plushpepe",
+        "ru": "📈 Статистика рынка коллекции: /market <коллекция или ссылка на подарок>\nПример: /market plushpepe",
+        "en": "📈 Market stats of a collection: /market <collection or gift link>\nExample: /market plushpepe"
+    },
+    "market_empty": {
+        "fa": "📈 در {days} روز گذشته آگهی یا فروشی برای {collection} ثبت نشده است.",
+        "ru": "📈 За последние {days} дн. для {collection} не было объявлений или продаж.",
+        "en": "📈 No {collection} listings or sales in the last {days} days."
+    },
+    "market_title": {
+        "fa": "📈 بازار {collection} در {days} روز گذشته",
+        "ru": "📈 Рынок {collection} за последние {days} дн.",
+        "en": "📈 {collection} market, last {days} days"
+    },
+    "market_totals": {
+        "fa": "📥 آگهی‌ها: {listed} | 🤝 فروش‌ها: {sold}",
+        "ru": "📥 Объявления: {listed} | 🤝 Продажи: {sold}",
+        "en": "📥 Listed: {listed} | 🤝 Sold: {sold}"
+    },
+    "market_listed_prices": {
+        "fa": "💰 قیمت آگهی‌ها (کمینه / میانه / بیشینه): {prices} TON",
+        "ru": "💰 Цены объявлений (мин / медиана / макс): {prices} TON",
+        "en": "💰 Listing prices (min / median / max): {prices} TON"
+    },
+    "market_sold_prices": {
+        "fa": "🤝 قیمت فروش‌ها (کمینه / میانه / بیشینه): {prices} TON",
+        "ru": "🤝 Цены продаж (мин / медиана / макс): {prices} TON",
+        "en": "🤝 Sale prices (min / median / max): {prices} TON"
+    },
+    
+    # Ad lifecycle: availability reminders, expiry and paid bumps
+    "ad_reminder": {
+        "fa": "⏰ آگهی شما هنوز موجود است؟\n\n🎁 {link}\n💰 {price} TON\n\nاگر تا {hours} ساعت دیگر تایید نکنید، آگهی در کانال منقضی می‌شود.",
+        "ru": "⏰ Ваше объявление ещё актуально?\n\n🎁 {link}\n💰 {price} TON\n\nЕсли не подтвердить его в течение {hours} ч., объявление в канале будет помечено как истёкшее.",
+        "en": "⏰ Is your ad still available?\n\n🎁 {link}\n💰 {price} TON\n\nIf you don't confirm within {hours} hours, the ad will be marked expired in the channel."
+    },
+    "confirm_available_button": {
+        "fa": "✅ هنوز موجود است",
+        "ru": "✅ Ещё доступно",
+        "en": "✅ Still available"
+    },
+    "ad_confirmed": {
+        "fa": "✅ ممنون! آگهی شما در کانال باقی می‌ماند.",
+        "ru": "✅ Спасибо! Ваше объявление остаётся в канале.",
+        "en": "✅ Thanks! Your ad stays listed."
+    },
+    "ad_expired_notice": {
+        "fa": "⌛ آگهی شما چون موجود بودن آن تایید نشد منقضی شد.\n\n🎁 {link}\n\nاگر هنوز موجود است، آن را دوباره فعال کنید.",
+        "ru": "⌛ Ваше объявление истекло, так как его актуальность не была подтверждена.\n\n🎁 {link}\n\nЕсли оно ещё актуально, отметьте его как доступное.",
+        "en": "⌛ Your ad expired because its availability wasn't confirmed.\n\n🎁 {link}\n\nIf it's still available, mark it available again."
+    },
+    "bump_button": {
+        "fa": "🚀 ارتقا ({stars} ⭐)",
+        "ru": "🚀 Поднять ({stars} ⭐)",
+        "en": "🚀 Bump ({stars} ⭐)"
+    },
+    "bump_title": {
+        "fa": "ارتقای آگهی",
+        "ru": "Поднятие объявления",
+        "en": "Ad bump"
+    },
+    "bump_description": {
+        "fa": "آگهی شما دوباره در بالای کانال منتشر می‌شود.",
+        "ru": "Ваше объявление будет заново опубликовано вверху канала.",
+        "en": "Your ad is posted again at the top of the channel."
+    },
+    "bump_label": {
+        "fa": "ارتقای آگهی",
+        "ru": "Поднятие объявления",
+        "en": "Ad bump"
+    },
+    "bump_unavailable": {
+        "fa": "❌ فقط آگهی‌های تایید شده و موجود قابل ارتقا هستند.",
+        "ru": "❌ Поднять можно только одобренное и доступное объявление.",
+        "en": "❌ Only approved, available ads can be bumped."
+    },
+    "bump_failed_refunded": {
+        "fa": "❌ ارتقای آگهی در کانال منتشر نشد و استارز شما بازگردانده شد.",
+        "ru": "❌ Не удалось опубликовать поднятое объявление в канале, звёзды возвращены.",
+        "en": "❌ The bumped ad couldn't be posted to the channel, so your Stars were refunded."
+    },
+    "bump_failed": {
+        "fa": "❌ ارتقای آگهی در کانال منتشر نشد. ادمین‌ها مطلع شدند و به زودی بررسی می‌کنند.",
+        "ru": "❌ Не удалось опубликовать поднятое объявление в канале. Администраторы уведомлены и скоро разберутся.",
+        "en": "❌ The bumped ad couldn't be posted to the channel. The admins have been notified and will look into it."
+    },
+    "ad_bumped": {
+        "fa": "🚀 آگهی شما دوباره در {channel_name} منتشر شد.",
+        "ru": "🚀 Ваше объявление снова опубликовано в {channel_name}.",
+        "en": "🚀 Your ad was posted again in {channel_name}."
     }
 }
 
@@ -620,6 +833,9 @@ def get_main_menu_keyboard(language='fa'):
                 KeyboardButton(text=get_text('new_ad_button', language)),
                 KeyboardButton(text=get_text('my_ads_button', language))
             ],
+            [
+                KeyboardButton(text=get_text('browse_button', language))
+            ],
             [
                 KeyboardButton(text=get_text('support_button', language)),
                 KeyboardButton(text=get_text('change_language_button', language))